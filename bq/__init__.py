@@ -4,11 +4,17 @@ from .models import Event
 from .models import EventModelMixin
 from .models import EventModelRefTaskMixin
 from .models import EventType
+from .models import Payload
+from .models import PayloadModelMixin
+from .models import QueueDepth
+from .models import QueueDepthModelMixin
 from .models import Task  # noqa
+from .models import TaskModelDedupMixin
 from .models import TaskModelMixin
 from .models import TaskModelRefEventMixin
 from .models import TaskModelRefParentMixin
 from .models import TaskModelRefWorkerMixin
+from .models import TaskModelTimestampsMixin
 from .models import TaskState  # noqa
 from .models import Worker  # noqa
 from .models import WorkerModelMixin  # noqa
@@ -17,3 +23,4 @@ from .models import WorkerState  # noqa
 from .processors.retry_policies import DelayRetry
 from .processors.retry_policies import ExponentialBackoffRetry
 from .processors.retry_policies import LimitAttempt
+from .utils import uuid7
@@ -1,13 +1,15 @@
+import dataclasses
+import datetime
 import functools
 import importlib
 import logging
 import platform
 import sys
 import threading
+import time
 import typing
-from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
 from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import wait as futures_wait
 from importlib.metadata import PackageNotFoundError
 from importlib.metadata import version
 
@@ -15,22 +17,55 @@ import venusian
 from sqlalchemy import func
 from sqlalchemy.engine import create_engine
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session as DBSession
-from sqlalchemy.pool import QueuePool
 from sqlalchemy.pool import SingletonThreadPool
 
 from . import constants
 from . import events
 from . import models
+from . import stats
+from .codecs import make_json_serializers
+from .completion import CompletionBuffer
 from .config import Config
+from .db.pool import TimedQueuePool
 from .db.session import SessionMaker
+from .event_sinks import BufferedEventSink
+from .event_sinks import DatabaseEventSink
+from .event_sinks import EventSink
+from .event_sinks import LogFileEventSink
+from .event_sinks import SampledEventSink
 from .metrics import MetricsServer
+from .payloads import configure_payload_store
+from .payloads import FilesystemPayloadStore
+from .payloads import PayloadStore
+from .payloads import TablePayloadStore
+from .planner import ConcurrencyPlan
+from .planner import make_concurrency_plan
+from .planner import validate_concurrency_plan
 from .processors.processor import Processor
 from .processors.processor import ProcessorHelper
 from .processors.registry import collect
+from .processors.registry import Registry
+from .retention import NDJSONWriter
+from .retention import Retention
+from .services.completion import Completion
+from .services.completion import CompletionService
+from .services.dispatch import DeferredColumnLoader
 from .services.dispatch import DispatchService
+from .services.overview import OverviewService
+from .services.partition import PartitionService
+from .services.queue_depth import QueueDepthService
+from .services.retention import CompactionRule
+from .services.retention import make_compaction_rules
+from .services.retention import make_retention_rules
+from .services.retention import RetentionService
+from .services.submit import SubmitService
+from .services.uuid7 import UUID7Service
 from .services.worker import WorkerService
 from .utils import load_module_var
+from .utils import Waker
+from .watchdog import Watchdog
 
 logger = logging.getLogger(__name__)
 
@@ -51,30 +86,49 @@ class BeanQueue:
         self._engine = engine
         self._worker_update_shutdown_event: threading.Event = threading.Event()
         self._metrics_server: MetricsServer | None = None
+        self._completion_buffer: CompletionBuffer | None = None
+        self._event_sink: EventSink | None = None
+        self._watchdog: Watchdog | None = None
+        self._retention: Retention | None = None
+        # lower bound of created_at for dispatching from the created_at partitions
+        self._dispatch_min_created_at: datetime.datetime | None = None
+        # time.monotonic() of the last successful database round trip of the heartbeat thread
+        self._last_heartbeat_at: float | None = None
+        self._thread_local = threading.local()
+        self._thread_sessions: list[DBSession] = []
+        self._thread_sessions_lock = threading.Lock()
+        if self.config.PAYLOAD_STORE is not None:
+            configure_payload_store(
+                self.make_payload_store(), threshold=self.config.PAYLOAD_THRESHOLD
+            )
+
+    @property
+    def concurrency_plan(self) -> ConcurrencyPlan:
+        return make_concurrency_plan(self.config)
 
     def create_default_engine(self):
+        plan = self.concurrency_plan
+        json_serializer, json_deserializer = make_json_serializers(
+            self.config.JSON_SERIALIZER
+        )
         # Use thread-safe connection pool when thread pool executor is enabled
-        if self.config.MAX_WORKER_THREADS != 1:
+        if plan.threaded:
             # QueuePool is thread-safe and suitable for multi-threaded usage
-            # Configure pool size based on number of worker threads
-            max_workers = (
-                self.config.MAX_WORKER_THREADS
-                if self.config.MAX_WORKER_THREADS > 0
-                else 10
-            )
-            pool_size = (
-                max_workers + 5
-            )  # Extra connections for main thread and worker update thread
             return create_engine(
                 str(self.config.DATABASE_URL),
-                poolclass=QueuePool,
-                pool_size=pool_size,
-                max_overflow=10,
+                poolclass=TimedQueuePool,
+                pool_size=plan.pool_size,
+                max_overflow=plan.pool_max_overflow,
+                json_serializer=json_serializer,
+                json_deserializer=json_deserializer,
             )
         else:
             # SingletonThreadPool for single-threaded sequential processing
             return create_engine(
-                str(self.config.DATABASE_URL), poolclass=SingletonThreadPool
+                str(self.config.DATABASE_URL),
+                poolclass=SingletonThreadPool,
+                json_serializer=json_serializer,
+                json_deserializer=json_deserializer,
             )
 
     def make_session(self) -> DBSession:
@@ -100,6 +154,26 @@ class BeanQueue:
             return
         return load_module_var(self.config.EVENT_MODEL)
 
+    @property
+    def queue_depth_model(self) -> typing.Type[models.QueueDepth]:
+        return load_module_var(self.config.QUEUE_DEPTH_MODEL)
+
+    @property
+    def payload_model(self) -> typing.Type[models.Payload]:
+        return load_module_var(self.config.PAYLOAD_MODEL)
+
+    def make_payload_store(self) -> PayloadStore:
+        """Make the payload store of PAYLOAD_STORE"""
+        if self.config.PAYLOAD_STORE == "table":
+            return TablePayloadStore(payload_model=self.payload_model)
+        elif self.config.PAYLOAD_STORE == "filesystem":
+            if self.config.PAYLOAD_STORE_PATH is None:
+                raise ValueError(
+                    "PAYLOAD_STORE_PATH is required by filesystem payload store"
+                )
+            return FilesystemPayloadStore(self.config.PAYLOAD_STORE_PATH)
+        raise ValueError(f"Invalid payload store {self.config.PAYLOAD_STORE!r}")
+
     def _make_worker_service(self, session: DBSession):
         return self.worker_service_cls(
             session=session, task_model=self.task_model, worker_model=self.worker_model
@@ -108,6 +182,198 @@ class BeanQueue:
     def _make_dispatch_service(self, session: DBSession):
         return self.dispatch_service_cls(session=session, task_model=self.task_model)
 
+    def _make_completion_service(self, session: DBSession):
+        return CompletionService(
+            session=session,
+            task_model=self.task_model,
+            event_model=self.event_model,
+            event_sink=self._event_sink,
+        )
+
+    def _make_submit_service(self, session: DBSession):
+        return SubmitService(session=session, task_model=self.task_model)
+
+    def submit(
+        self,
+        db: DBSession,
+        tasks: typing.Sequence[models.Task],
+        debounce: datetime.timedelta | None = None,
+    ) -> list[typing.Any]:
+        """Insert the tasks in bulk without committing, collapsing the ones with the dedup key of a pending task into
+        it, and return the ids of the inserted or debounced tasks
+        """
+        return self._make_submit_service(db).submit(tasks, debounce=debounce)
+
+    def make_event_sink(self) -> EventSink | None:
+        """Make the sink of COMPLETE events with the EVENT_SINK settings, None when the processors insert them along
+        with the tasks as usual
+        """
+        if self.event_model is None:
+            return None
+        if self.config.EVENT_SINK == "database":
+            if self.config.EVENT_SAMPLE_RATE >= 1:
+                return None
+            sink = DatabaseEventSink(self.event_model)
+        elif self.config.EVENT_SINK == "buffered":
+            sink = BufferedEventSink(
+                make_session=self.make_session,
+                event_model=self.event_model,
+                max_size=self.config.EVENT_SINK_BATCH_SIZE,
+                interval=self.config.EVENT_SINK_BATCH_INTERVAL,
+            )
+        elif self.config.EVENT_SINK == "logfile":
+            if self.config.EVENT_SINK_PATH is None:
+                raise ValueError("EVENT_SINK_PATH is required for logfile event sink")
+            sink = LogFileEventSink(self.config.EVENT_SINK_PATH)
+        else:
+            raise ValueError(f"Invalid event sink {self.config.EVENT_SINK!r}")
+        if self.config.EVENT_SAMPLE_RATE < 1:
+            sink = SampledEventSink(sink, rate=self.config.EVENT_SAMPLE_RATE)
+        return sink
+
+    def _process_kwargs(self) -> dict[str, typing.Any]:
+        # only pass the event sink when it's set, to keep custom registries working
+        kwargs = dict(event_cls=self.event_model)
+        if self._event_sink is not None:
+            kwargs["event_sink"] = self._event_sink
+        return kwargs
+
+    def _make_queue_depth_service(self, session: DBSession):
+        return QueueDepthService(
+            session=session,
+            task_model=self.task_model,
+            queue_depth_model=self.queue_depth_model,
+        )
+
+    def _make_uuid7_service(self, session: DBSession):
+        return UUID7Service(
+            session=session,
+            task_model=self.task_model,
+            worker_model=self.worker_model,
+            event_model=self.event_model,
+        )
+
+    def _make_overview_service(self, session: DBSession):
+        return OverviewService(
+            session=session,
+            task_model=self.task_model,
+            worker_model=self.worker_model,
+            queue_depth_model=self.queue_depth_model
+            if self.config.QUEUE_DEPTH_ENABLED
+            else None,
+        )
+
+    def _make_retention_service(self, session: DBSession):
+        return RetentionService(
+            session=session, task_model=self.task_model, event_model=self.event_model
+        )
+
+    def make_retention(
+        self, writer: NDJSONWriter | None = None, registry: Registry | None = None
+    ) -> Retention:
+        """Make the retention removing finished tasks with the RETENTION_* settings, and clearing the results and
+        kwargs of DONE tasks with the `keep_result_for` and `keep_kwargs_for` of the processors in the registry
+        """
+        return Retention(
+            self,
+            rules=make_retention_rules(
+                self.config.RETENTION_SECONDS, self.config.RETENTION_CHANNELS
+            ),
+            batch_size=self.config.RETENTION_BATCH_SIZE,
+            batch_interval=self.config.RETENTION_BATCH_INTERVAL,
+            archive_suffix=self.config.RETENTION_ARCHIVE_SUFFIX
+            if self.config.RETENTION_ARCHIVE
+            else None,
+            writer=writer,
+            compaction_rules=self._make_compaction_rules(registry)
+            if registry is not None
+            else (),
+        )
+
+    def _make_compaction_rules(self, registry: Registry) -> list[CompactionRule]:
+        return make_compaction_rules(
+            processor
+            for module_processors in registry.processors.values()
+            for func_processors in module_processors.values()
+            for processor in func_processors.values()
+        )
+
+    def _make_partition_service(self, session: DBSession):
+        return PartitionService(
+            session=session, task_model=self.task_model, event_model=self.event_model
+        )
+
+    def _compact_queue_depth(self, db: DBSession):
+        try:
+            if self._make_queue_depth_service(db).compact():
+                logger.debug("Compacted queue depth counters")
+            db.commit()
+        except DBAPIError:
+            # most likely a deadlock or lock timeout with the triggers, the shards are compacted next time
+            logger.warning("Failed to compact queue depth counters", exc_info=True)
+            db.rollback()
+
+    def _maintain_partitions(self, db: DBSession):
+        partition_service = self._make_partition_service(db)
+        try:
+            partition_service.maintain(
+                interval=self.config.PARTITION_INTERVAL,
+                premake=self.config.PARTITION_PREMAKE,
+                retention=datetime.timedelta(
+                    seconds=self.config.PARTITION_RETENTION_SECONDS
+                )
+                if self.config.PARTITION_RETENTION_SECONDS is not None
+                else None,
+                detach_only=self.config.PARTITION_DETACH_ONLY,
+            )
+            db.commit()
+        except DBAPIError:
+            # most likely lock timeout because of other long running queries, try again next time
+            logger.warning("Failed to maintain partitions", exc_info=True)
+            db.rollback()
+        try:
+            self._dispatch_min_created_at = partition_service.get_min_created_at()
+            db.commit()
+        except DBAPIError:
+            logger.warning("Failed to find the active partitions", exc_info=True)
+            db.rollback()
+            # dispatch from all the partitions until we know
+            self._dispatch_min_created_at = None
+
+    def _dispatch_kwargs(self, defer_kwargs: bool = False) -> dict[str, typing.Any]:
+        # only pass the options when they are set, to keep custom dispatch services working
+        kwargs = {}
+        if defer_kwargs:
+            kwargs["defer_kwargs"] = True
+        if self._dispatch_min_created_at is not None:
+            kwargs["min_created_at"] = self._dispatch_min_created_at
+        if self.config.DISPATCH_ORDER_BY_ID:
+            kwargs["order_by_id"] = True
+        return kwargs
+
+    def install_queue_depth(self):
+        """Install the triggers maintaining the queue depth counters and count the existing tasks"""
+        with self.make_session() as db:
+            self._make_queue_depth_service(db).install(
+                shards=self.config.QUEUE_DEPTH_SHARDS
+            )
+            db.commit()
+
+    def install_uuid7(self):
+        """Install the function generating UUIDv7 and make it the default of the id columns"""
+        with self.make_session() as db:
+            self._make_uuid7_service(db).install()
+            db.commit()
+
+    def queue_depth(
+        self, channels: typing.Sequence[str] | None = None
+    ) -> dict[str, dict[models.TaskState, int]]:
+        """Get the number of tasks per channel and state from the counters, requires QUEUE_DEPTH_ENABLED"""
+        if not self.config.QUEUE_DEPTH_ENABLED:
+            raise ValueError("Queue depth counters are not enabled")
+        with self.make_session() as db:
+            return self._make_queue_depth_service(db).get_depth(channels)
+
     def processor(
         self,
         channel: str = constants.DEFAULT_CHANNEL,
@@ -115,6 +381,12 @@ class BeanQueue:
         retry_policy: typing.Callable | None = None,
         retry_exceptions: typing.Type | typing.Tuple[typing.Type, ...] | None = None,
         task_model: typing.Type | None = None,
+        isolation: str | None = None,
+        slow_threshold: float | None = None,
+        codec: str | None = None,
+        stream_payload: bool = False,
+        keep_result_for: float | None = None,
+        keep_kwargs_for: float | None = None,
     ) -> typing.Callable:
         def decorator(wrapped: typing.Callable):
             processor = Processor(
@@ -125,6 +397,12 @@ class BeanQueue:
                 auto_complete=auto_complete,
                 retry_policy=retry_policy,
                 retry_exceptions=retry_exceptions,
+                isolation=isolation,
+                slow_threshold=slow_threshold,
+                codec=codec,
+                stream_payload=stream_payload,
+                keep_result_for=keep_result_for,
+                keep_kwargs_for=keep_kwargs_for,
             )
             helper_obj = ProcessorHelper(
                 processor,
@@ -181,6 +459,12 @@ class BeanQueue:
             if found_dead_worker:
                 db.commit()
 
+            if self.config.QUEUE_DEPTH_ENABLED:
+                self._compact_queue_depth(db)
+            if self.config.PARTITION_BY == "created_at":
+                self._maintain_partitions(db)
+            self._last_heartbeat_at = time.monotonic()
+
             if current_worker.state != models.WorkerState.RUNNING:
                 # This probably means we are somehow very slow to update the heartbeat in time, or the timeout window
                 # is set too short. It could also be the administrator update the worker state to something else than
@@ -202,20 +486,44 @@ class BeanQueue:
             db.add(current_worker)
             db.commit()
 
+    def _get_thread_session(self) -> DBSession:
+        """Get the long-lived database session of the current worker thread, create one if not exists."""
+        db = getattr(self._thread_local, "session", None)
+        if db is None:
+            db = self.make_session()
+            self._thread_local.session = db
+            with self._thread_sessions_lock:
+                self._thread_sessions.append(db)
+        return db
+
+    def _close_thread_sessions(self):
+        with self._thread_sessions_lock:
+            thread_sessions = self._thread_sessions
+            self._thread_sessions = []
+        for db in thread_sessions:
+            db.close()
+
     def _process_task_in_thread(
         self,
-        task_id: typing.Any,
+        task: models.Task,
         registry: typing.Any,
+        kwargs_loader: DeferredColumnLoader | None = None,
     ):
-        """Process a single task in a thread-safe manner with its own database session.
+        """Process a single task in a thread-safe manner with the thread's own database session.
 
-        This method is called from worker threads in the thread pool. It creates its own
-        database session to avoid SQLAlchemy session conflicts between threads.
+        This method is called from worker threads in the thread pool. Each thread keeps its own
+        long-lived database session to avoid SQLAlchemy session conflicts between threads. The
+        claimed task is passed in as a detached object, and merged into the thread's session
+        without querying the database again.
+
+        :param kwargs_loader: loader of the kwargs of the batch when they are deferred by dispatch
         """
-        db = self.make_session()
+        db = self._get_thread_session()
+        task_id = task.id
         try:
-            # Reload the task in this thread's session to avoid SQLAlchemy context issues
-            task = db.query(self.task_model).filter(self.task_model.id == task_id).one()
+            task = db.merge(task, load=False)
+            if kwargs_loader is not None:
+                kwargs_loader.apply(db, task)
 
             logger.info(
                 "Processing task %s, channel=%s, module=%s, func=%s",
@@ -224,14 +532,54 @@ class BeanQueue:
                 task.module,
                 task.func_name,
             )
-            registry.process(task, event_cls=self.event_model)
+            registry.process(task, **self._process_kwargs())
+            if self._should_buffer_completion(task, registry):
+                completion = Completion(
+                    task_id=task.id,
+                    result=task.result,
+                    started_at=getattr(task, "started_at", None),
+                    finished_at=getattr(task, "finished_at", None),
+                )
+                # discard the changes in the session, the buffer writes them for us
+                db.rollback()
+                self._completion_buffer.add(completion)
+                return
             db.commit()
         except Exception as e:
             logger.exception("Error processing task %s: %s", task_id, e)
             db.rollback()
             raise
         finally:
-            db.close()
+            # Objects are usually released from the identity map once they are committed, as it only keeps
+            # weak references to them. But in case the processors hold them, make sure it won't grow unbounded.
+            if len(db.identity_map) > self.config.THREAD_SESSION_IDENTITY_MAP_LIMIT:
+                logger.debug(
+                    "Thread session identity map size %s exceeds limit %s, expunge all",
+                    len(db.identity_map),
+                    self.config.THREAD_SESSION_IDENTITY_MAP_LIMIT,
+                )
+                db.expunge_all()
+
+    def _should_buffer_completion(self, task: models.Task, registry: typing.Any):
+        if self._completion_buffer is None:
+            return False
+        if task.state != models.TaskState.DONE:
+            return False
+        processor = registry.get(task)
+        return (
+            processor is not None
+            and processor.auto_complete
+            and processor.resolved_isolation == "none"
+            # the buffer only writes the results
+            and processor.keep_kwargs_for != 0
+        )
+
+    @staticmethod
+    def _record_thread_utilization(plan: ConcurrencyPlan, busy_threads: int):
+        stats.stats.set(stats.WORKER_THREADS_BUSY, busy_threads)
+        stats.stats.set(
+            stats.WORKER_THREADS_UTILIZATION, busy_threads / plan.worker_threads
+        )
 
     def _process_tasks_sequential(
         self,
@@ -242,12 +590,14 @@ class BeanQueue:
         worker_id: typing.Any,
     ):
         """Process tasks sequentially (original behavior for MAX_WORKER_THREADS=1)."""
+        plan = self.concurrency_plan
         while True:
             while True:
                 tasks = dispatch_service.dispatch(
                     channels,
                     worker_id=worker_id,
-                    limit=self.config.BATCH_SIZE,
+                    limit=plan.prefetch,
+                    **self._dispatch_kwargs(),
                 ).all()
 
                 for task in tasks:
@@ -258,7 +608,7 @@ class BeanQueue:
                         task.module,
                         task.func_name,
                     )
-                    registry.process(task, event_cls=self.event_model)
+                    registry.process(task, **self._process_kwargs())
                 if tasks:
                     db.commit()
 
@@ -280,91 +630,124 @@ class BeanQueue:
         db: DBSession,
         executor: ThreadPoolExecutor,
         dispatch_service: DispatchService,
+        listen_service: DispatchService,
         registry: typing.Any,
         channels: tuple[str, ...],
         worker_id: typing.Any,
     ):
         """Process tasks using thread pool with continuous task feeding.
 
-        This implementation continuously checks for completed futures and fetches new tasks
-        when there's capacity in the thread pool. It uses concurrent.futures.wait() to
-        properly detect ANY completed future, not just the first one submitted.
+        The loop is driven by a single waker, woken up by the completion callbacks of the futures,
+        and waited together with the notifications of the listened channels. The database is only
+        queried for new tasks when there might be new tasks and there's capacity for them, namely,
+        after a notification arrives, POLL_TIMEOUT after the last dispatch (for scheduled tasks and
+        retries, which don't notify), or when the last dispatch was limited by capacity instead of
+        running out of tasks.
+
+        :param listen_service: dispatch service with a dedicated connection for LISTEN and polling
         """
-        max_workers = self.config.MAX_WORKER_THREADS
-        if max_workers == 0:
-            max_workers = 10  # Default when set to auto
+        plan = self.concurrency_plan
+        running_futures: set[Future] = set()
+        waker = Waker()
+        # Whether there might be tasks ready to be dispatched
+        has_pending_tasks = True
+        # When to dispatch again anyway, the wakeups by completions don't push it back
+        redispatch_at = time.monotonic()
 
-        running_futures: set = set()
+        def on_future_done(_future: Future):
+            waker.wake()
 
-        while True:
-            # Clean up ANY completed futures using wait() with zero timeout
-            if running_futures:
-                done, running_futures = futures_wait(
-                    running_futures, timeout=0, return_when=FIRST_COMPLETED
-                )
+        try:
+            while True:
+                done = [f for f in running_futures if f.done()]
                 for f in done:
+                    running_futures.remove(f)
                     try:
                         f.result()
                     except Exception as e:
                         logger.error("Task processing failed: %s", e)
+                self._record_thread_utilization(plan, len(running_futures))
+
+                # If we have capacity, fetch and submit more tasks
+                capacity = plan.max_in_flight - len(running_futures)
+                if capacity > 0 and has_pending_tasks:
+                    limit = min(capacity, plan.prefetch)
+                    tasks = dispatch_service.dispatch(
+                        channels,
+                        worker_id=worker_id,
+                        limit=limit,
+                        **self._dispatch_kwargs(
+                            defer_kwargs=self.config.DISPATCH_DEFER_KWARGS
+                        ),
+                    ).all()
+                    # Detach the claimed tasks before commit expires them, so that their loaded data can be
+                    # passed to the worker threads
+                    for task in tasks:
+                        db.expunge(task)
 
-            # If we have capacity, fetch and submit more tasks
-            capacity = max_workers - len(running_futures)
-            if capacity > 0:
-                tasks = dispatch_service.dispatch(
-                    channels,
-                    worker_id=worker_id,
-                    limit=min(capacity, self.config.BATCH_SIZE),
-                ).all()
-
-                # Always commit to close the transaction and refresh the snapshot,
-                # so subsequent dispatch calls can see newly committed tasks
-                db.commit()
-
-                if tasks:
-                    logger.debug(
-                        "Dispatching %d tasks (running=%d, capacity=%d)",
-                        len(tasks),
-                        len(running_futures),
-                        capacity,
-                    )
+                    # Always commit to close the transaction and refresh the snapshot,
+                    # so subsequent dispatch calls can see newly committed tasks
+                    db.commit()
 
-                    for task in tasks:
-                        future = executor.submit(
-                            self._process_task_in_thread,
-                            task.id,
-                            registry,
+                    # Getting fewer tasks than we asked for means we have run out of them for now
+                    has_pending_tasks = len(tasks) == limit
+                    redispatch_at = time.monotonic() + self.config.POLL_TIMEOUT
+                    if tasks:
+                        logger.debug(
+                            "Dispatching %d tasks (running=%d, capacity=%d)",
+                            len(tasks),
+                            len(running_futures),
+                            capacity,
                         )
-                        running_futures.add(future)
-
-            # If we have running tasks, wait briefly for any to complete then check for new tasks
-            if running_futures:
-                # Short wait - allows checking for new tasks frequently
-                done, running_futures = futures_wait(
-                    running_futures, timeout=0.05, return_when=FIRST_COMPLETED
-                )
-                for f in done:
-                    try:
-                        f.result()
-                    except Exception as e:
-                        logger.error("Task processing failed: %s", e)
-                continue
 
-            # No running tasks and no new tasks found - poll for notifications
-            db.close()
-            try:
-                for notification in dispatch_service.poll(
-                    timeout=self.config.POLL_TIMEOUT
-                ):
-                    logger.debug("Receive notification %s", notification)
-            except TimeoutError:
-                logger.debug("Poll timeout, try again")
-                continue
+                        process_task = self._process_task_in_thread
+                        if self.config.DISPATCH_DEFER_KWARGS:
+                            process_task = functools.partial(
+                                process_task,
+                                kwargs_loader=DeferredColumnLoader(
+                                    self.task_model,
+                                    "kwargs",
+                                    [task.id for task in tasks],
+                                ),
+                            )
+                        for task in tasks:
+                            future = executor.submit(process_task, task, registry)
+                            running_futures.add(future)
+                            future.add_done_callback(on_future_done)
+                        self._record_thread_utilization(plan, len(running_futures))
+                    if has_pending_tasks and capacity > len(tasks):
+                        continue
+
+                # Wait for any running task to finish, or new tasks to be announced
+                timeout = self.config.POLL_TIMEOUT
+                if not has_pending_tasks:
+                    timeout = redispatch_at - time.monotonic()
+                    if timeout <= 0:
+                        # scheduled tasks may be ready now
+                        has_pending_tasks = True
+                        continue
+                try:
+                    for notification in listen_service.poll(
+                        timeout=timeout, waker=waker
+                    ):
+                        logger.debug("Receive notification %s", notification)
+                        has_pending_tasks = True
+                except TimeoutError:
+                    logger.debug("Poll timeout, try again")
+                    # scheduled tasks may be ready now
+                    has_pending_tasks = True
+        finally:
+            waker.close()
 
     def process_tasks(
         self,
         channels: tuple[str, ...],
+        registry: Registry | None = None,
     ):
+        """Process tasks of the given channels until interrupted
+
+        :param registry: registry of the processors to use, scan PROCESSOR_PACKAGES for processors if not provided
+        """
         try:
             bq_version = version("beanqueue")
         except PackageNotFoundError:
@@ -374,17 +757,34 @@ class BeanQueue:
             "Starting processing tasks, bq_version=%s",
             bq_version,
         )
+        plan = self.concurrency_plan
+        logger.info(
+            "Concurrency plan: worker_threads=%s, max_in_flight=%s, prefetch=%s, pool_size=%s, pool_max_overflow=%s",
+            plan.worker_threads,
+            plan.max_in_flight,
+            plan.prefetch,
+            plan.pool_size,
+            plan.pool_max_overflow,
+        )
+        for setting, value in dataclasses.asdict(plan).items():
+            stats.stats.set(
+                stats.CONCURRENCY_PLAN, value if value is not None else 0, (setting,)
+            )
         db = self.make_session()
+        if self.config.VALIDATE_CONCURRENCY_PLAN:
+            validate_concurrency_plan(plan, db)
+            db.commit()
         if not channels:
             channels = [constants.DEFAULT_CHANNEL]
 
-        if not self.config.PROCESSOR_PACKAGES:
-            logger.error("No PROCESSOR_PACKAGES provided")
-            raise ValueError("No PROCESSOR_PACKAGES provided")
+        if registry is None:
+            if not self.config.PROCESSOR_PACKAGES:
+                logger.error("No PROCESSOR_PACKAGES provided")
+                raise ValueError("No PROCESSOR_PACKAGES provided")
 
-        logger.info("Scanning packages %s", self.config.PROCESSOR_PACKAGES)
-        pkgs = list(map(importlib.import_module, self.config.PROCESSOR_PACKAGES))
-        registry = collect(pkgs)
+            logger.info("Scanning packages %s", self.config.PROCESSOR_PACKAGES)
+            pkgs = list(map(importlib.import_module, self.config.PROCESSOR_PACKAGES))
+            registry = collect(pkgs)
         for channel, module_processors in registry.processors.items():
             logger.info("Collected processors with channel %r", channel)
             for module, func_processors in module_processors.items():
@@ -402,9 +802,44 @@ class BeanQueue:
 
         worker = work_service.make_worker(name=platform.node(), channels=channels)
         db.add(worker)
-        dispatch_service.listen(channels)
+        listen_connection = None
+        listen_service = None
+        if plan.threaded:
+            # The main session checks out different connections from the pool from time to time in threaded
+            # mode, keep a dedicated connection for LISTEN, so that we won't miss any notification
+            listen_connection = self.engine.connect()
+            listen_db = self.session_cls(bind=listen_connection)
+            listen_service = self._make_dispatch_service(listen_db)
+            listen_service.listen(channels)
+            listen_db.commit()
+        else:
+            dispatch_service.listen(channels)
         db.commit()
 
+        if self.config.SLOW_TASK_THRESHOLD is not None or any(
+            processor.slow_threshold is not None
+            for module_processors in registry.processors.values()
+            for func_processors in module_processors.values()
+            for processor in func_processors.values()
+        ):
+            self._watchdog = Watchdog(
+                default_slow_threshold=self.config.SLOW_TASK_THRESHOLD,
+                interval=self.config.WATCHDOG_INTERVAL,
+            )
+            self._watchdog.start()
+            logger.info(
+                "Started watchdog with slow_task_threshold=%s, interval=%s",
+                self.config.SLOW_TASK_THRESHOLD,
+                self.config.WATCHDOG_INTERVAL,
+            )
+
+        if self.config.RETENTION_INTERVAL is not None:
+            self._retention = self.make_retention(registry=registry)
+            self._retention.start(self.config.RETENTION_INTERVAL)
+            logger.info(
+                "Started retention with interval=%s", self.config.RETENTION_INTERVAL
+            )
+
         if self.config.METRICS_HTTP_SERVER_ENABLED:
             self._metrics_server = MetricsServer(self, worker.id)
             self._metrics_server.start()
@@ -426,18 +861,38 @@ class BeanQueue:
 
         worker_id = worker.id
 
-        # Determine the number of worker threads
-        max_workers = self.config.MAX_WORKER_THREADS
-        if max_workers == 0:
-            max_workers = None  # Default to (num_cpus * 5)
+        self._event_sink = self.make_event_sink()
+        if self._event_sink is not None:
+            self._event_sink.start()
+            logger.info(
+                "Started event sink %s with sample_rate=%s",
+                self.config.EVENT_SINK,
+                self.config.EVENT_SAMPLE_RATE,
+            )
 
         # Create thread pool executor for concurrent task processing
         executor = None
-        if max_workers != 1:
+        if plan.threaded:
             executor = ThreadPoolExecutor(
-                max_workers=max_workers, thread_name_prefix="task_worker"
+                max_workers=plan.worker_threads, thread_name_prefix="task_worker"
             )
-            logger.info("Created thread pool executor with max_workers=%s", max_workers)
+            logger.info(
+                "Created thread pool executor with max_workers=%s", plan.worker_threads
+            )
+            if self.config.COMPLETION_BATCH_ENABLED:
+                self._completion_buffer = CompletionBuffer(
+                    make_session=self.make_session,
+                    make_service=self._make_completion_service,
+                    worker_id=worker_id,
+                    max_size=self.config.COMPLETION_BATCH_SIZE,
+                    interval=self.config.COMPLETION_BATCH_INTERVAL,
+                )
+                self._completion_buffer.start()
+                logger.info(
+                    "Started completion buffer with max_size=%s, interval=%s",
+                    self.config.COMPLETION_BATCH_SIZE,
+                    self.config.COMPLETION_BATCH_INTERVAL,
+                )
 
         try:
             if executor is not None:
@@ -446,6 +901,7 @@ class BeanQueue:
                     db=db,
                     executor=executor,
                     dispatch_service=dispatch_service,
+                    listen_service=listen_service,
                     registry=registry,
                     channels=channels,
                     worker_id=worker_id,
@@ -468,11 +924,28 @@ class BeanQueue:
                 logger.info("Shutting down thread pool executor...")
                 executor.shutdown(wait=True, cancel_futures=False)
                 logger.info("Thread pool executor shutdown complete")
+                self._close_thread_sessions()
+
+            if self._completion_buffer is not None:
+                logger.info("Writing buffered completions ...")
+                self._completion_buffer.shutdown()
+
+            # after the completion buffer, as it records the events of the completions
+            if self._event_sink is not None:
+                logger.info("Shutting down event sink ...")
+                self._event_sink.shutdown()
 
             self._worker_update_shutdown_event.set()
             worker_update_thread.join(5)
+            if self._watchdog is not None:
+                self._watchdog.shutdown()
+            if self._retention is not None:
+                self._retention.shutdown()
             if self._metrics_server is not None:
                 self._metrics_server.shutdown()
+            if listen_connection is not None:
+                listen_service.session.close()
+                listen_connection.close()
 
         worker.state = models.WorkerState.SHUTDOWN
         db.add(worker)
@@ -0,0 +1,3 @@
+from .runner import Benchmark
+from .runner import BenchmarkResult
+from .runner import BenchmarkSettings
@@ -0,0 +1,52 @@
+import time
+import typing
+
+from ..processors.processor import Processor
+from ..processors.registry import Registry
+
+
+# The benchmark runner passes the time it submitted the task as `submitted` and the workers run on the same
+# host, so that all the timings come from one clock instead of comparing the worker clock with the database one
+def _timings(submitted: float, started: float) -> dict[str, float]:
+    return dict(submitted=submitted, started=started, finished=time.time())
+
+
+def noop(submitted: float) -> dict[str, float]:
+    started = time.time()
+    return _timings(submitted, started)
+
+
+def sleep(submitted: float, seconds: float) -> dict[str, float]:
+    started = time.time()
+    time.sleep(seconds)
+    return _timings(submitted, started)
+
+
+def burn(submitted: float, iterations: int) -> dict[str, float]:
+    started = time.time()
+    value = 0
+    for index in range(iterations):
+        value += index * index
+    return _timings(submitted, started)
+
+
+WORKLOADS: dict[str, typing.Callable] = {
+    "noop": noop,
+    "sleep": sleep,
+    "burn": burn,
+}
+
+
+def make_registry(channel: str) -> Registry:
+    """Make a registry with the benchmark processors registered to the given channel"""
+    registry = Registry()
+    for func in WORKLOADS.values():
+        registry.add(
+            Processor(
+                channel=channel,
+                module=__name__,
+                name=func.__name__,
+                func=func,
+            )
+        )
+    return registry
@@ -0,0 +1,337 @@
+import dataclasses
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import time
+import typing
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from . import processors
+from .. import models
+from ..app import BeanQueue
+from ..config import Config
+from ..utils import uuid7
+
+logger = logging.getLogger(__name__)
+
+# Number of tasks to insert per transaction when submitting
+SUBMIT_BATCH_SIZE = 1000
+
+
+@dataclasses.dataclass(frozen=True)
+class BenchmarkSettings:
+    # number of tasks to submit
+    tasks: int = 1000
+    # number of worker processes
+    workers: int = 1
+    # BATCH_SIZE of the workers
+    batch_size: int = 1
+    # MAX_WORKER_THREADS of the workers
+    threads: int = 1
+    # one of noop, sleep or burn
+    workload: str = "noop"
+    # seconds to sleep for each task of the sleep workload
+    sleep_seconds: float = 0.01
+    # number of loop iterations for each task of the burn workload
+    burn_iterations: int = 10_000
+    # seconds to wait for the workers to finish all the tasks
+    timeout: float = 600
+    # keep submitting tasks for this many seconds to measure the sustained throughput, the number of tasks is
+    # the backlog to keep topped up then. None means submitting the tasks only once
+    duration: float | None = None
+    # seconds of each throughput window while running for a duration
+    report_interval: float = 60
+
+
+@dataclasses.dataclass(frozen=True)
+class BenchmarkResult:
+    settings: BenchmarkSettings
+    # number of tasks processed
+    done: int
+    # number of tasks failed
+    failed: int
+    # seconds between the first task submitted and the last task finished
+    elapsed: float
+    # tasks processed per second
+    throughput: float
+    # seconds between tasks submitted and their processor functions started
+    enqueue_to_start_p50: float
+    enqueue_to_start_p99: float
+    # seconds between tasks submitted and their processor functions finished
+    enqueue_to_finish_p50: float
+    enqueue_to_finish_p99: float
+    # tasks finished per second of each report interval, only when running for a duration
+    throughput_windows: list[float] = dataclasses.field(default_factory=list)
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        """Return the result as a JSON compatible dict, with None for the NaN values of a run without done tasks"""
+        return {
+            key: None if isinstance(value, float) and math.isnan(value) else value
+            for key, value in dataclasses.asdict(self).items()
+        }
+
+
+def percentile(values: typing.Sequence[float], percent: float) -> float:
+    """Nearest-rank percentile of the values"""
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def run_worker(config: Config, channel: str):
+    app = BeanQueue(config=config)
+    app.process_tasks(channels=(channel,), registry=processors.make_registry(channel))
+
+
+def make_worker_config(config: Config, settings: BenchmarkSettings) -> Config:
+    return config.model_copy(
+        update=dict(
+            BATCH_SIZE=settings.batch_size,
+            MAX_WORKER_THREADS=settings.threads,
+            METRICS_HTTP_SERVER_ENABLED=False,
+        )
+    )
+
+
+def make_task_kwargs(settings: BenchmarkSettings) -> dict[str, typing.Any]:
+    if settings.workload == "sleep":
+        return dict(seconds=settings.sleep_seconds)
+    elif settings.workload == "burn":
+        return dict(iterations=settings.burn_iterations)
+    return {}
+
+
+class Benchmark:
+    """Run the benchmark processors with worker processes against the database of the app, in a channel of its own
+    so that it won't interfere with other tasks. The tasks, events and workers of the channel are deleted afterward
+    unless `cleanup` is False.
+    """
+
+    def __init__(self, app: BeanQueue, cleanup: bool = True):
+        self.app = app
+        self.cleanup = cleanup
+
+    def _wait_workers(self, channel: str, count: int, timeout: float):
+        worker_model = self.app.worker_model
+        deadline = time.monotonic() + timeout
+        with self.app.make_session() as db:
+            while True:
+                running = db.scalar(
+                    select(func.count())
+                    .select_from(worker_model)
+                    .where(worker_model.channels.contains([channel]))
+                    .where(worker_model.state == models.WorkerState.RUNNING)
+                )
+                if running >= count:
+                    return
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"Only {running} of {count} workers started in time"
+                    )
+                time.sleep(0.1)
+
+    def _submit(self, channel: str, settings: BenchmarkSettings, count: int):
+        task_model = self.app.task_model
+        kwargs = make_task_kwargs(settings)
+        with self.app.make_session() as db:
+            for offset in range(0, count, SUBMIT_BATCH_SIZE):
+                batch_count = min(SUBMIT_BATCH_SIZE, count - offset)
+                # stamp the submit time with the clock of this host, the same one the workers use
+                batch_kwargs = dict(kwargs, submitted=time.time())
+                rows = [
+                    dict(
+                        channel=channel,
+                        module=processors.__name__,
+                        func_name=settings.workload,
+                        kwargs=batch_kwargs,
+                    )
+                    for _ in range(batch_count)
+                ]
+                if self.app.config.UUID7_IDS:
+                    # generate the ids on the client, they are ordered and known before inserting
+                    for row in rows:
+                        row["id"] = uuid7()
+                db.execute(task_model.__table__.insert(), rows)
+                # bulk insert skips the ORM events, notify the workers ourselves
+                self.app._make_dispatch_service(db).notify([channel])
+                db.commit()
+
+    def _count_active(self, channel: str) -> int:
+        task_model = self.app.task_model
+        with self.app.make_session() as db:
+            return db.scalar(
+                select(func.count())
+                .select_from(task_model)
+                .where(task_model.channel == channel)
+                .where(
+                    task_model.state.in_(
+                        [models.TaskState.PENDING, models.TaskState.PROCESSING]
+                    )
+                )
+            )
+
+    def _soak(
+        self, channel: str, settings: BenchmarkSettings
+    ) -> tuple[int, list[float]]:
+        """Keep the backlog of the channel topped up for the duration, returns the number of submitted tasks and
+        the throughput of each report interval. Counting the active tasks only keeps it cheap as the finished
+        tasks pile up.
+        """
+        submitted = 0
+        windows = []
+        start = time.monotonic()
+        window_start = start
+        window_done = 0
+        while True:
+            now = time.monotonic()
+            active = self._count_active(channel)
+            done = submitted - active
+            if now - window_start >= settings.report_interval:
+                throughput = (done - window_done) / (now - window_start)
+                windows.append(throughput)
+                logger.info(
+                    "Processed %s tasks in the last %.1f seconds, %.1f tasks/s",
+                    done - window_done,
+                    now - window_start,
+                    throughput,
+                )
+                window_start = now
+                window_done = done
+            if now - start >= settings.duration:
+                return submitted, windows
+            # top up once half of the backlog is consumed to submit in batches
+            if active <= settings.tasks // 2:
+                self._submit(channel, settings, settings.tasks - active)
+                submitted += settings.tasks - active
+            time.sleep(min(0.1, settings.report_interval))
+
+    def _wait_tasks(self, channel: str, settings: BenchmarkSettings, count: int):
+        task_model = self.app.task_model
+        deadline = time.monotonic() + settings.timeout
+        with self.app.make_session() as db:
+            while True:
+                finished = db.scalar(
+                    select(func.count())
+                    .select_from(task_model)
+                    .where(task_model.channel == channel)
+                    .where(
+                        task_model.state.in_(
+                            [models.TaskState.DONE, models.TaskState.FAILED]
+                        )
+                    )
+                )
+                if finished >= count:
+                    return
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"Only {finished} of {count} tasks finished in time"
+                    )
+                time.sleep(0.1)
+
+    def _collect(
+        self,
+        channel: str,
+        settings: BenchmarkSettings,
+        throughput_windows: list[float] | None = None,
+    ) -> BenchmarkResult:
+        task_model = self.app.task_model
+        with self.app.make_session() as db:
+            rows = db.execute(
+                select(task_model.state, task_model.result).where(
+                    task_model.channel == channel
+                )
+            ).all()
+        to_start = []
+        to_finish = []
+        first_submitted = math.inf
+        last_finished = -math.inf
+        failed = 0
+        for state, result in rows:
+            if state != models.TaskState.DONE:
+                failed += 1
+                continue
+            # all the timings come from the host clock, not the database one, see processors
+            submitted = result["submitted"]
+            first_submitted = min(first_submitted, submitted)
+            last_finished = max(last_finished, result["finished"])
+            to_start.append(result["started"] - submitted)
+            to_finish.append(result["finished"] - submitted)
+        done = len(to_finish)
+        elapsed = last_finished - first_submitted if done else math.nan
+        return BenchmarkResult(
+            settings=settings,
+            done=done,
+            failed=failed,
+            elapsed=elapsed,
+            throughput=done / elapsed if done and elapsed > 0 else math.nan,
+            enqueue_to_start_p50=percentile(to_start, 50),
+            enqueue_to_start_p99=percentile(to_start, 99),
+            enqueue_to_finish_p50=percentile(to_finish, 50),
+            enqueue_to_finish_p99=percentile(to_finish, 99),
+            throughput_windows=throughput_windows or [],
+        )
+
+    def _delete(self, channel: str):
+        task_model = self.app.task_model
+        worker_model = self.app.worker_model
+        event_model = self.app.event_model
+        with self.app.make_session() as db:
+            task_ids = select(task_model.id).where(task_model.channel == channel)
+            if event_model is not None:
+                db.execute(
+                    event_model.__table__.delete().where(
+                        event_model.task_id.in_(task_ids)
+                    )
+                )
+            db.execute(
+                task_model.__table__.delete().where(task_model.channel == channel)
+            )
+            db.execute(
+                worker_model.__table__.delete().where(
+                    worker_model.channels.contains([channel])
+                )
+            )
+            db.commit()
+
+    def run(self, settings: BenchmarkSettings) -> BenchmarkResult:
+        if settings.workload not in processors.WORKLOADS:
+            raise ValueError(
+                f"Invalid workload {settings.workload!r}, should be one of {list(processors.WORKLOADS)}"
+            )
+        channel = f"bq-bench-{uuid.uuid4().hex[:12]}"
+        config = make_worker_config(self.app.config, settings)
+        logger.info("Run benchmark %s in channel %s", settings, channel)
+        procs = [
+            multiprocessing.Process(target=run_worker, args=(config, channel))
+            for _ in range(settings.workers)
+        ]
+        for proc in procs:
+            proc.start()
+        try:
+            self._wait_workers(channel, settings.workers, timeout=60)
+            if settings.duration is None:
+                self._submit(channel, settings, settings.tasks)
+                self._wait_tasks(channel, settings, settings.tasks)
+                return self._collect(channel, settings)
+            submitted, windows = self._soak(channel, settings)
+            self._wait_tasks(channel, settings, submitted)
+            return self._collect(channel, settings, throughput_windows=windows)
+        finally:
+            for proc in procs:
+                if proc.pid is not None and proc.is_alive():
+                    # shutdown gracefully with KeyboardInterrupt
+                    os.kill(proc.pid, signal.SIGINT)
+            for proc in procs:
+                proc.join(10)
+                if proc.is_alive():
+                    proc.kill()
+                    proc.join()
+            if self.cleanup:
+                self._delete(channel)
@@ -0,0 +1,100 @@
+import importlib
+import typing
+
+import click
+
+from ..processors.registry import collect
+from ..retention import NDJSONWriter
+from ..retention import Retention
+from ..services.retention import make_retention_rules
+from .cli import cli
+from .environment import Environment
+from .environment import pass_env
+
+
+@cli.command(
+    name="archive",
+    help="Remove finished tasks and their events past the retention (RETENTION_SECONDS and RETENTION_CHANNELS), "
+    "and clear the results and kwargs of DONE tasks past the keep_result_for and keep_kwargs_for of the "
+    "processors in PROCESSOR_PACKAGES",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("a"),
+    help="Append the removed rows to this file as newline delimited JSON",
+)
+@click.option(
+    "--archive-tables/--no-archive-tables",
+    default=None,
+    help="Move the removed rows into archive tables, defaults to RETENTION_ARCHIVE",
+)
+@click.option(
+    "--seconds",
+    type=int,
+    help="Retention seconds of the channels without their own, defaults to RETENTION_SECONDS",
+)
+@click.option(
+    "--batch-size", type=int, help="Tasks per batch, defaults to RETENTION_BATCH_SIZE"
+)
+@click.option(
+    "--batch-interval",
+    type=float,
+    help="Seconds to pause between batches, defaults to RETENTION_BATCH_INTERVAL",
+)
+@pass_env
+def archive(
+    env: Environment,
+    output: typing.TextIO | None,
+    archive_tables: bool | None,
+    seconds: int | None,
+    batch_size: int | None,
+    batch_interval: float | None,
+):
+    config = env.app.config
+    if archive_tables is None:
+        archive_tables = config.RETENTION_ARCHIVE
+    rules = make_retention_rules(
+        seconds if seconds is not None else config.RETENTION_SECONDS,
+        config.RETENTION_CHANNELS,
+    )
+    compaction_rules = []
+    if config.PROCESSOR_PACKAGES:
+        # the keep_result_for and keep_kwargs_for are only known from the processors
+        registry = collect(
+            list(map(importlib.import_module, config.PROCESSOR_PACKAGES))
+        )
+        compaction_rules = env.app._make_compaction_rules(registry)
+    if not rules and not compaction_rules:
+        raise click.UsageError(
+            "No retention configured, set RETENTION_SECONDS, RETENTION_CHANNELS or --seconds, "
+            "or processors with keep_result_for or keep_kwargs_for in PROCESSOR_PACKAGES"
+        )
+    if archive_tables:
+        with env.app.make_session() as db:
+            env.app._make_retention_service(db).create_archive_tables(
+                config.RETENTION_ARCHIVE_SUFFIX
+            )
+            db.commit()
+    retention = Retention(
+        env.app,
+        rules=rules,
+        batch_size=batch_size
+        if batch_size is not None
+        else config.RETENTION_BATCH_SIZE,
+        batch_interval=batch_interval
+        if batch_interval is not None
+        else config.RETENTION_BATCH_INTERVAL,
+        archive_suffix=config.RETENTION_ARCHIVE_SUFFIX if archive_tables else None,
+        writer=NDJSONWriter(output) if output is not None else None,
+        compaction_rules=compaction_rules,
+    )
+    counts = retention.run()
+    if counts is None:
+        raise click.ClickException("Retention is running elsewhere, try again later")
+    env.logger.info(
+        "Removed %s finished tasks and %s events, cleared results or kwargs of %s DONE tasks",
+        counts.tasks,
+        counts.events,
+        counts.compacted,
+    )
@@ -0,0 +1,130 @@
+import itertools
+import json
+
+import click
+
+from ..benchmark import Benchmark
+from ..benchmark import BenchmarkSettings
+from ..benchmark.processors import WORKLOADS
+from .cli import cli
+from .environment import Environment
+from .environment import pass_env
+
+
+@cli.command(
+    name="bench",
+    help="Benchmark throughput and latency of processing tasks against the database. "
+    "Options with multiple values run every combination of them.",
+)
+@click.option("-n", "--tasks", type=int, default=1000, help="Number of tasks")
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    multiple=True,
+    default=[1],
+    help="Number of worker processes",
+)
+@click.option(
+    "-b", "--batch-size", type=int, multiple=True, default=[1], help="BATCH_SIZE"
+)
+@click.option(
+    "-t", "--threads", type=int, multiple=True, default=[1], help="MAX_WORKER_THREADS"
+)
+@click.option(
+    "--workload",
+    type=click.Choice(list(WORKLOADS)),
+    multiple=True,
+    default=["noop"],
+    help="What each task does",
+)
+@click.option(
+    "--sleep-seconds",
+    type=float,
+    default=0.01,
+    help="Seconds to sleep for the sleep workload",
+)
+@click.option(
+    "--burn-iterations",
+    type=int,
+    default=10_000,
+    help="Loop iterations for the burn workload",
+)
+@click.option("--timeout", type=float, default=600, help="Seconds to wait for each run")
+@click.option(
+    "--duration",
+    type=float,
+    default=None,
+    help="Keep the backlog of --tasks topped up for this many seconds to measure the sustained throughput",
+)
+@click.option(
+    "--report-interval",
+    type=float,
+    default=60,
+    help="Seconds of each throughput window with --duration",
+)
+@click.option("--json", "as_json", is_flag=True, help="Output results as JSON")
+@click.option(
+    "--keep", is_flag=True, help="Keep the benchmark tasks and workers in the database"
+)
+@pass_env
+def bench(
+    env: Environment,
+    tasks: int,
+    workers: tuple[int, ...],
+    batch_size: tuple[int, ...],
+    threads: tuple[int, ...],
+    workload: tuple[str, ...],
+    sleep_seconds: float,
+    burn_iterations: int,
+    timeout: float,
+    duration: float | None,
+    report_interval: float,
+    as_json: bool,
+    keep: bool,
+):
+    benchmark = Benchmark(env.app, cleanup=not keep)
+    results = []
+    for (
+        workload_value,
+        workers_value,
+        batch_size_value,
+        threads_value,
+    ) in itertools.product(workload, workers, batch_size, threads):
+        settings = BenchmarkSettings(
+            tasks=tasks,
+            workers=workers_value,
+            batch_size=batch_size_value,
+            threads=threads_value,
+            workload=workload_value,
+            sleep_seconds=sleep_seconds,
+            burn_iterations=burn_iterations,
+            timeout=timeout,
+            duration=duration,
+            report_interval=report_interval,
+        )
+        result = benchmark.run(settings)
+        results.append(result)
+        if not as_json:
+            click.echo(
+                f"workload={settings.workload} workers={settings.workers} "
+                f"batch_size={settings.batch_size} threads={settings.threads}: "
+                f"{result.throughput:.1f} tasks/s, "
+                f"enqueue_to_start p50={result.enqueue_to_start_p50 * 1000:.1f}ms "
+                f"p99={result.enqueue_to_start_p99 * 1000:.1f}ms, "
+                f"enqueue_to_finish p50={result.enqueue_to_finish_p50 * 1000:.1f}ms "
+                f"p99={result.enqueue_to_finish_p99 * 1000:.1f}ms, "
+                f"done={result.done} failed={result.failed}"
+            )
+            if result.throughput_windows:
+                click.echo(
+                    f"  throughput of {len(result.throughput_windows)} windows: "
+                    f"min={min(result.throughput_windows):.1f} tasks/s "
+                    f"max={max(result.throughput_windows):.1f} tasks/s"
+                )
+    if as_json:
+        click.echo(
+            json.dumps(
+                [result.to_dict() for result in results], indent=2, allow_nan=False
+            )
+        )
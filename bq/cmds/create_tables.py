@@ -8,5 +8,43 @@ from .environment import pass_env
 @cli.command(name="create_tables", help="Create BeanQueue tables")
 @pass_env
 def create_tables(env: Environment):
+    config = env.app.config
+    if config.PARTITION_BY is not None:
+        with env.app.make_session() as db:
+            partition_service = env.app._make_partition_service(db)
+            managed_tables = partition_service.managed_tables()
+            # create the tables referenced by the task and event tables first
+            Base.metadata.create_all(
+                bind=db.connection(),
+                tables=[
+                    table
+                    for table in Base.metadata.sorted_tables
+                    if table not in managed_tables
+                ],
+            )
+            partition_service.create_tables(
+                config.PARTITION_BY,
+                interval=config.PARTITION_INTERVAL,
+                premake=config.PARTITION_PREMAKE,
+                storage_parameters=dict(
+                    active=config.PARTITION_ACTIVE_STORAGE_PARAMETERS,
+                    finished=config.PARTITION_FINISHED_STORAGE_PARAMETERS,
+                ),
+            )
+            db.commit()
+        env.logger.info("Created partitioned tables by %s", config.PARTITION_BY)
     Base.metadata.create_all(bind=env.app.engine)
+    if env.app.config.QUEUE_DEPTH_ENABLED:
+        env.app.install_queue_depth()
+        env.logger.info("Installed queue depth triggers")
+    if env.app.config.UUID7_IDS:
+        env.app.install_uuid7()
+        env.logger.info("Installed UUIDv7 id defaults")
+    if env.app.config.RETENTION_ARCHIVE:
+        with env.app.make_session() as db:
+            env.app._make_retention_service(db).create_archive_tables(
+                env.app.config.RETENTION_ARCHIVE_SUFFIX
+            )
+            db.commit()
+        env.logger.info("Created retention archive tables")
     env.logger.info("Done, tables created")
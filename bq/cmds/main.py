@@ -1,6 +1,10 @@
+from . import archive  # noqa
+from . import bench  # noqa
 from . import create_tables  # noqa
 from . import process  # noqa
+from . import queue_depth  # noqa
 from . import submit  # noqa
+from . import top  # noqa
 from .cli import cli
 
 __ALL__ = [cli]
@@ -0,0 +1,18 @@
+import click
+
+from .cli import cli
+from .environment import Environment
+from .environment import pass_env
+
+
+@cli.command(name="queue_depth", help="Show number of tasks per channel and state")
+@click.argument("channels", nargs=-1)
+@pass_env
+def queue_depth(
+    env: Environment,
+    channels: tuple[str, ...],
+):
+    depth = env.app.queue_depth(channels or None)
+    for channel, states in sorted(depth.items()):
+        for state, count in sorted(states.items(), key=lambda item: item[0].value):
+            click.echo(f"{channel}\t{state.value}\t{count}")
@@ -0,0 +1,166 @@
+import time
+
+import click
+from rich.console import Console
+from rich.console import Group
+from rich.live import Live
+from rich.table import Table
+from rich.text import Text
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+
+from ..app import BeanQueue
+from ..services.overview import Overview
+from .cli import cli
+from .environment import Environment
+from .environment import pass_env
+
+
+def fetch_overview(
+    app: BeanQueue, channels: tuple[str, ...], statement_timeout: int
+) -> Overview:
+    with app.make_session() as db:
+        db.execute(
+            select(func.set_config("statement_timeout", str(statement_timeout), True))
+        )
+        db.execute(select(func.set_config("transaction_read_only", "on", True)))
+        overview = app._make_overview_service(db).get_overview(channels or None)
+        db.rollback()
+    return overview
+
+
+def compute_rates(
+    previous: Overview | None, current: Overview, elapsed: float
+) -> dict[str, tuple[float, float]]:
+    """Compute done and failed tasks per second of each channel from the change of the totals"""
+    if previous is None or elapsed <= 0:
+        return {}
+    previous_totals = {channel.channel: channel for channel in previous.channels}
+    rates = {}
+    for channel in current.channels:
+        previous_channel = previous_totals.get(channel.channel)
+        if channel.done is None or previous_channel is None:
+            continue
+        rates[channel.channel] = (
+            max(channel.done - previous_channel.done, 0) / elapsed,
+            max(channel.failed - previous_channel.failed, 0) / elapsed,
+        )
+    return rates
+
+
+def format_age(seconds: float | None) -> str:
+    if seconds is None:
+        return "-"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+def format_rate(rate: float | None) -> str:
+    if rate is None:
+        return "-"
+    return f"{rate:.1f}/s"
+
+
+def render(
+    overview: Overview,
+    rates: dict[str, tuple[float, float]],
+    error: str | None = None,
+) -> Group:
+    channel_table = Table(title="Channels", expand=True)
+    channel_table.add_column("Channel")
+    channel_table.add_column("Pending", justify="right")
+    channel_table.add_column("Processing", justify="right")
+    channel_table.add_column("Scheduled", justify="right")
+    channel_table.add_column("Oldest pending", justify="right")
+    channel_table.add_column("Done rate", justify="right")
+    channel_table.add_column("Failed rate", justify="right")
+    for channel in overview.channels:
+        done_rate, failed_rate = rates.get(channel.channel, (None, None))
+        channel_table.add_row(
+            channel.channel,
+            str(channel.pending),
+            str(channel.processing),
+            str(channel.scheduled),
+            format_age(channel.oldest_pending_age),
+            format_rate(done_rate),
+            format_rate(failed_rate),
+        )
+
+    worker_table = Table(title="Workers", expand=True)
+    worker_table.add_column("ID")
+    worker_table.add_column("Name")
+    worker_table.add_column("Channels")
+    worker_table.add_column("Heartbeat", justify="right")
+    worker_table.add_column("In-flight", justify="right")
+    for worker in overview.workers:
+        worker_table.add_row(
+            str(worker.id),
+            worker.name,
+            ", ".join(worker.channels),
+            format_age(worker.heartbeat_age),
+            str(worker.in_flight),
+        )
+
+    renderables = [channel_table, worker_table]
+    if error is not None:
+        renderables.append(Text(error, style="red"))
+    return Group(*renderables)
+
+
+@cli.command(
+    name="top",
+    help="Show a live dashboard of channels and workers. "
+    "Completion and failure rates require QUEUE_DEPTH_ENABLED.",
+)
+@click.argument("channels", nargs=-1)
+@click.option(
+    "-i", "--interval", type=float, default=1, help="Seconds between refreshes"
+)
+@click.option(
+    "--statement-timeout",
+    type=int,
+    default=1000,
+    help="Milliseconds before giving up on a refresh, to protect a busy database",
+)
+@click.option("--once", is_flag=True, help="Print the dashboard once and exit")
+@pass_env
+def top(
+    env: Environment,
+    channels: tuple[str, ...],
+    interval: float,
+    statement_timeout: int,
+    once: bool,
+):
+    if once:
+        overview = fetch_overview(env.app, channels, statement_timeout)
+        Console().print(render(overview, rates={}))
+        return
+
+    previous = None
+    previous_at = None
+    rates = {}
+    try:
+        with Live(auto_refresh=False) as live:
+            while True:
+                error = None
+                try:
+                    overview = fetch_overview(env.app, channels, statement_timeout)
+                except DBAPIError as exc:
+                    error = f"Failed to refresh: {exc.orig}"
+                else:
+                    now = time.monotonic()
+                    if previous_at is not None:
+                        rates = compute_rates(previous, overview, now - previous_at)
+                    previous = overview
+                    previous_at = now
+                if previous is not None:
+                    live.update(render(previous, rates, error=error), refresh=True)
+                elif error is not None:
+                    live.update(Text(error, style="red"), refresh=True)
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
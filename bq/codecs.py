@@ -0,0 +1,236 @@
+import base64
+import functools
+import json
+import typing
+from importlib.util import find_spec
+
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import TypeDecorator
+
+CODECS_EXTRA = "codecs"
+# Key of the JSON object wrapping an encoded value, along with the base64 encoded data. Base64 makes the data about
+# 33% larger, so the codecs only pay off when they shrink the values more than that
+ENVELOPE_KEY = "__bq_codec__"
+ENVELOPE_DATA_KEY = "data"
+
+
+class CodecNotInstalledError(ImportError):
+    """Raised when the optional dependencies of a codec are not installed."""
+
+
+def require_module(name: str):
+    if find_spec(name) is None:
+        raise CodecNotInstalledError(
+            f"Codec requires optional dependency {name}. "
+            f"Install it with: pip install beanqueue[{CODECS_EXTRA}]"
+        )
+
+
+class Codec:
+    """Encode a JSON compatible value into bytes and back"""
+
+    name: str
+
+    def encode(self, value: typing.Any) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, data: bytes) -> typing.Any:
+        raise NotImplementedError()
+
+
+class JSONCodec(Codec):
+    name = "json"
+
+    def encode(self, value: typing.Any) -> bytes:
+        return json_dumps(value).encode()
+
+    def decode(self, data: bytes) -> typing.Any:
+        return json_loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+
+    def __init__(self):
+        require_module("msgpack")
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def encode(self, value: typing.Any) -> bytes:
+        return self._msgpack.packb(value)
+
+    def decode(self, data: bytes) -> typing.Any:
+        return self._msgpack.unpackb(data, strict_map_key=False)
+
+
+class ZstdCodec(Codec):
+    """Compress the output of another codec with zstd"""
+
+    def __init__(self, codec: Codec, level: int = 3):
+        require_module("zstandard")
+        import zstandard
+
+        self.codec = codec
+        self.name = f"{codec.name}+zstd"
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def encode(self, value: typing.Any) -> bytes:
+        return self._compressor.compress(self.codec.encode(value))
+
+    def decode(self, data: bytes) -> typing.Any:
+        return self.codec.decode(self._decompressor.decompress(data))
+
+
+BASE_CODECS: dict[str, typing.Callable[[], Codec]] = dict(
+    json=JSONCodec,
+    msgpack=MsgpackCodec,
+)
+
+
+@functools.cache
+def get_codec(name: str) -> Codec:
+    """Get codec by name, like "json", "msgpack" or "msgpack+zstd" """
+    base_name, _, compression = name.partition("+")
+    if base_name not in BASE_CODECS or compression not in ("", "zstd"):
+        raise ValueError(f"Invalid codec {name!r}")
+    codec = BASE_CODECS[base_name]()
+    if compression == "zstd":
+        codec = ZstdCodec(codec)
+    return codec
+
+
+def get_envelope_codec(name: str) -> Codec:
+    """Get codec by name for encoding values into envelopes. The plain "json" codec is rejected, the values
+    are stored as JSON already and the base64 envelope would only make them larger.
+    """
+    if name == JSONCodec.name:
+        raise ValueError(
+            f"Invalid codec {name!r} for envelopes, the base64 encoded JSON is larger than the plain JSON, "
+            'use "json+zstd" or "msgpack" instead'
+        )
+    return get_codec(name)
+
+
+def has_orjson() -> bool:
+    return find_spec("orjson") is not None
+
+
+def json_dumps(value: typing.Any) -> str:
+    return json.dumps(value)
+
+
+def json_loads(data: str | bytes) -> typing.Any:
+    return json.loads(data)
+
+
+def orjson_dumps(value: typing.Any) -> str:
+    import orjson
+
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def orjson_loads(data: str | bytes) -> typing.Any:
+    import orjson
+
+    return orjson.loads(data)
+
+
+def make_json_serializers(
+    name: str,
+) -> tuple[typing.Callable[[typing.Any], str], typing.Callable[[str], typing.Any]]:
+    """Return the serializer and deserializer functions for the json_serializer and json_deserializer arguments of
+    create_engine
+    """
+    if name == "orjson":
+        require_module("orjson")
+        return orjson_dumps, orjson_loads
+    elif name == "json":
+        return json_dumps, json_loads
+    raise ValueError(f"Invalid JSON serializer {name!r}")
+
+
+class EncodedDict(dict):
+    """A dict to be encoded with the given codec when written into an `EncodedJSONB` column"""
+
+    def __init__(self, *args, codec: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codec = codec
+
+
+class EncodedList(list):
+    """A list to be encoded with the given codec when written into an `EncodedJSONB` column"""
+
+    def __init__(self, *args, codec: str):
+        super().__init__(*args)
+        self.codec = codec
+
+
+def with_codec(value: typing.Any, codec: str | None) -> typing.Any:
+    """Mark a dict or list value to be encoded with the codec, other values are stored as plain JSON"""
+    if codec is None:
+        return value
+    if isinstance(value, dict):
+        return EncodedDict(value, codec=codec)
+    elif isinstance(value, list):
+        return EncodedList(value, codec=codec)
+    return value
+
+
+def encode_value(value: typing.Any, codec: Codec, min_size: int) -> typing.Any:
+    data = codec.encode(value)
+    if len(data) < min_size:
+        # small values are cheaper to keep as plain JSON
+        return value
+    return {
+        ENVELOPE_KEY: codec.name,
+        ENVELOPE_DATA_KEY: base64.b64encode(data).decode(),
+    }
+
+
+def is_encoded(value: typing.Any) -> bool:
+    return (
+        isinstance(value, dict)
+        and len(value) == 2
+        and ENVELOPE_KEY in value
+        and ENVELOPE_DATA_KEY in value
+    )
+
+
+def decode_value(value: typing.Any) -> typing.Any:
+    """Decode the value if it's an envelope, otherwise return it as it is"""
+    if is_encoded(value):
+        return get_codec(value[ENVELOPE_KEY]).decode(
+            base64.b64decode(value[ENVELOPE_DATA_KEY])
+        )
+    return value
+
+
+class EncodedJSONB(TypeDecorator):
+    """JSONB column storing the values larger than `min_size` bytes encoded with a codec, wrapped in an envelope
+    object. The codec can also be picked per value with `with_codec`.
+
+    The values are read as they are, envelopes included, so that loading rows doesn't pay for decoding values
+    nobody reads. Decode them with `decode_value` where they are used, the processors do that for the kwargs.
+    """
+
+    impl = JSONB
+    cache_ok = True
+
+    def __init__(self, codec: str | None = None, min_size: int = 1024):
+        super().__init__()
+        if codec is not None:
+            # fail early for invalid codecs or missing dependencies
+            get_envelope_codec(codec)
+        self.codec = codec
+        self.min_size = min_size
+
+    def process_bind_param(self, value: typing.Any, dialect) -> typing.Any:
+        # values read from another row are still encoded
+        if value is None or is_encoded(value):
+            return value
+        codec = getattr(value, "codec", None) or self.codec
+        if codec is None:
+            return value
+        return encode_value(value, get_envelope_codec(codec), self.min_size)
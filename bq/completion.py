@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import logging
+import threading
+import typing
+
+from sqlalchemy.orm import Session as DBSession
+
+from .services.completion import Completion
+from .services.completion import CompletionService
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionBuffer:
+    """Buffer completed tasks from worker threads and write them in groups with a background thread.
+
+    The buffered completions are written with a single statement every `interval` seconds, or as soon as
+    `max_size` completions are buffered. Completions still in the buffer are lost if the process crashes,
+    those tasks stay in PROCESSING state until other workers find this worker dead and reschedule them.
+    """
+
+    def __init__(
+        self,
+        make_session: typing.Callable[[], DBSession],
+        make_service: typing.Callable[[DBSession], CompletionService],
+        worker_id: typing.Any,
+        max_size: int = 100,
+        interval: float = 0.01,
+    ):
+        self._make_session = make_session
+        self._make_service = make_service
+        self._worker_id = worker_id
+        self._max_size = max_size
+        self._interval = interval
+        self._completions: list[Completion] = []
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._thread: threading.Thread | None = None
+
+    def add(self, completion: Completion):
+        with self._condition:
+            self._completions.append(completion)
+            if len(self._completions) >= self._max_size:
+                self._condition.notify()
+
+    def _take(self) -> list[Completion]:
+        with self._condition:
+            if len(self._completions) < self._max_size and not self._shutdown:
+                self._condition.wait(self._interval)
+            completions = self._completions
+            self._completions = []
+            return completions
+
+    def flush(self, completions: typing.Sequence[Completion]):
+        if not completions:
+            return
+        db = self._make_session()
+        try:
+            service = self._make_service(db)
+            try:
+                count = service.complete(completions, worker_id=self._worker_id)
+                db.commit()
+            except Exception:
+                logger.exception(
+                    "Failed to write %s completions, write them one by one instead",
+                    len(completions),
+                )
+                db.rollback()
+                count = 0
+                for completion in completions:
+                    try:
+                        count += service.complete(
+                            [completion], worker_id=self._worker_id
+                        )
+                        db.commit()
+                    except Exception:
+                        logger.exception(
+                            "Failed to write completion of task %s", completion.task_id
+                        )
+                        db.rollback()
+            if count != len(completions):
+                logger.warning(
+                    "Only %s of %s buffered completions written, the others are no longer processed by this worker",
+                    count,
+                    len(completions),
+                )
+            logger.debug("Wrote %s completions", count)
+        finally:
+            db.close()
+
+    def run(self):
+        while True:
+            completions = self._take()
+            self.flush(completions)
+            if self._shutdown and not completions:
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="completion_buffer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        # flush anything added after the thread quit
+        completions = self._completions
+        self._completions = []
+        self.flush(completions)
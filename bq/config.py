@@ -19,9 +19,131 @@ class Config(BaseSettings):
 
     # Maximum number of worker threads for concurrent task processing
     # Set to 1 to disable thread pool and process tasks sequentially
-    # Set to 0 to use the default (number of CPUs * 5)
+    # Set to 0 to use the default (10 threads)
     MAX_WORKER_THREADS: int = 1
 
+    # Maximum number of connections the pool could open beyond its size in threaded mode
+    DB_POOL_MAX_OVERFLOW: int = 10
+
+    # Check the database connections needed against max_connections of the server at startup
+    VALIDATE_CONCURRENCY_PLAN: bool = True
+
+    # Worker threads keep their database sessions, expunge all objects from a session once its identity map
+    # grows beyond this size
+    THREAD_SESSION_IDENTITY_MAP_LIMIT: int = 1000
+
+    # Buffer the completions of processors with isolation "none" in threaded mode and write them in groups.
+    # Buffered completions are lost on crash, the tasks will then be rescheduled once this worker is found dead.
+    COMPLETION_BATCH_ENABLED: bool = False
+
+    # Write the buffered completions once the buffer reaches this size
+    COMPLETION_BATCH_SIZE: int = 100
+
+    # Write the buffered completions at least every this many seconds
+    COMPLETION_BATCH_INTERVAL: float = 0.01
+
+    # Maintain the number of tasks per channel and state in a counter table with triggers.
+    # The triggers are installed by the create_tables command, or by calling BeanQueue.install_queue_depth
+    QUEUE_DEPTH_ENABLED: bool = False
+
+    # Number of counter rows per channel and state for concurrent transactions to write to
+    QUEUE_DEPTH_SHARDS: int = 16
+
+    # Serializer of the JSONB columns, "json" for the standard library or "orjson" for the faster one, which
+    # requires the codecs extra
+    JSON_SERIALIZER: typing.Literal["json", "orjson"] = "json"
+
+    # Move the kwargs and results of tasks larger than PAYLOAD_THRESHOLD out of the task rows, into the "table"
+    # of the same database, or the "filesystem" directory of PAYLOAD_STORE_PATH. None means keeping them inline
+    PAYLOAD_STORE: typing.Literal["table", "filesystem"] | None = None
+
+    # Directory of the "filesystem" payload store
+    PAYLOAD_STORE_PATH: str | None = None
+
+    # Move the values larger than this many bytes once encoded into the payload store
+    PAYLOAD_THRESHOLD: int = 1024 * 1024
+
+    # Generate time-ordered UUIDv7 ids instead of random UUIDv4 for tasks, workers and events, for the locality of
+    # the primary key indexes. The function generating them on the server is installed as the default of the id
+    # columns by the create_tables command, or by calling BeanQueue.install_uuid7
+    UUID7_IDS: bool = False
+
+    # Dispatch pending tasks in the order of their ids instead of created_at, only makes sense with UUID7_IDS
+    DISPATCH_ORDER_BY_ID: bool = False
+
+    # Leave the kwargs out of the dispatch query in threaded mode, the worker threads load the kwargs of each
+    # dispatched batch with one query instead, so that the main loop doesn't transfer and decode them
+    DISPATCH_DEFER_KWARGS: bool = False
+
+    # Seconds for a running task to be reported as slow by the watchdog, can be overridden by the slow_threshold
+    # of processors. The watchdog only runs if this or slow_threshold of any processor is set
+    SLOW_TASK_THRESHOLD: float | None = None
+
+    # Interval of the watchdog checking for slow tasks in seconds
+    WATCHDOG_INTERVAL: float = 5
+
+    # Report the worker as unhealthy in /healthz while any slow task is running
+    SLOW_TASK_UNHEALTHY: bool = False
+
+    # Seconds to keep DONE and FAILED tasks and their events before the retention removes them,
+    # None means keeping them forever
+    RETENTION_SECONDS: int | None = None
+
+    # Retention seconds of specific channels overriding RETENTION_SECONDS, None means keeping the channel forever
+    RETENTION_CHANNELS: dict[str, int | None] = Field(default_factory=dict)
+
+    # Move the removed rows into archive tables, named after the task and event tables with
+    # RETENTION_ARCHIVE_SUFFIX, instead of deleting them
+    RETENTION_ARCHIVE: bool = False
+
+    # Suffix of the archive table names
+    RETENTION_ARCHIVE_SUFFIX: str = "_archive"
+
+    # Number of tasks to remove in each transaction
+    RETENTION_BATCH_SIZE: int = 1000
+
+    # Seconds to pause between batches, to limit the WAL volume and replication lag
+    RETENTION_BATCH_INTERVAL: float = 0.1
+
+    # Run the retention in the workers every this many seconds, only one worker runs it at a time.
+    # None means only running it with the archive command
+    RETENTION_INTERVAL: float | None = None
+
+    # Create the task and event tables as partitioned tables with the create_tables command, partitioned by
+    # ranges of "created_at" or by "state". None means regular tables
+    PARTITION_BY: typing.Literal["created_at", "state"] | None = None
+
+    # Range of each created_at partition, "day", "week" or "month"
+    PARTITION_INTERVAL: typing.Literal["day", "week", "month"] = "day"
+
+    # Number of created_at partitions to create ahead of the current one
+    PARTITION_PREMAKE: int = 3
+
+    # Drop the created_at partitions older than this many seconds once all of their tasks are finished,
+    # None means keeping them forever
+    PARTITION_RETENTION_SECONDS: int | None = None
+
+    # Only detach the old partitions instead of dropping them, for archiving them elsewhere
+    PARTITION_DETACH_ONLY: bool = False
+
+    # Storage parameters of the active partition when partitioned by state. It's small and churns fast, leave room
+    # for HOT updates and vacuum it after a fixed number of dead rows instead of a fraction of the table
+    PARTITION_ACTIVE_STORAGE_PARAMETERS: dict[str, int | float] = dict(
+        fillfactor=70,
+        autovacuum_vacuum_scale_factor=0,
+        autovacuum_vacuum_threshold=1000,
+        autovacuum_analyze_scale_factor=0,
+        autovacuum_analyze_threshold=1000,
+        autovacuum_vacuum_cost_delay=0,
+    )
+
+    # Storage parameters of the finished partition when partitioned by state. It's insert mostly, vacuum it after
+    # inserts to keep its visibility map up to date
+    PARTITION_FINISHED_STORAGE_PARAMETERS: dict[str, int | float] = dict(
+        autovacuum_vacuum_insert_scale_factor=0,
+        autovacuum_vacuum_insert_threshold=100_000,
+    )
+
     # How long we should poll before timeout in seconds
     POLL_TIMEOUT: int = 60
 
@@ -40,6 +162,30 @@ class Config(BaseSettings):
     # which event model to use
     EVENT_MODEL: str | None = "bq.Event"
 
+    # Where the COMPLETE events go, the failure events are always inserted along with the tasks:
+    # - database: insert them along with the tasks
+    # - buffered: insert them in groups from a background thread once the tasks are committed, lost on crash
+    # - logfile: append them to EVENT_SINK_PATH as newline delimited JSON once the tasks are committed
+    EVENT_SINK: typing.Literal["database", "buffered", "logfile"] = "database"
+
+    # Fraction of the COMPLETE events to record, the failure events are always recorded
+    EVENT_SAMPLE_RATE: float = 1.0
+
+    # Path of the file for the logfile event sink
+    EVENT_SINK_PATH: str | None = None
+
+    # Write the buffered events once the buffer reaches this size
+    EVENT_SINK_BATCH_SIZE: int = 1000
+
+    # Write the buffered events at least every this many seconds
+    EVENT_SINK_BATCH_INTERVAL: float = 1.0
+
+    # which queue depth model to use
+    QUEUE_DEPTH_MODEL: str = "bq.QueueDepth"
+
+    # which payload model to use for the "table" payload store
+    PAYLOAD_MODEL: str = "bq.Payload"
+
     # Enable metrics HTTP server
     METRICS_HTTP_SERVER_ENABLED: bool = False
 
@@ -57,6 +203,23 @@ class Config(BaseSettings):
     # JSON via BQ_METRICS_HTTP_SERVER_LOG_CONFIG.
     METRICS_HTTP_SERVER_LOG_CONFIG: dict[str, typing.Any] | None = None
 
+    # Seconds to cache the result of /healthz, 0 means checking on every request.
+    # Concurrent requests share the same in-flight check regardless
+    METRICS_HEALTHZ_CACHE_TTL: float = 0
+
+    # /livez fails if the heartbeat thread has no successful database round trip for this many seconds,
+    # None means WORKER_HEARTBEAT_TIMEOUT
+    METRICS_LIVEZ_MAX_HEARTBEAT_AGE: float | None = None
+
+    # Enable the sampling profiler endpoint /debug/profile on the metrics HTTP server
+    METRICS_PROFILE_ENABLED: bool = False
+
+    # Interval between stack samples of the profiler in seconds
+    METRICS_PROFILE_INTERVAL: float = 0.01
+
+    # Maximum duration of a profile in seconds
+    METRICS_PROFILE_MAX_SECONDS: int = 60
+
     POSTGRES_SERVER: str = "localhost"
     POSTGRES_USER: str = "bq"
     POSTGRES_PASSWORD: str = ""
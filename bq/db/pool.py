@@ -0,0 +1,20 @@
+import time
+
+from sqlalchemy.pool import QueuePool
+
+from ..stats import DB_POOL_CHECKOUT_SECONDS
+from ..stats import stats
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long it takes to check out a connection, including the time waiting for
+    other threads to return one when the pool is exhausted
+
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats.observe(DB_POOL_CHECKOUT_SECONDS, time.perf_counter() - start)
@@ -0,0 +1,227 @@
+import dataclasses
+import datetime
+import json
+import logging
+import os
+import random
+import threading
+import typing
+
+from sqlalchemy import event
+from sqlalchemy import insert
+from sqlalchemy.orm import Session as DBSession
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Key of the session info for the records waiting for the session to commit
+PENDING_RECORDS_KEY = "bq_pending_event_records"
+
+
+@dataclasses.dataclass(frozen=True)
+class EventRecord:
+    task_id: typing.Any
+    type: models.EventType
+    created_at: datetime.datetime = dataclasses.field(
+        default_factory=lambda: datetime.datetime.now(datetime.timezone.utc)
+    )
+
+
+class EventSink:
+    """Record the COMPLETE events of tasks.
+
+    Only the COMPLETE events go through the sink, the FAILED and FAILED_RETRY_SCHEDULED events are always added to
+    the task transaction, so that the retry policies counting them see every attempt.
+    """
+
+    def add(self, db: DBSession, records: typing.Sequence[EventRecord]):
+        """Record the events of tasks completed in the current transaction of the session"""
+        raise NotImplementedError()
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class DatabaseEventSink(EventSink):
+    """Insert the events in the same transaction as the tasks"""
+
+    def __init__(self, event_model: typing.Type = models.Event):
+        self.event_model: typing.Type[models.Event] = event_model
+
+    def add(self, db: DBSession, records: typing.Sequence[EventRecord]):
+        db.add_all(
+            self.event_model(
+                task_id=record.task_id, type=record.type, created_at=record.created_at
+            )
+            for record in records
+        )
+
+
+class SampledEventSink(EventSink):
+    """Only pass a random `rate` fraction of the events to another sink"""
+
+    def __init__(
+        self,
+        sink: EventSink,
+        rate: float,
+        random_func: typing.Callable[[], float] = random.random,
+    ):
+        if not 0 <= rate <= 1:
+            raise ValueError(f"Invalid rate {rate!r}, should be between 0 and 1")
+        self.sink = sink
+        self.rate = rate
+        self._random = random_func
+
+    def add(self, db: DBSession, records: typing.Sequence[EventRecord]):
+        sampled = [record for record in records if self._random() < self.rate]
+        if sampled:
+            self.sink.add(db, sampled)
+
+    def start(self):
+        self.sink.start()
+
+    def shutdown(self):
+        self.sink.shutdown()
+
+
+class CommittedEventSink(EventSink):
+    """Base of the sinks writing the events outside of the task transaction, only once it's committed. The events
+    are dropped if the transaction is rolled back.
+    """
+
+    def add(self, db: DBSession, records: typing.Sequence[EventRecord]):
+        if not event.contains(db, "after_commit", self._after_commit):
+            event.listen(db, "after_commit", self._after_commit)
+            event.listen(db, "after_soft_rollback", self._after_soft_rollback)
+        db.info.setdefault(PENDING_RECORDS_KEY, []).extend(records)
+
+    def _after_commit(self, db: DBSession):
+        records = db.info.pop(PENDING_RECORDS_KEY, None)
+        if records:
+            self.write(records)
+
+    def _after_soft_rollback(self, db: DBSession, previous_transaction: typing.Any):
+        # a savepoint rolled back doesn't roll back the tasks completed before it
+        if previous_transaction.parent is not None:
+            return
+        db.info.pop(PENDING_RECORDS_KEY, None)
+
+    def write(self, records: typing.Sequence[EventRecord]):
+        """Write the records of committed transactions"""
+        raise NotImplementedError()
+
+
+class BufferedEventSink(CommittedEventSink):
+    """Buffer the events and insert them with a multi-row statement from a background thread, every `interval`
+    seconds or as soon as `max_size` events are buffered. Events still in the buffer are lost if the process crashes.
+    """
+
+    def __init__(
+        self,
+        make_session: typing.Callable[[], DBSession],
+        event_model: typing.Type = models.Event,
+        max_size: int = 1000,
+        interval: float = 1.0,
+    ):
+        self._make_session = make_session
+        self.event_model: typing.Type[models.Event] = event_model
+        self._max_size = max_size
+        self._interval = interval
+        self._records: list[EventRecord] = []
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._thread: threading.Thread | None = None
+
+    def write(self, records: typing.Sequence[EventRecord]):
+        with self._condition:
+            self._records.extend(records)
+            if len(self._records) >= self._max_size:
+                self._condition.notify()
+
+    def _take(self) -> list[EventRecord]:
+        with self._condition:
+            if len(self._records) < self._max_size and not self._shutdown:
+                self._condition.wait(self._interval)
+            records = self._records
+            self._records = []
+            return records
+
+    def flush(self, records: typing.Sequence[EventRecord]):
+        if not records:
+            return
+        db = self._make_session()
+        try:
+            db.execute(
+                insert(self.event_model),
+                [
+                    dict(
+                        task_id=record.task_id,
+                        type=record.type,
+                        created_at=record.created_at,
+                    )
+                    for record in records
+                ],
+            )
+            db.commit()
+            logger.debug("Wrote %s events", len(records))
+        except Exception:
+            logger.exception("Failed to write %s events, drop them", len(records))
+            db.rollback()
+        finally:
+            db.close()
+
+    def run(self):
+        while True:
+            records = self._take()
+            self.flush(records)
+            if self._shutdown and not records:
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="event_sink")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        # flush anything added after the thread quit
+        records = self._records
+        self._records = []
+        self.flush(records)
+
+
+class LogFileEventSink(CommittedEventSink):
+    """Append the events to a local file as newline delimited JSON, to be shipped elsewhere by a log collector"""
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf8")
+
+    def write(self, records: typing.Sequence[EventRecord]):
+        lines = "".join(
+            json.dumps(
+                dict(
+                    task_id=str(record.task_id),
+                    type=record.type.value,
+                    created_at=record.created_at.isoformat(),
+                )
+            )
+            + "\n"
+            for record in records
+        )
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
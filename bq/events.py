@@ -5,3 +5,23 @@ worker_init = blinker.signal("worker-init")
 task_failure = blinker.signal("task-failure")
 
 healthz_check = blinker.signal("healthz-check")
+
+# The signals below are sent in the hot path. They are only sent when there are receivers connected, so they cost
+# nearly nothing otherwise. Timings are in seconds from time.perf_counter().
+
+# Sent by Registry.process before processing a task, with `task`, `processor` (None if not found) and `started_at`
+task_started = blinker.signal("task-started")
+
+# Sent by Registry.process after processing a task regardless of the outcome, with `task`, `processor`,
+# `state` (TaskState after processing, None if the task was expired) , `started_at` and `duration`
+task_completed = blinker.signal("task-completed")
+
+# Sent by DispatchService.dispatch before claiming tasks, with `channels`, `limit` and `started_at`
+dispatch_started = blinker.signal("dispatch-started")
+
+# Sent by DispatchService.dispatch after claiming tasks, with `channels`, `limit`, `claimed` (list of ClaimedTask),
+# `started_at` and `duration`
+dispatch_finished = blinker.signal("dispatch-finished")
+
+# Sent by the watchdog when a task runs longer than its slow threshold, with `running_task`, `elapsed` and `stack`
+task_slow = blinker.signal("task-slow")
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import asyncio
 import copy
 import logging.config
 import threading
+import time
 import typing
 from collections.abc import Callable
 from collections.abc import Coroutine
@@ -12,6 +14,9 @@ from sqlalchemy.orm import Session as DBSession
 
 from . import events
 from . import models
+from . import stats
+from .profiler import ProfilerBusyError
+from .profiler import SamplingProfiler
 
 if typing.TYPE_CHECKING:
     from .app import BeanQueue
@@ -82,6 +87,10 @@ class MetricsServer:
         self._worker_id = worker_id
         self._server = None
         self._thread: threading.Thread | None = None
+        self._profiler = SamplingProfiler(interval=bq.config.METRICS_PROFILE_INTERVAL)
+        self._healthz_result: tuple[bool, dict[str, typing.Any]] | None = None
+        self._healthz_expires_at: float = 0
+        self._healthz_inflight: asyncio.Future | None = None
 
     def _has_custom_health_checks(self) -> bool:
         return bool(events.healthz_check.receivers)
@@ -105,6 +114,16 @@ class MetricsServer:
     async def check_healthz(self) -> tuple[bool, dict[str, typing.Any]]:
         body: dict[str, typing.Any] = {"status": "ok"}
 
+        watchdog = self._bq._watchdog
+        if self._bq.config.SLOW_TASK_UNHEALTHY and watchdog is not None:
+            slow_tasks = watchdog.slow_tasks
+            if slow_tasks:
+                body["status"] = "slow tasks"
+                body["slow_tasks"] = [
+                    str(running_task.task_id) for running_task in slow_tasks
+                ]
+                return False, body
+
         if not self._has_custom_health_checks():
             return True, body
 
@@ -118,25 +137,106 @@ class MetricsServer:
                 return False, body
         return True, body
 
+    async def _refresh_healthz(self) -> tuple[bool, dict[str, typing.Any]]:
+        try:
+            result = await self.check_healthz()
+            self._healthz_result = result
+            self._healthz_expires_at = (
+                time.monotonic() + self._bq.config.METRICS_HEALTHZ_CACHE_TTL
+            )
+            return result
+        finally:
+            self._healthz_inflight = None
+
+    async def get_healthz(self) -> tuple[bool, dict[str, typing.Any]]:
+        """Get the health check result, cached for METRICS_HEALTHZ_CACHE_TTL seconds, and shared by concurrent
+        requests while the check is running
+
+        """
+        if (
+            self._healthz_result is not None
+            and time.monotonic() < self._healthz_expires_at
+        ):
+            return self._healthz_result
+        if self._healthz_inflight is None:
+            self._healthz_inflight = asyncio.ensure_future(self._refresh_healthz())
+        return await asyncio.shield(self._healthz_inflight)
+
+    def check_livez(self) -> tuple[bool, dict[str, typing.Any]]:
+        """Check liveness by the last successful database round trip of the heartbeat thread, without
+        touching the database
+
+        """
+        max_age = self._bq.config.METRICS_LIVEZ_MAX_HEARTBEAT_AGE
+        if max_age is None:
+            max_age = self._bq.config.WORKER_HEARTBEAT_TIMEOUT
+        last_heartbeat_at = self._bq._last_heartbeat_at
+        if last_heartbeat_at is None:
+            return False, {"status": "no heartbeat yet"}
+        age = time.monotonic() - last_heartbeat_at
+        body = {"status": "ok", "heartbeat_age": round(age, 3)}
+        if age > max_age:
+            body["status"] = "heartbeat too old"
+            return False, body
+        return True, body
+
+    def update_queue_depth(self):
+        for channel, states in self._bq.queue_depth().items():
+            for state, count in states.items():
+                stats.stats.set(stats.QUEUE_DEPTH, count, (channel, state.value))
+
     def create_app(self):
         from starlette.applications import Starlette
+        from starlette.concurrency import run_in_threadpool
         from starlette.responses import JSONResponse
+        from starlette.responses import PlainTextResponse
+        from starlette.responses import Response
         from starlette.routing import Route
 
         async def healthz(_request):
-            ok, body = await self.check_healthz()
+            ok, body = await self.get_healthz()
             return JSONResponse(body, status_code=200 if ok else 500)
 
-        return Starlette(
-            routes=[
-                Route("/healthz", healthz),
-            ]
-        )
+        async def livez(_request):
+            ok, body = self.check_livez()
+            return JSONResponse(body, status_code=200 if ok else 500)
+
+        async def metrics(_request):
+            if self._bq.config.QUEUE_DEPTH_ENABLED:
+                # the query blocks, keep it off the event loop serving the health checks
+                await run_in_threadpool(self.update_queue_depth)
+            return Response(stats.stats.render(), media_type=stats.CONTENT_TYPE)
+
+        async def profile(request):
+            try:
+                seconds = float(request.query_params.get("seconds", 10))
+            except ValueError:
+                return PlainTextResponse("Invalid seconds", status_code=400)
+            if not 0 < seconds <= self._bq.config.METRICS_PROFILE_MAX_SECONDS:
+                return PlainTextResponse(
+                    f"seconds should be between 0 and {self._bq.config.METRICS_PROFILE_MAX_SECONDS}",
+                    status_code=400,
+                )
+            try:
+                body = await run_in_threadpool(self._profiler.profile, seconds)
+            except ProfilerBusyError as exc:
+                return PlainTextResponse(str(exc), status_code=409)
+            return PlainTextResponse(body)
+
+        routes = [
+            Route("/healthz", healthz),
+            Route("/livez", livez),
+            Route("/metrics", metrics),
+        ]
+        if self._bq.config.METRICS_PROFILE_ENABLED:
+            routes.append(Route("/debug/profile", profile))
+        return Starlette(routes=routes)
 
     def start(self) -> None:
         import uvicorn
 
         require_metrics_extras()
+        stats.connect_receivers()
         host = self._bq.config.METRICS_HTTP_SERVER_INTERFACE
         port = self._bq.config.METRICS_HTTP_SERVER_PORT
         log_config = resolve_metrics_log_config(self._bq.config)
@@ -165,6 +265,7 @@ class MetricsServer:
         self._thread.start()
 
     def shutdown(self) -> None:
+        stats.disconnect_receivers()
         if self._server is not None:
             self._server.should_exit = True
         if self._thread is not None:
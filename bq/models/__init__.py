@@ -2,11 +2,17 @@ from .event import Event
 from .event import EventModelMixin
 from .event import EventModelRefTaskMixin
 from .event import EventType
+from .payload import Payload
+from .payload import PayloadModelMixin
+from .queue_depth import QueueDepth
+from .queue_depth import QueueDepthModelMixin
 from .task import Task
+from .task import TaskModelDedupMixin
 from .task import TaskModelMixin
 from .task import TaskModelRefEventMixin
 from .task import TaskModelRefParentMixin
 from .task import TaskModelRefWorkerMixin
+from .task import TaskModelTimestampsMixin
 from .task import TaskState
 from .worker import Worker
 from .worker import WorkerModelMixin
@@ -56,6 +56,7 @@ class EventModelRefTaskMixin:
         UUID(as_uuid=True),
         ForeignKey("bq_tasks.id", name="fk_event_task_id"),
         nullable=True,
+        index=True,
     )
 
     @declared_attr
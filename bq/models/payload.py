@@ -0,0 +1,39 @@
+import datetime
+import uuid
+
+from sqlalchemy import DateTime
+from sqlalchemy import func
+from sqlalchemy import LargeBinary
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+
+from ..db.base import Base
+from .helpers import make_repr_attrs
+
+
+class PayloadModelMixin:
+    id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), primary_key=True, server_default=func.gen_random_uuid()
+    )
+    # id of the task owning the payload, not a foreign key so that the task table can be partitioned
+    task_id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True), nullable=False, index=True
+    )
+    # encoded value moved out of the task row
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    # created datetime of the payload
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+
+
+class Payload(PayloadModelMixin, Base):
+    __tablename__ = "bq_payloads"
+
+    def __repr__(self) -> str:
+        items = [
+            ("id", self.id),
+            ("task_id", self.task_id),
+        ]
+        return f"<{self.__class__.__name__} {make_repr_attrs(items)}>"
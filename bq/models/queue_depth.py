@@ -0,0 +1,33 @@
+from sqlalchemy import BigInteger
+from sqlalchemy import Integer
+from sqlalchemy import String
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+
+from ..db.base import Base
+from .helpers import make_repr_attrs
+
+
+class QueueDepthModelMixin:
+    # channel of the counted tasks
+    channel: Mapped[str] = mapped_column(String, primary_key=True)
+    # state of the counted tasks
+    state: Mapped[str] = mapped_column(String, primary_key=True)
+    # concurrent transactions write to different shards to avoid contention on the same row,
+    # the shards are folded into shard 0 by compaction periodically
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # number of tasks, could be negative for a shard before compaction
+    count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+class QueueDepth(QueueDepthModelMixin, Base):
+    __tablename__ = "bq_queue_depth"
+
+    def __repr__(self) -> str:
+        items = [
+            ("channel", self.channel),
+            ("state", self.state),
+            ("shard", self.shard),
+            ("count", self.count),
+        ]
+        return f"<{self.__class__.__name__} {make_repr_attrs(items)}>"
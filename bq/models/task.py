@@ -9,9 +9,10 @@ from sqlalchemy import Enum
 from sqlalchemy import event
 from sqlalchemy import ForeignKey
 from sqlalchemy import func
+from sqlalchemy import Index
 from sqlalchemy import inspect
 from sqlalchemy import String
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import declared_attr
 from sqlalchemy.orm import Mapped
@@ -19,6 +20,7 @@ from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import Mapper
 from sqlalchemy.orm import relationship
 
+from ..codecs import EncodedJSONB
 from ..db.base import Base
 from .helpers import make_repr_attrs
 
@@ -53,9 +55,13 @@ class TaskModelMixin:
     # func name of the processor func
     func_name: Mapped[str] = mapped_column(String, nullable=False)
     # keyword arguments
-    kwargs: Mapped[typing.Optional[typing.Any]] = mapped_column(JSONB, nullable=True)
+    kwargs: Mapped[typing.Optional[typing.Any]] = mapped_column(
+        EncodedJSONB(), nullable=True
+    )
     # Result of the task
-    result: Mapped[typing.Optional[typing.Any]] = mapped_column(JSONB, nullable=True)
+    result: Mapped[typing.Optional[typing.Any]] = mapped_column(
+        EncodedJSONB(), nullable=True
+    )
     # Error message
     error_message: Mapped[typing.Optional[str]] = mapped_column(String, nullable=True)
     # created datetime of the task
@@ -69,6 +75,48 @@ class TaskModelMixin:
     )
 
 
+class TaskModelTimestampsMixin:
+    # when the task was claimed by a worker, set by the dispatch query with the database clock
+    dispatched_at: Mapped[typing.Optional[datetime.datetime]] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+    # when the processor function started running, set with the worker clock
+    started_at: Mapped[typing.Optional[datetime.datetime]] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
+    # when the processor function finished running, set with the worker clock, indexed for the
+    # latency window query
+    finished_at: Mapped[typing.Optional[datetime.datetime]] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+        index=True,
+    )
+
+
+# Predicate of the partial unique index of dedup keys, also for inferring it with ON CONFLICT
+DEDUP_INDEX_WHERE = "state = 'PENDING' AND dedup_key IS NOT NULL"
+# Columns of the partial unique index of dedup keys, the state is included for partitioning the table by state
+DEDUP_INDEX_ELEMENTS = ("dedup_key", "state")
+
+
+class TaskModelDedupMixin:
+    # key of the logical job, at most one PENDING task has the same key
+    dedup_key: Mapped[typing.Optional[str]] = mapped_column(String, nullable=True)
+
+    @declared_attr.directive
+    def __table_args__(cls) -> tuple:
+        return (
+            Index(
+                f"ix_{cls.__tablename__}_pending_dedup_key",
+                *DEDUP_INDEX_ELEMENTS,
+                unique=True,
+                postgresql_where=text(DEDUP_INDEX_WHERE),
+            ),
+        )
+
+
 class TaskModelRefWorkerMixin:
     # foreign key id of assigned worker
     worker_id: Mapped[uuid.UUID] = mapped_column(
@@ -88,6 +136,7 @@ class TaskModelRefParentMixin:
         UUID(as_uuid=True),
         ForeignKey("bq_tasks.id", name="fk_task_parent_task_id"),
         nullable=True,
+        index=True,
     )
 
     @declared_attr
@@ -0,0 +1,315 @@
+import dataclasses
+import io
+import os
+import pathlib
+import shutil
+import typing
+import uuid
+
+from sqlalchemy import Connection
+from sqlalchemy import delete
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapper
+from sqlalchemy.orm.base import NO_VALUE
+from sqlalchemy.sql import ClauseElement
+
+from . import models
+from .codecs import get_codec
+from .utils import uuid7
+
+# Key of the JSON object referencing a payload moved out of the task row
+REFERENCE_KEY = "__bq_payload__"
+# Columns of the task model which could be moved out of the row
+PAYLOAD_COLUMNS = ("kwargs", "result")
+# Size of each chunk read from the payload table when streaming
+TABLE_CHUNK_SIZE = 1024 * 1024
+
+
+class PayloadStore:
+    """Store of the payloads moved out of the task rows, the operations run with the connection of the
+    transaction writing or reading the task, so that a database backed store is consistent with the tasks.
+    """
+
+    name: str
+
+    def put(self, connection: Connection, task_id: uuid.UUID, data: bytes) -> str:
+        """Store the data of the task and return its key"""
+        raise NotImplementedError()
+
+    def open(self, connection: Connection, key: str) -> typing.BinaryIO:
+        """Open the data of the key as a binary stream"""
+        raise NotImplementedError()
+
+    def delete(self, connection: Connection, task_ids: typing.Sequence[uuid.UUID]):
+        """Delete all the payloads of the tasks"""
+        raise NotImplementedError()
+
+    def remove(self, connection: Connection, key: str):
+        """Remove the data of the key, if it still exists"""
+        raise NotImplementedError()
+
+
+class _TableReader(io.RawIOBase):
+    """Read a payload from the table in chunks, so that a huge payload doesn't need to be loaded at once"""
+
+    def __init__(self, connection: Connection, column: typing.Any, where: typing.Any):
+        self._connection = connection
+        self._column = column
+        self._where = where
+        self._offset = 0
+        self._size = connection.scalar(select(func.octet_length(column)).where(where))
+        if self._size is None:
+            raise KeyError("Payload not found")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self._size - self._offset, TABLE_CHUNK_SIZE)
+        if size <= 0:
+            return 0
+        # substring of bytea is 1-based
+        chunk = bytes(
+            self._connection.scalar(
+                select(func.substring(self._column, self._offset + 1, size)).where(
+                    self._where
+                )
+            )
+        )
+        buffer[: len(chunk)] = chunk
+        self._offset += len(chunk)
+        return len(chunk)
+
+
+class TablePayloadStore(PayloadStore):
+    """Store the payloads in a table of the same database, written and deleted in the same transaction as the
+    tasks
+    """
+
+    name = "table"
+
+    def __init__(self, payload_model: typing.Type = models.Payload):
+        self.payload_model: typing.Type[models.Payload] = payload_model
+
+    def put(self, connection: Connection, task_id: uuid.UUID, data: bytes) -> str:
+        payload_id = connection.scalar(
+            insert(self.payload_model.__table__)
+            .values(task_id=task_id, data=data)
+            .returning(self.payload_model.id)
+        )
+        return str(payload_id)
+
+    def open(self, connection: Connection, key: str) -> typing.BinaryIO:
+        table = self.payload_model.__table__
+        return io.BufferedReader(
+            _TableReader(connection, table.c.data, table.c.id == uuid.UUID(key)),
+            buffer_size=TABLE_CHUNK_SIZE,
+        )
+
+    def delete(self, connection: Connection, task_ids: typing.Sequence[uuid.UUID]):
+        if not task_ids:
+            return
+        table = self.payload_model.__table__
+        connection.execute(delete(table).where(table.c.task_id.in_(task_ids)))
+
+    def remove(self, connection: Connection, key: str):
+        table = self.payload_model.__table__
+        connection.execute(delete(table).where(table.c.id == uuid.UUID(key)))
+
+
+class FilesystemPayloadStore(PayloadStore):
+    """Store the payloads as files in a directory per task, which could be a shared volume. The files are not part
+    of the database transaction, a file written for a task failed to be inserted is left behind.
+    """
+
+    name = "filesystem"
+
+    def __init__(self, root: str | os.PathLike):
+        self.root = pathlib.Path(root).resolve()
+
+    def _path(self, key: str) -> pathlib.Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Invalid payload key {key!r}")
+        return path
+
+    def put(self, connection: Connection, task_id: uuid.UUID, data: bytes) -> str:
+        key = f"{task_id}/{uuid.uuid4().hex}"
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_bytes(data)
+        # only visible once it's completely written
+        os.replace(temp_path, path)
+        return key
+
+    def open(self, connection: Connection, key: str) -> typing.BinaryIO:
+        return self._path(key).open("rb")
+
+    def delete(self, connection: Connection, task_ids: typing.Sequence[uuid.UUID]):
+        for task_id in task_ids:
+            shutil.rmtree(self._path(str(task_id)), ignore_errors=True)
+
+    def remove(self, connection: Connection, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+
+@dataclasses.dataclass(frozen=True)
+class PayloadOffloading:
+    store: PayloadStore
+    # move the values larger than this many bytes once encoded out of the task rows
+    threshold: int
+
+
+_stores: dict[str, PayloadStore] = {}
+_offloading: PayloadOffloading | None = None
+
+
+def configure_payload_store(store: PayloadStore | None, threshold: int = 1024 * 1024):
+    """Move the kwargs and results of tasks larger than the threshold into the store from now on, None to stop.
+    The stores configured before are still used for reading the existing payloads.
+    """
+    global _offloading
+    if store is None:
+        _offloading = None
+        return
+    _stores[store.name] = store
+    _offloading = PayloadOffloading(store=store, threshold=threshold)
+
+
+def has_stores() -> bool:
+    """Whether any payload store is configured, so that the task values could reference payloads"""
+    return bool(_stores)
+
+
+def is_reference(value: typing.Any) -> bool:
+    return isinstance(value, dict) and REFERENCE_KEY in value
+
+
+def _get_store(reference: dict[str, typing.Any]) -> PayloadStore:
+    name = reference[REFERENCE_KEY]
+    if name not in _stores:
+        raise ValueError(f"Payload store {name!r} is not configured")
+    return _stores[name]
+
+
+def open_payload(
+    connection: Connection, reference: dict[str, typing.Any]
+) -> typing.BinaryIO:
+    """Open the encoded data of a payload reference as a binary stream"""
+    return _get_store(reference).open(connection, reference["key"])
+
+
+def load_payload(connection: Connection, value: typing.Any) -> typing.Any:
+    """Load and decode the value if it's a payload reference, otherwise return it as it is"""
+    if not is_reference(value):
+        return value
+    with open_payload(connection, value) as file:
+        data = file.read()
+    return get_codec(value["codec"]).decode(data)
+
+
+def remove_payload(connection: Connection, reference: dict[str, typing.Any]):
+    """Remove the data of a payload reference from its store"""
+    _get_store(reference).remove(connection, reference["key"])
+
+
+def offload_value(
+    connection: Connection, task_id: uuid.UUID, value: typing.Any
+) -> typing.Any:
+    """Move the value of the task into the store and return its reference if it's larger than the threshold,
+    otherwise return it as it is
+    """
+    if (
+        _offloading is None
+        or value is None
+        # SQL expressions, like null() for clearing the value
+        or isinstance(value, ClauseElement)
+        or is_reference(value)
+    ):
+        return value
+    codec = get_codec(getattr(value, "codec", None) or "json")
+    data = codec.encode(value)
+    if len(data) <= _offloading.threshold:
+        return value
+    key = _offloading.store.put(connection, task_id, data)
+    return {REFERENCE_KEY: _offloading.store.name, "key": key, "codec": codec.name}
+
+
+def make_reference_query(table: typing.Any, column: str):
+    """Make the query of the ids and the values of the column of the tasks referencing payloads, without loading
+    the inline values
+    """
+    value = table.c[column]
+    return select(table.c.id, value).where(
+        type_coerce(value, JSONB).has_key(REFERENCE_KEY)
+    )
+
+
+def offload_payloads(connection: Connection, task: models.Task):
+    if not has_stores():
+        return
+    state = inspect(task)
+    for column in PAYLOAD_COLUMNS:
+        # only look at the values set in this flush, without loading deferred or expired ones
+        if column not in state.dict:
+            continue
+        if state.persistent:
+            history = state.attrs[column].history
+            if not history.has_changes():
+                continue
+            old_values = history.deleted
+            if state.committed_state.get(column) is NO_VALUE:
+                # replaced without being loaded, like the result deferred by dispatching
+                table = task.__table__
+                old_values = [
+                    old_value
+                    for _, old_value in connection.execute(
+                        make_reference_query(table, column).where(table.c.id == task.id)
+                    )
+                ]
+            # the payloads replaced by the new value are not referenced anymore
+            for old_value in old_values:
+                if is_reference(old_value):
+                    remove_payload(connection, old_value)
+        if _offloading is None:
+            continue
+        value = state.dict[column]
+        if value is None or isinstance(value, ClauseElement) or is_reference(value):
+            continue
+        if task.id is None:
+            # the payload needs the task id before the row is inserted
+            task.id = uuid7()
+        offloaded = offload_value(connection, task.id, value)
+        if offloaded is not value:
+            setattr(task, column, offloaded)
+
+
+def delete_payloads(connection: Connection, task_ids: typing.Sequence[uuid.UUID]):
+    """Delete the payloads of the tasks from all the configured stores"""
+    for store in _stores.values():
+        store.delete(connection, task_ids)
+
+
+def _before_insert(mapper: Mapper, connection: Connection, target: models.Task):
+    offload_payloads(connection, target)
+
+
+def _before_update(mapper: Mapper, connection: Connection, target: models.Task):
+    offload_payloads(connection, target)
+
+
+def _after_delete(mapper: Mapper, connection: Connection, target: models.Task):
+    delete_payloads(connection, [target.id])
+
+
+# listen on the mixin, so that the task models defined by users are covered too
+event.listen(models.TaskModelMixin, "before_insert", _before_insert, propagate=True)
+event.listen(models.TaskModelMixin, "before_update", _before_update, propagate=True)
+event.listen(models.TaskModelMixin, "after_delete", _after_delete, propagate=True)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import typing
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+if typing.TYPE_CHECKING:
+    from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Number of worker threads when MAX_WORKER_THREADS is set to 0 (auto)
+DEFAULT_AUTO_WORKER_THREADS = 10
+# Extra pooled connections in threaded mode for the main thread, the heartbeat thread, the LISTEN connection,
+# the metrics server and the completion buffer
+EXTRA_POOL_CONNECTIONS = 5
+# Connections in sequential mode, one for each of the main thread, the heartbeat thread and the metrics server
+SEQUENTIAL_CONNECTIONS = 3
+
+
+@dataclasses.dataclass(frozen=True)
+class ConcurrencyPlan:
+    # number of threads processing tasks, 1 means processing tasks sequentially in the main thread
+    worker_threads: int
+    # maximum number of tasks dispatched to the threads but not finished yet
+    max_in_flight: int
+    # maximum number of tasks to claim with a single dispatch query
+    prefetch: int
+    # size of the connection pool, None for sequential mode which uses one connection per thread
+    pool_size: int | None
+    # maximum number of connections allowed to be opened beyond the pool size
+    pool_max_overflow: int
+
+    @property
+    def threaded(self) -> bool:
+        return self.worker_threads != 1
+
+    @property
+    def max_connections(self) -> int:
+        """Maximum number of database connections a worker process could open with this plan"""
+        if self.pool_size is None:
+            return SEQUENTIAL_CONNECTIONS
+        return self.pool_size + self.pool_max_overflow
+
+
+def make_concurrency_plan(config: Config) -> ConcurrencyPlan:
+    worker_threads = config.MAX_WORKER_THREADS
+    if worker_threads == 0:
+        worker_threads = DEFAULT_AUTO_WORKER_THREADS
+    if worker_threads < 0:
+        raise ValueError(
+            f"MAX_WORKER_THREADS should not be negative, got {worker_threads}"
+        )
+    if config.BATCH_SIZE < 1:
+        raise ValueError(f"BATCH_SIZE should be at least 1, got {config.BATCH_SIZE}")
+    if worker_threads == 1:
+        return ConcurrencyPlan(
+            worker_threads=1,
+            max_in_flight=config.BATCH_SIZE,
+            prefetch=config.BATCH_SIZE,
+            pool_size=None,
+            pool_max_overflow=0,
+        )
+    return ConcurrencyPlan(
+        worker_threads=worker_threads,
+        max_in_flight=worker_threads,
+        # there's no point to claim more tasks than the threads can take
+        prefetch=min(config.BATCH_SIZE, worker_threads),
+        pool_size=worker_threads + EXTRA_POOL_CONNECTIONS,
+        pool_max_overflow=config.DB_POOL_MAX_OVERFLOW,
+    )
+
+
+def validate_concurrency_plan(plan: ConcurrencyPlan, session: Session) -> int:
+    """Validate the plan against the max_connections of the PostgreSQL server, return the number of
+    workers with the same plan the server can take at most
+
+    """
+    max_connections = int(session.scalar(text("SHOW max_connections")))
+    reserved_connections = int(
+        session.scalar(text("SHOW superuser_reserved_connections"))
+    )
+    available_connections = max_connections - reserved_connections
+    if plan.max_connections > available_connections:
+        raise ValueError(
+            f"Concurrency plan needs up to {plan.max_connections} database connections, "
+            f"but the database server only allows {available_connections} "
+            f"(max_connections={max_connections}, superuser_reserved_connections={reserved_connections})"
+        )
+    max_workers = available_connections // plan.max_connections
+    logger.info(
+        "Concurrency plan needs up to %s of %s available database connections, "
+        "the server can take at most %s workers with this plan",
+        plan.max_connections,
+        available_connections,
+        max_workers,
+    )
+    return max_workers
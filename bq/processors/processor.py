@@ -1,19 +1,37 @@
 import contextvars
 import dataclasses
 import datetime
+import functools
 import inspect
+import io
 import logging
 import typing
 
+from sqlalchemy import null
 from sqlalchemy import select
 from sqlalchemy.orm import object_session
 
 from .. import events
 from .. import models
+from ..codecs import decode_value
+from ..codecs import get_envelope_codec
+from ..codecs import with_codec
+from ..event_sinks import EventRecord
+from ..event_sinks import EventSink
+from ..payloads import is_reference
+from ..payloads import load_payload
+from ..payloads import open_payload
 
 logger = logging.getLogger(__name__)
 current_task = contextvars.ContextVar("current_task")
 
+# How the processor function is isolated from the task bookkeeping in the same session:
+# - savepoint: run inside `db.begin_nested()`, rollback to the savepoint on failure
+# - none: run without any savepoint, only suitable for functions not touching the db
+# - transaction: commit before running the function, rollback the whole transaction on failure
+ISOLATION_LEVELS = ("savepoint", "none", "transaction")
+Isolation = typing.Literal["savepoint", "none", "transaction"]
+
 
 @dataclasses.dataclass(frozen=True)
 class Processor:
@@ -27,23 +45,121 @@ class Processor:
     retry_policy: typing.Callable | None = None
     # The exceptions we suppose to retry when encountered
     retry_exceptions: typing.Type | typing.Tuple[typing.Type, ...] | None = None
+    # The isolation level, None means savepoint if the func takes `db` or `savepoint`, otherwise none
+    isolation: Isolation | None = None
+    # Seconds for a running task to be reported as slow by the watchdog, None means SLOW_TASK_THRESHOLD of config
+    slow_threshold: float | None = None
+    # Codec for encoding large kwargs and results, like "msgpack+zstd", None means the codec of the column
+    codec: str | None = None
+    # Pass the kwargs moved into the payload store as a binary stream of the encoded data with the `payload`
+    # argument, instead of loading them as keyword arguments
+    stream_payload: bool = False
+    # Seconds to keep the result and kwargs of DONE tasks before the retention clears them, None means keeping
+    # them as long as the task, 0 means clearing them right at the completion
+    keep_result_for: float | None = None
+    keep_kwargs_for: float | None = None
+
+    def __post_init__(self):
+        for name in ("keep_result_for", "keep_kwargs_for"):
+            value = getattr(self, name)
+            if value is not None and value < 0:
+                raise ValueError(f"Invalid {name} {value!r}, should not be negative")
+        if self.slow_threshold is not None and self.slow_threshold <= 0:
+            raise ValueError(
+                f"Invalid slow_threshold {self.slow_threshold!r}, should be positive"
+            )
+        if self.stream_payload and "payload" not in self.func_parameters:
+            raise ValueError(
+                f"Processor {self.name} streams payload but doesn't take payload argument"
+            )
+        if self.codec is not None:
+            # fail early for invalid codecs or missing dependencies
+            get_envelope_codec(self.codec)
+        if self.isolation is not None and self.isolation not in ISOLATION_LEVELS:
+            raise ValueError(
+                f"Invalid isolation {self.isolation!r}, should be one of {ISOLATION_LEVELS}"
+            )
+        if (
+            "savepoint" in self.func_parameters
+            and self.resolved_isolation != "savepoint"
+        ):
+            raise ValueError(
+                f"Processor {self.name} takes savepoint argument but its isolation is {self.isolation!r}"
+            )
+
+    @functools.cached_property
+    def func_parameters(self) -> typing.Mapping[str, inspect.Parameter]:
+        return inspect.signature(self.func).parameters
 
-    def process(self, task: models.Task, event_cls: typing.Type | None = None):
+    @functools.cached_property
+    def resolved_isolation(self) -> Isolation:
+        if self.isolation is not None:
+            return self.isolation
+        if "db" in self.func_parameters or "savepoint" in self.func_parameters:
+            return "savepoint"
+        return "none"
+
+    def process(
+        self,
+        task: models.Task,
+        event_cls: typing.Type | None = None,
+        event_sink: EventSink | None = None,
+    ):
         ctx_token = current_task.set(task)
+        payload_stream = None
+        # only assign the timestamps along with the completion, so that they don't cost extra statements
+        record_timestamps = hasattr(task, "started_at")
+        started_at = None
+        if record_timestamps:
+            started_at = datetime.datetime.now(datetime.timezone.utc)
         try:
             db = object_session(task)
-            func_signature = inspect.signature(self.func)
+            func_parameters = self.func_parameters
+            isolation = self.resolved_isolation
             base_kwargs = {}
-            if "task" in func_signature.parameters:
+            if "task" in func_parameters:
                 base_kwargs["task"] = task
-            if "db" in func_signature.parameters:
+            if "db" in func_parameters:
                 base_kwargs["db"] = db
             try:
-                with db.begin_nested() as savepoint:
-                    if "savepoint" in func_signature.parameters:
-                        base_kwargs["savepoint"] = savepoint
-                    result = self.func(**base_kwargs, **task.kwargs)
+                # a missing payload or a corrupted value fails the task like the function raising
+                kwargs = task.kwargs
+                if is_reference(kwargs):
+                    if self.stream_payload:
+                        payload_stream = open_payload(db.connection(), kwargs)
+                        base_kwargs["payload"] = payload_stream
+                        kwargs = {}
+                    else:
+                        kwargs = load_payload(db.connection(), kwargs)
+                else:
+                    # the encoded kwargs are only decoded here, where they are used
+                    kwargs = decode_value(kwargs)
+                if isolation == "savepoint":
+                    with db.begin_nested() as savepoint:
+                        if "savepoint" in func_parameters:
+                            base_kwargs["savepoint"] = savepoint
+                        result = self.func(**base_kwargs, **kwargs)
+                elif isolation == "transaction":
+                    if "payload" in base_kwargs:
+                        # the stream may read from the connection released by the commit
+                        base_kwargs["payload"] = io.BytesIO(payload_stream.read())
+                    # keep the other tasks dispatched in the same batch loaded, otherwise each of them is reloaded
+                    # with another query
+                    expire_on_commit = db.expire_on_commit
+                    db.expire_on_commit = False
+                    try:
+                        db.commit()
+                    finally:
+                        db.expire_on_commit = expire_on_commit
+                    result = self.func(**base_kwargs, **kwargs)
+                else:
+                    result = self.func(**base_kwargs, **kwargs)
             except Exception as exc:
+                if isolation == "transaction":
+                    db.rollback()
+                if record_timestamps:
+                    task.started_at = started_at
+                    task.finished_at = datetime.datetime.now(datetime.timezone.utc)
                 logger.error("Unhandled exception for task %s", task.id, exc_info=True)
                 events.task_failure.send(self, task=task, exception=exc)
                 task.state = models.TaskState.FAILED
@@ -57,6 +173,9 @@ class Processor:
                     if retry_scheduled_at is not None:
                         task.state = models.TaskState.PENDING
                         task.scheduled_at = retry_scheduled_at
+                        if hasattr(task, "dedup_key"):
+                            # a newer task with the same key may be pending already
+                            task.dedup_key = None
                         if isinstance(retry_scheduled_at, datetime.datetime):
                             retry_scheduled_at_value = retry_scheduled_at
                         else:
@@ -82,9 +201,22 @@ class Processor:
                 return
             if self.auto_complete:
                 logger.info("Task %s auto complete", task.id)
+                if record_timestamps:
+                    task.started_at = started_at
+                    task.finished_at = datetime.datetime.now(datetime.timezone.utc)
                 task.state = models.TaskState.DONE
-                task.result = result
-                if event_cls is not None:
+                if self.keep_result_for == 0:
+                    task.result = null()
+                else:
+                    task.result = with_codec(result, self.codec)
+                if self.keep_kwargs_for == 0:
+                    task.kwargs = null()
+                if event_sink is not None:
+                    event_sink.add(
+                        db,
+                        [EventRecord(task_id=task.id, type=models.EventType.COMPLETE)],
+                    )
+                elif event_cls is not None:
                     event = event_cls(
                         task=task,
                         type=models.EventType.COMPLETE,
@@ -93,6 +225,8 @@ class Processor:
                 db.add(task)
             return result
         finally:
+            if payload_stream is not None:
+                payload_stream.close()
             current_task.reset(ctx_token)
 
 
@@ -106,15 +240,29 @@ class ProcessorHelper:
     def __call__(self, *args, **kwargs):
         return self._processor.func(*args, **kwargs)
 
-    def run(self, **kwargs) -> models.Task:
-        try:
-            parent = current_task.get()
-        except LookupError:
-            parent = None
+    def run(self, *, dedup_key: str | None = None, **kwargs) -> models.Task:
+        """Make a task of the processor with the kwargs
+
+        :param dedup_key: collapse the task into the pending one with the same key when submitted with
+            `BeanQueue.submit`, which requires a task model with `TaskModelDedupMixin`
+        """
+        extra = {}
+        # custom task models may not have the parent relationship
+        if hasattr(self._task_cls, "parent"):
+            try:
+                extra["parent"] = current_task.get()
+            except LookupError:
+                extra["parent"] = None
+        if dedup_key is not None:
+            if not hasattr(self._task_cls, "dedup_key"):
+                raise ValueError(
+                    f"Task model {self._task_cls.__name__} has no dedup_key column"
+                )
+            extra["dedup_key"] = dedup_key
         return self._task_cls(
             channel=self._processor.channel,
             module=self._processor.module,
             func_name=self._processor.name,
-            kwargs=kwargs,
-            parent=parent,
+            kwargs=with_codec(kwargs, self._processor.codec),
+            **extra,
         )
@@ -1,12 +1,16 @@
 import collections
 import logging
+import time
 import typing
 
 import venusian
+from sqlalchemy import inspect
 from sqlalchemy.orm import object_session
 
 from .. import constants
+from .. import events
 from .. import models
+from ..event_sinks import EventSink
 from .processor import Processor
 
 
@@ -18,34 +22,55 @@ class Registry:
     def add(self, processor: Processor):
         self.processors[processor.channel][processor.module][processor.name] = processor
 
+    def get(self, task: models.Task) -> Processor | None:
+        modules = self.processors.get(task.channel, {})
+        functions = modules.get(task.module, {})
+        return functions.get(task.func_name)
+
     def process(
         self,
         task: models.Task,
         event_cls: typing.Type | None = None,
+        event_sink: EventSink | None = None,
     ) -> typing.Any:
-        modules = self.processors.get(task.channel, {})
-        functions = modules.get(task.module, {})
-        processor: Processor = functions.get(task.func_name)
+        processor = self.get(task)
         db = object_session(task)
-        if processor is None:
-            self.logger.error(
-                "Cannot find processor for task %s with module=%s, func=%s",
-                task.id,
-                task.module,
-                task.func_name,
+        started_at = time.perf_counter()
+        if events.task_started.receivers:
+            events.task_started.send(
+                self, task=task, processor=processor, started_at=started_at
             )
-            task.state = models.TaskState.FAILED
-            task.error_message = f"Cannot find processor for task with module={task.module}, func={task.func_name}"
-            if event_cls is not None:
-                event = event_cls(
+        try:
+            if processor is None:
+                self.logger.error(
+                    "Cannot find processor for task %s with module=%s, func=%s",
+                    task.id,
+                    task.module,
+                    task.func_name,
+                )
+                task.state = models.TaskState.FAILED
+                task.error_message = f"Cannot find processor for task with module={task.module}, func={task.func_name}"
+                if event_cls is not None:
+                    event = event_cls(
+                        task=task,
+                        type=models.EventType.FAILED,
+                        error_message=task.error_message,
+                    )
+                    db.add(event)
+                db.add(task)
+                return
+            return processor.process(task, event_cls=event_cls, event_sink=event_sink)
+        finally:
+            if events.task_completed.receivers:
+                events.task_completed.send(
+                    self,
                     task=task,
-                    type=models.EventType.FAILED,
-                    error_message=task.error_message,
+                    processor=processor,
+                    # read the state without loading it, the task could be expired by the transaction isolation
+                    state=inspect(task).dict.get("state"),
+                    started_at=started_at,
+                    duration=time.perf_counter() - started_at,
                 )
-                db.add(event)
-            db.add(task)
-            return
-        return processor.process(task, event_cls=event_cls)
 
 
 def collect(packages: list[typing.Any], registry: Registry | None = None) -> Registry:
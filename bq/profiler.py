@@ -0,0 +1,104 @@
+import collections
+import logging
+import sys
+import threading
+import time
+import typing
+
+from . import events
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Threads to sample, the worker threads of the thread pool and the main thread running the dispatch loop
+DEFAULT_THREAD_NAME_PREFIXES = ("task_worker", "MainThread")
+UNKNOWN_TASK = "-"
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when another profile is still running"""
+
+
+class SamplingProfiler:
+    """Sample the stacks of the worker threads periodically and aggregate them into collapsed stacks, which can be
+    turned into a flamegraph with tools like flamegraph.pl or speedscope.
+
+    Each stack is prefixed with the thread name and the processor of the task running in the thread. The running
+    tasks are tracked by connecting to the task_started and task_completed signals only while profiling, so that
+    it costs nothing otherwise. Tasks already running when the profile starts are attributed to "-".
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.01,
+        thread_name_prefixes: typing.Sequence[str] = DEFAULT_THREAD_NAME_PREFIXES,
+    ):
+        self.interval = interval
+        self.thread_name_prefixes = tuple(thread_name_prefixes)
+        self._running_tasks: dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def _on_task_started(
+        self,
+        sender: typing.Any,
+        task: models.Task,
+        processor: typing.Any,
+        **kwargs: typing.Any,
+    ):
+        if processor is not None:
+            label = f"{processor.channel}:{processor.module}.{processor.name}"
+        else:
+            label = f"{task.channel}:{task.module}.{task.func_name}"
+        self._running_tasks[threading.get_ident()] = label
+
+    def _on_task_completed(self, sender: typing.Any, **kwargs: typing.Any):
+        self._running_tasks.pop(threading.get_ident(), None)
+
+    def _sample_once(self, stacks: collections.Counter, self_ident: int):
+        thread_names = {
+            thread.ident: thread.name
+            for thread in threading.enumerate()
+            if thread.name.startswith(self.thread_name_prefixes)
+        }
+        for ident, frame in sys._current_frames().items():
+            if ident == self_ident:
+                continue
+            thread_name = thread_names.get(ident)
+            if thread_name is None:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            frames.append(self._running_tasks.get(ident, UNKNOWN_TASK))
+            frames.append(thread_name)
+            frames.reverse()
+            stacks[";".join(frames)] += 1
+
+    def sample(self, seconds: float) -> collections.Counter:
+        """Sample the stacks for the given seconds, return the count of each collapsed stack"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("Another profile is running")
+        stacks = collections.Counter()
+        events.task_started.connect(self._on_task_started)
+        events.task_completed.connect(self._on_task_completed)
+        try:
+            self_ident = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                self._sample_once(stacks, self_ident)
+                time.sleep(self.interval)
+        finally:
+            events.task_started.disconnect(self._on_task_started)
+            events.task_completed.disconnect(self._on_task_completed)
+            self._running_tasks.clear()
+            self._lock.release()
+        return stacks
+
+    def profile(self, seconds: float) -> str:
+        """Sample the stacks for the given seconds, return them in collapsed stack format"""
+        stacks = self.sample(seconds)
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
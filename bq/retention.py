@@ -0,0 +1,170 @@
+import datetime
+import enum
+import io
+import json
+import logging
+import os
+import threading
+import typing
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from .services.retention import CompactionRule
+from .services.retention import RemovedCounts
+from .services.retention import RETENTION_LOCK_KEY
+from .services.retention import RetentionRule
+
+if typing.TYPE_CHECKING:
+    from .app import BeanQueue
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value: typing.Any) -> typing.Any:
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class NDJSONWriter:
+    """Write removed rows as newline delimited JSON, one object per row with the table name under "table" """
+
+    def __init__(self, file: typing.TextIO):
+        self.file = file
+
+    def __call__(self, table: str, row: dict[str, typing.Any]):
+        self.file.write(json.dumps(dict(table=table, row=row), default=_json_default))
+        self.file.write("\n")
+
+    def flush(self):
+        self.file.flush()
+        try:
+            os.fsync(self.file.fileno())
+        except (OSError, io.UnsupportedOperation):
+            # not a regular file, like stdout piped to another process
+            pass
+
+
+class Retention:
+    """Remove finished tasks past their retention in small batches, each batch in its own transaction with a pause
+    in between, to limit the WAL volume and lock time on a busy database.
+
+    Only one runner at a time holds the advisory lock, so the workers can all start the background thread and the
+    `archive` command can run alongside them. With a writer, the rows are flushed to it before each batch commits,
+    so a crash in between could write a batch twice but never lose it. The compaction rules clear the results and
+    kwargs of DONE tasks in the same way, before the tasks are removed.
+    """
+
+    def __init__(
+        self,
+        app: "BeanQueue",
+        rules: typing.Sequence[RetentionRule],
+        batch_size: int = 1000,
+        batch_interval: float = 0.1,
+        archive_suffix: str | None = None,
+        writer: NDJSONWriter | None = None,
+        compaction_rules: typing.Sequence[CompactionRule] = (),
+    ):
+        self.app = app
+        self.rules = list(rules)
+        self.compaction_rules = list(compaction_rules)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.archive_suffix = archive_suffix
+        self.writer = writer
+        self._shutdown_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run(self) -> RemovedCounts | None:
+        """Remove all the finished tasks past their retention, return None if another runner holds the lock"""
+        with self.app.engine.connect() as lock_conn:
+            if not lock_conn.scalar(
+                select(func.pg_try_advisory_lock(RETENTION_LOCK_KEY))
+            ):
+                return None
+            # the lock is session level, no need to keep the transaction open
+            lock_conn.commit()
+            try:
+                return self._run()
+            finally:
+                lock_conn.scalar(select(func.pg_advisory_unlock(RETENTION_LOCK_KEY)))
+                lock_conn.commit()
+
+    def _run(self) -> RemovedCounts:
+        total = RemovedCounts()
+        with self.app.make_session() as db:
+            service = self.app._make_retention_service(db)
+            for rule in self.rules:
+                while not self._shutdown_event.is_set():
+                    counts = service.remove_batch(
+                        rule,
+                        limit=self.batch_size,
+                        archive_suffix=self.archive_suffix,
+                        writer=self.writer,
+                    )
+                    if self.writer is not None:
+                        self.writer.flush()
+                    db.commit()
+                    total += counts
+                    logger.debug(
+                        "Removed %s tasks and %s events of %s",
+                        counts.tasks,
+                        counts.events,
+                        rule,
+                    )
+                    if counts.tasks < self.batch_size:
+                        break
+                    if self._shutdown_event.wait(self.batch_interval):
+                        break
+            for compaction_rule in self.compaction_rules:
+                while not self._shutdown_event.is_set():
+                    compacted = service.compact_batch(
+                        compaction_rule, limit=self.batch_size
+                    )
+                    db.commit()
+                    total.compacted += compacted
+                    logger.debug("Compacted %s tasks of %s", compacted, compaction_rule)
+                    if compacted < self.batch_size:
+                        break
+                    if self._shutdown_event.wait(self.batch_interval):
+                        break
+        return total
+
+    def run_periodically(self, interval: float):
+        while not self._shutdown_event.wait(interval):
+            try:
+                counts = self.run()
+            except Exception:
+                logger.exception("Failed to remove finished tasks")
+                continue
+            if counts is None:
+                logger.debug("Retention is running elsewhere, skip")
+            else:
+                if counts.tasks:
+                    logger.info(
+                        "Removed %s finished tasks and %s events past retention",
+                        counts.tasks,
+                        counts.events,
+                    )
+                if counts.compacted:
+                    logger.info(
+                        "Cleared results or kwargs of %s DONE tasks", counts.compacted
+                    )
+
+    def start(self, interval: float):
+        self._thread = threading.Thread(
+            target=self.run_periodically, args=(interval,), name="retention"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        self._shutdown_event.set()
+        if self._thread is not None:
+            self._thread.join(5)
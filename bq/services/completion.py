@@ -0,0 +1,169 @@
+import dataclasses
+import datetime
+import typing
+
+from sqlalchemy import cast
+from sqlalchemy import column
+from sqlalchemy import insert
+from sqlalchemy import literal
+from sqlalchemy import select
+from sqlalchemy import values
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ClauseElement
+
+from .. import models
+from ..event_sinks import EventRecord
+from ..event_sinks import EventSink
+from ..payloads import has_stores
+from ..payloads import make_reference_query
+from ..payloads import offload_value
+from ..payloads import remove_payload
+
+
+@dataclasses.dataclass(frozen=True)
+class Completion:
+    task_id: typing.Any
+    result: typing.Any = None
+    # only written if the task model has the timestamp columns
+    started_at: datetime.datetime | None = None
+    finished_at: datetime.datetime | None = None
+
+
+class CompletionService:
+    def __init__(
+        self,
+        session: Session,
+        task_model: typing.Type = models.Task,
+        event_model: typing.Type | None = models.Event,
+        event_sink: EventSink | None = None,
+    ):
+        self.session = session
+        self.task_model: typing.Type[models.Task] = task_model
+        self.event_model: typing.Type[models.Event] | None = event_model
+        # record the COMPLETE events with the sink instead of inserting them along with the update
+        self.event_sink = event_sink
+
+    def _result_value(self, result: typing.Any) -> typing.Any:
+        if result is None:
+            # stored as JSON null like the results written through the ORM, None would be rendered as an untyped
+            # NULL and a batch of only those fails as Postgres picks text for the VALUES column
+            return cast(literal("null"), JSONB)
+        if isinstance(result, ClauseElement):
+            # SQL expressions like null() for clearing the result are not typed in the VALUES list
+            return cast(result, JSONB)
+        return result
+
+    def make_update_query(
+        self, completions: typing.Sequence[Completion], worker_id: typing.Any
+    ):
+        task_table = self.task_model.__table__
+        with_timestamps = "started_at" in task_table.c
+        columns = [
+            column("id", task_table.c.id.type),
+            # the type of the column, so that its codec applies
+            column("result", task_table.c.result.type),
+        ]
+        if with_timestamps:
+            columns.extend(
+                [
+                    column("started_at", task_table.c.started_at.type),
+                    column("finished_at", task_table.c.finished_at.type),
+                ]
+            )
+        rows = values(*columns, name="completions").data(
+            [
+                (
+                    completion.task_id,
+                    self._result_value(completion.result),
+                    completion.started_at,
+                    completion.finished_at,
+                )
+                if with_timestamps
+                else (completion.task_id, self._result_value(completion.result))
+                for completion in completions
+            ]
+        )
+        update_values = dict(
+            state=models.TaskState.DONE,
+            result=rows.c.result,
+        )
+        if with_timestamps:
+            update_values.update(
+                started_at=rows.c.started_at,
+                finished_at=rows.c.finished_at,
+            )
+        return (
+            task_table.update()
+            .where(task_table.c.id == rows.c.id)
+            # the tasks could be rescheduled by other workers if we were considered dead, don't overwrite them
+            .where(task_table.c.state == models.TaskState.PROCESSING)
+            .where(task_table.c.worker_id == worker_id)
+            .values(**update_values)
+            .returning(task_table.c.id)
+        )
+
+    def make_complete_query(
+        self, completions: typing.Sequence[Completion], worker_id: typing.Any
+    ):
+        update_query = self.make_update_query(completions, worker_id=worker_id)
+        if self.event_model is None or self.event_sink is not None:
+            return update_query
+        event_table = self.event_model.__table__
+        completed = update_query.cte("completed")
+        return insert(event_table).from_select(
+            [event_table.c.task_id, event_table.c.type],
+            select(
+                completed.c.id,
+                literal(models.EventType.COMPLETE, event_table.c.type.type),
+            ),
+        )
+
+    def complete(
+        self, completions: typing.Sequence[Completion], worker_id: typing.Any
+    ) -> int:
+        connection = self.session.connection()
+        replaced = []
+        if has_stores():
+            # the payloads of the results replaced by the completions are not referenced anymore, lock the tasks so
+            # that the update below writes exactly these ones
+            task_table = self.task_model.__table__
+            replaced = [
+                reference
+                for _, reference in connection.execute(
+                    make_reference_query(task_table, "result")
+                    .where(
+                        task_table.c.id.in_(
+                            [completion.task_id for completion in completions]
+                        )
+                    )
+                    .where(task_table.c.state == models.TaskState.PROCESSING)
+                    .where(task_table.c.worker_id == worker_id)
+                    .with_for_update()
+                )
+            ]
+        # the large results go into the payload store like the ones written through the ORM
+        completions = [
+            dataclasses.replace(
+                completion,
+                result=offload_value(connection, completion.task_id, completion.result),
+            )
+            for completion in completions
+        ]
+        res = self.session.execute(
+            self.make_complete_query(completions, worker_id=worker_id)
+        )
+        for reference in replaced:
+            remove_payload(connection, reference)
+        if self.event_sink is None:
+            return res.rowcount
+        task_ids = frozenset(res.scalars())
+        self.event_sink.add(
+            self.session,
+            [
+                EventRecord(task_id=completion.task_id, type=models.EventType.COMPLETE)
+                for completion in completions
+                if completion.task_id in task_ids
+            ],
+        )
+        return len(task_ids)
@@ -1,15 +1,22 @@
 import dataclasses
+import datetime
 import select
+import threading
+import time
 import typing
 import uuid
 
 from sqlalchemy import func
 from sqlalchemy import null
 from sqlalchemy import or_
+from sqlalchemy.orm import defer
 from sqlalchemy.orm import Query
+from sqlalchemy.orm.attributes import set_committed_value
 
+from .. import events
 from .. import models
 from ..db.session import Session
+from ..utils import Waker
 
 
 @dataclasses.dataclass(frozen=True)
@@ -19,7 +26,53 @@ class Notification:
     payload: typing.Optional[str] = None
 
 
+@dataclasses.dataclass(frozen=True)
+class ClaimedTask:
+    id: typing.Any
+    channel: str
+    # seconds between the task becoming ready (created or scheduled) and being claimed, with the database clock
+    queue_wait: float
+
+
+class DeferredColumnLoader:
+    """Load a deferred column of a batch of claimed tasks with one query, once the first of them needs it. Meant
+    to be shared by the threads processing the batch, each of them takes its own value with its own session.
+    """
+
+    def __init__(
+        self,
+        task_model: typing.Type,
+        column: str,
+        task_ids: typing.Sequence[typing.Any],
+    ):
+        self.task_model: typing.Type[models.Task] = task_model
+        self.column = column
+        self.task_ids = list(task_ids)
+        self._lock = threading.Lock()
+        self._values: dict[typing.Any, typing.Any] | None = None
+
+    def load(self, session: Session, task_id: typing.Any) -> typing.Any:
+        with self._lock:
+            if self._values is None:
+                self._values = dict(
+                    session.query(
+                        self.task_model.id, getattr(self.task_model, self.column)
+                    )
+                    .filter(self.task_model.id.in_(self.task_ids))
+                    .all()
+                )
+            # each value is only taken once, release it as soon as possible
+            return self._values.pop(task_id, None)
+
+    def apply(self, session: Session, task: models.Task):
+        """Set the loaded value to the task as if it was loaded with the task"""
+        set_committed_value(task, self.column, self.load(session, task.id))
+
+
 class DispatchService:
+    # columns not needed for processing the claimed tasks, loaded only when accessed
+    DEFERRED_COLUMNS = ("result", "error_message")
+
     def __init__(self, session: Session, task_model: typing.Type = models.Task):
         self.session = session
         self.task_model: typing.Type[models.Task] = task_model
@@ -29,8 +82,10 @@ class DispatchService:
         channels: typing.Sequence[str],
         limit: int = 1,
         now: typing.Any = func.now(),
+        min_created_at: datetime.datetime | None = None,
+        order_by_id: bool = False,
     ) -> Query:
-        return (
+        query = (
             self.session.query(self.task_model.id)
             .filter(self.task_model.channel.in_(channels))
             .filter(self.task_model.state == models.TaskState.PENDING)
@@ -40,20 +95,47 @@ class DispatchService:
                     now >= self.task_model.scheduled_at,
                 )
             )
-            .order_by(self.task_model.created_at)
+        )
+        if min_created_at is not None:
+            # let the planner prune the partitions without any pending task
+            query = query.filter(self.task_model.created_at >= min_created_at)
+        return (
+            # time-ordered ids like UUIDv7 follow the creation order without looking at created_at
+            query.order_by(
+                self.task_model.id if order_by_id else self.task_model.created_at
+            )
             .limit(limit)
             .with_for_update(skip_locked=True)
         )
 
     def make_update_query(self, task_query: typing.Any, worker_id: typing.Any):
+        values = dict(
+            state=models.TaskState.PROCESSING,
+            worker_id=worker_id,
+        )
+        if hasattr(self.task_model, "dispatched_at"):
+            values.update(
+                dispatched_at=func.now(),
+                # clear the timestamps of the previous attempt
+                started_at=None,
+                finished_at=None,
+            )
         return (
             self.task_model.__table__.update()
             .where(self.task_model.id.in_(task_query))
-            .values(
-                state=models.TaskState.PROCESSING,
-                worker_id=worker_id,
+            .values(**values)
+            .returning(
+                self.task_model.id,
+                self.task_model.channel,
+                # how long the task has been ready for processing, greatest() ignores NULL scheduled_at
+                func.extract(
+                    "epoch",
+                    func.statement_timestamp()
+                    - func.greatest(
+                        self.task_model.created_at, self.task_model.scheduled_at
+                    ),
+                ),
             )
-            .returning(self.task_model.id)
         )
 
     def dispatch(
@@ -62,19 +144,60 @@ class DispatchService:
         worker_id: uuid.UUID,
         limit: int = 1,
         now: typing.Any = func.now(),
+        min_created_at: datetime.datetime | None = None,
+        order_by_id: bool = False,
+        defer_kwargs: bool = False,
     ) -> Query:
-        task_query = self.make_task_query(channels, limit=limit, now=now)
+        """Claim pending tasks for the worker and return the query of them
+
+        :param defer_kwargs: leave kwargs out of the query too, for loading them in bulk with
+            `DeferredColumnLoader` or lazily when accessed
+        """
+        task_query = self.make_task_query(
+            channels,
+            limit=limit,
+            now=now,
+            min_created_at=min_created_at,
+            order_by_id=order_by_id,
+        )
         task_subquery = task_query.scalar_subquery()
-        task_ids = [
-            item[0]
-            for item in self.session.execute(
-                self.make_update_query(task_subquery, worker_id=worker_id)
+        started_at = time.perf_counter()
+        if events.dispatch_started.receivers:
+            events.dispatch_started.send(
+                self, channels=channels, limit=limit, started_at=started_at
+            )
+        rows = self.session.execute(
+            self.make_update_query(task_subquery, worker_id=worker_id)
+        ).all()
+        task_ids = [row[0] for row in rows]
+        if events.dispatch_finished.receivers:
+            events.dispatch_finished.send(
+                self,
+                channels=channels,
+                limit=limit,
+                claimed=[
+                    ClaimedTask(
+                        id=task_id, channel=channel, queue_wait=float(queue_wait)
+                    )
+                    for task_id, channel, queue_wait in rows
+                ],
+                started_at=started_at,
+                duration=time.perf_counter() - started_at,
             )
-        ]
         # TODO: ideally returning with (self.task_model) should return the whole model, but SQLAlchemy is returning
         #       it columns in rows. We can save a round trip if we can find out how to solve this
-        return self.session.query(self.task_model).filter(
-            self.task_model.id.in_(task_ids)
+        return self.make_load_query(task_ids, defer_kwargs=defer_kwargs)
+
+    def make_load_query(
+        self, task_ids: typing.Sequence[typing.Any], defer_kwargs: bool = False
+    ) -> Query:
+        columns = list(self.DEFERRED_COLUMNS)
+        if defer_kwargs:
+            columns.append("kwargs")
+        return (
+            self.session.query(self.task_model)
+            .filter(self.task_model.id.in_(task_ids))
+            .options(*(defer(getattr(self.task_model, column)) for column in columns))
         )
 
     def listen(self, channels: typing.Sequence[str]):
@@ -83,7 +206,14 @@ class DispatchService:
             quoted_channel = conn.dialect.identifier_preparer.quote_identifier(channel)
             conn.exec_driver_sql(f"LISTEN {quoted_channel}")
 
-    def poll(self, timeout: int = 5) -> typing.Generator[Notification, None, None]:
+    def poll(
+        self, timeout: int = 5, waker: Waker | None = None
+    ) -> typing.Generator[Notification, None, None]:
+        """Poll notifications of the listened channels
+
+        :param timeout: raise TimeoutError if nothing received before the timeout
+        :param waker: also return when the waker is woken up, yield nothing if there's no notification
+        """
         conn = self.session.connection()
         driver_conn = conn.connection.driver_connection
 
@@ -102,10 +232,16 @@ class DispatchService:
             yield from pop_notifies()
         else:
             # okay, nothing, let's select and wait for new stuff
-            if select.select([driver_conn], [], [], timeout) == ([], [], []):
+            readers = [driver_conn]
+            if waker is not None:
+                readers.append(waker)
+            ready, _, _ = select.select(readers, [], [], timeout)
+            if not ready:
                 # nope, nothing, times out
                 raise TimeoutError("Timeout waiting for new notifications")
-            else:
+            if waker is not None and waker in ready:
+                waker.drain()
+            if driver_conn in ready:
                 # yep, we got something
                 driver_conn.poll()
                 yield from pop_notifies()
@@ -0,0 +1,118 @@
+import dataclasses
+import datetime
+import typing
+
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .. import models
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+@dataclasses.dataclass(frozen=True)
+class Percentiles:
+    p50: float | None
+    p95: float | None
+    p99: float | None
+
+
+@dataclasses.dataclass(frozen=True)
+class ProcessorLatency:
+    channel: str
+    module: str
+    func_name: str
+    # number of finished tasks in the window
+    count: int
+    # seconds between the task becoming ready (created or scheduled) and being dispatched
+    wait: Percentiles
+    # seconds spent on running the processor function
+    run: Percentiles
+
+
+class LatencyService:
+    """Query latency percentiles of finished tasks, requires the task model to have the columns of
+    `TaskModelTimestampsMixin`
+
+    """
+
+    def __init__(self, session: Session, task_model: typing.Type = models.Task):
+        self.session = session
+        self.task_model: typing.Type[models.Task] = task_model
+
+    def make_latency_query(
+        self,
+        since: datetime.datetime,
+        until: datetime.datetime | None = None,
+        channels: typing.Sequence[str] | None = None,
+    ):
+        if not hasattr(self.task_model, "finished_at"):
+            raise ValueError(
+                f"Task model {self.task_model.__name__} has no timestamp columns, "
+                "please add TaskModelTimestampsMixin to it"
+            )
+        wait = func.extract(
+            "epoch",
+            self.task_model.dispatched_at
+            - func.greatest(self.task_model.created_at, self.task_model.scheduled_at),
+        )
+        run = func.extract(
+            "epoch", self.task_model.finished_at - self.task_model.started_at
+        )
+        query = (
+            select(
+                self.task_model.channel,
+                self.task_model.module,
+                self.task_model.func_name,
+                func.count(),
+                *(
+                    func.percentile_cont(percentile).within_group(wait)
+                    for percentile in PERCENTILES
+                ),
+                *(
+                    func.percentile_cont(percentile).within_group(run)
+                    for percentile in PERCENTILES
+                ),
+            )
+            .where(self.task_model.finished_at >= since)
+            .group_by(
+                self.task_model.channel,
+                self.task_model.module,
+                self.task_model.func_name,
+            )
+            .order_by(
+                self.task_model.channel,
+                self.task_model.module,
+                self.task_model.func_name,
+            )
+        )
+        if until is not None:
+            query = query.where(self.task_model.finished_at < until)
+        if channels is not None:
+            query = query.where(self.task_model.channel.in_(channels))
+        return query
+
+    def get_latency(
+        self,
+        since: datetime.datetime,
+        until: datetime.datetime | None = None,
+        channels: typing.Sequence[str] | None = None,
+    ) -> list[ProcessorLatency]:
+        return [
+            ProcessorLatency(
+                channel=channel,
+                module=module,
+                func_name=func_name,
+                count=count,
+                wait=Percentiles(*_to_floats(row[0:3])),
+                run=Percentiles(*_to_floats(row[3:6])),
+            )
+            for channel, module, func_name, count, *row in self.session.execute(
+                self.make_latency_query(since, until=until, channels=channels)
+            )
+        ]
+
+
+def _to_floats(values: typing.Sequence[typing.Any]) -> list[float | None]:
+    return [float(value) if value is not None else None for value in values]
@@ -0,0 +1,229 @@
+import dataclasses
+import typing
+
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .. import models
+from .queue_depth import QueueDepthService
+
+
+@dataclasses.dataclass(frozen=True)
+class ChannelOverview:
+    channel: str
+    # number of pending tasks, including the scheduled ones
+    pending: int
+    processing: int
+    # number of pending tasks scheduled to run in the future
+    scheduled: int
+    # seconds since the oldest pending task became ready to run
+    oldest_pending_age: float | None
+    # total number of done and failed tasks, only available with the queue depth counters
+    done: int | None = None
+    failed: int | None = None
+
+
+@dataclasses.dataclass(frozen=True)
+class WorkerOverview:
+    id: typing.Any
+    name: str
+    channels: list[str]
+    # seconds since the last heartbeat
+    heartbeat_age: float
+    # number of tasks the worker is processing
+    in_flight: int
+
+
+@dataclasses.dataclass(frozen=True)
+class Overview:
+    channels: list[ChannelOverview]
+    workers: list[WorkerOverview]
+
+
+class OverviewService:
+    """Summarize channels and running workers for monitoring.
+
+    Only the pending and processing tasks are aggregated, which the state index narrows down to the active part of
+    the task table, so that it stays cheap no matter how many finished tasks are kept. When the queue depth
+    counters are available, the counts per state are read from them instead, including the done and failed totals,
+    and only the pending tasks of the channels having any are looked up for the scheduled count and the oldest age.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        task_model: typing.Type = models.Task,
+        worker_model: typing.Type = models.Worker,
+        queue_depth_model: typing.Type | None = None,
+    ):
+        self.session = session
+        self.task_model: typing.Type[models.Task] = task_model
+        self.worker_model: typing.Type[models.Worker] = worker_model
+        self.queue_depth_model: typing.Type[models.QueueDepth] | None = (
+            queue_depth_model
+        )
+
+    def _make_pending_columns(self) -> tuple:
+        """Make the columns of the scheduled count and the oldest pending age, for aggregating pending tasks"""
+        pending = self.task_model.state == models.TaskState.PENDING
+        scheduled = self.task_model.scheduled_at > func.now()
+        return (
+            func.count().filter(pending & scheduled),
+            func.extract(
+                "epoch",
+                func.now()
+                - func.min(
+                    func.greatest(
+                        self.task_model.created_at, self.task_model.scheduled_at
+                    )
+                ).filter(pending & ~func.coalesce(scheduled, False)),
+            ),
+        )
+
+    def make_channel_query(self, channels: typing.Sequence[str] | None = None):
+        query = (
+            select(
+                self.task_model.channel,
+                func.count().filter(self.task_model.state == models.TaskState.PENDING),
+                func.count().filter(
+                    self.task_model.state == models.TaskState.PROCESSING
+                ),
+                *self._make_pending_columns(),
+            )
+            .where(
+                self.task_model.state.in_(
+                    [models.TaskState.PENDING, models.TaskState.PROCESSING]
+                )
+            )
+            .group_by(self.task_model.channel)
+        )
+        if channels is not None:
+            query = query.where(self.task_model.channel.in_(channels))
+        return query
+
+    def make_pending_query(self, channels: typing.Sequence[str]):
+        """Make the query of the scheduled count and the oldest pending age of the channels, which only reads the
+        pending tasks
+        """
+        return (
+            select(self.task_model.channel, *self._make_pending_columns())
+            .where(self.task_model.state == models.TaskState.PENDING)
+            .where(self.task_model.channel.in_(channels))
+            .group_by(self.task_model.channel)
+        )
+
+    def make_worker_query(self, channels: typing.Sequence[str] | None = None):
+        in_flight = (
+            select(
+                self.task_model.worker_id,
+                func.count().label("count"),
+            )
+            .where(self.task_model.state == models.TaskState.PROCESSING)
+            .group_by(self.task_model.worker_id)
+            .subquery()
+        )
+        query = (
+            select(
+                self.worker_model.id,
+                self.worker_model.name,
+                self.worker_model.channels,
+                func.extract("epoch", func.now() - self.worker_model.last_heartbeat),
+                func.coalesce(in_flight.c.count, 0),
+            )
+            .outerjoin(in_flight, in_flight.c.worker_id == self.worker_model.id)
+            .where(self.worker_model.state == models.WorkerState.RUNNING)
+            .order_by(self.worker_model.created_at)
+        )
+        if channels is not None:
+            query = query.where(self.worker_model.channels.overlap(list(channels)))
+        return query
+
+    def get_channels(
+        self, channels: typing.Sequence[str] | None = None
+    ) -> list[ChannelOverview]:
+        if self.queue_depth_model is not None:
+            return self._get_channels_from_counters(channels)
+        rows = {
+            channel: (pending, processing, scheduled, oldest_pending_age)
+            for channel, pending, processing, scheduled, oldest_pending_age in (
+                self.session.execute(self.make_channel_query(channels))
+            )
+        }
+        result = []
+        for channel in sorted(rows):
+            pending, processing, scheduled, oldest_pending_age = rows[channel]
+            result.append(
+                ChannelOverview(
+                    channel=channel,
+                    pending=pending,
+                    processing=processing,
+                    scheduled=scheduled,
+                    oldest_pending_age=float(oldest_pending_age)
+                    if oldest_pending_age is not None
+                    else None,
+                )
+            )
+        return result
+
+    def _get_channels_from_counters(
+        self, channels: typing.Sequence[str] | None = None
+    ) -> list[ChannelOverview]:
+        depth = QueueDepthService(
+            self.session,
+            task_model=self.task_model,
+            queue_depth_model=self.queue_depth_model,
+        ).get_depth(channels)
+        pending_channels = sorted(
+            channel
+            for channel, states in depth.items()
+            if states.get(models.TaskState.PENDING, 0) > 0
+        )
+        pending_rows = {}
+        if pending_channels:
+            pending_rows = {
+                channel: (scheduled, oldest_pending_age)
+                for channel, scheduled, oldest_pending_age in self.session.execute(
+                    self.make_pending_query(pending_channels)
+                )
+            }
+        result = []
+        for channel in sorted(depth):
+            states = depth[channel]
+            scheduled, oldest_pending_age = pending_rows.get(channel, (0, None))
+            result.append(
+                ChannelOverview(
+                    channel=channel,
+                    pending=states.get(models.TaskState.PENDING, 0),
+                    processing=states.get(models.TaskState.PROCESSING, 0),
+                    scheduled=scheduled,
+                    oldest_pending_age=float(oldest_pending_age)
+                    if oldest_pending_age is not None
+                    else None,
+                    done=states.get(models.TaskState.DONE, 0),
+                    failed=states.get(models.TaskState.FAILED, 0),
+                )
+            )
+        return result
+
+    def get_workers(
+        self, channels: typing.Sequence[str] | None = None
+    ) -> list[WorkerOverview]:
+        return [
+            WorkerOverview(
+                id=id,
+                name=name,
+                channels=worker_channels,
+                heartbeat_age=float(heartbeat_age),
+                in_flight=in_flight,
+            )
+            for id, name, worker_channels, heartbeat_age, in_flight in (
+                self.session.execute(self.make_worker_query(channels))
+            )
+        ]
+
+    def get_overview(self, channels: typing.Sequence[str] | None = None) -> Overview:
+        return Overview(
+            channels=self.get_channels(channels),
+            workers=self.get_workers(channels),
+        )
@@ -0,0 +1,393 @@
+import dataclasses
+import datetime
+import logging
+import re
+import typing
+
+from sqlalchemy import bindparam
+from sqlalchemy import func
+from sqlalchemy import Index
+from sqlalchemy import inspect
+from sqlalchemy import MetaData
+from sqlalchemy import select
+from sqlalchemy import Table
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock key for making sure only one worker creates and drops partitions at a time
+PARTITION_LOCK_KEY = 0x62715F7074  # "bq_pt"
+
+PartitionBy = typing.Literal["created_at", "state"]
+PartitionInterval = typing.Literal["day", "week", "month"]
+StorageParameters = typing.Mapping[str, int | float]
+
+ACTIVE_STATES = (models.TaskState.PENDING, models.TaskState.PROCESSING)
+FINISHED_STATES = (models.TaskState.DONE, models.TaskState.FAILED)
+
+_RANGE_PARTITION_PATTERN = re.compile(r"_p(\d{8})$")
+_STORAGE_PARAMETER_PATTERN = re.compile(r"^[a-z_.]+$")
+
+
+@dataclasses.dataclass(frozen=True)
+class Partition:
+    name: str
+    # start of the created_at range, None for the default or state partitions
+    start: datetime.datetime | None
+
+
+def truncate_datetime(
+    value: datetime.datetime, interval: PartitionInterval
+) -> datetime.datetime:
+    """Truncate the datetime to the start of its partition range in UTC"""
+    value = value.astimezone(datetime.timezone.utc).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    if interval == "week":
+        value -= datetime.timedelta(days=value.weekday())
+    elif interval == "month":
+        value = value.replace(day=1)
+    return value
+
+
+def next_datetime(
+    value: datetime.datetime, interval: PartitionInterval
+) -> datetime.datetime:
+    """Start of the partition range after the one starting at the given datetime"""
+    if interval == "day":
+        return value + datetime.timedelta(days=1)
+    elif interval == "week":
+        return value + datetime.timedelta(weeks=1)
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+class PartitionService:
+    """Create the task and event tables as declaratively partitioned tables and manage their partitions.
+
+    With "created_at", both tables are partitioned by ranges of created_at. Partitions are created ahead of time,
+    and the old ones are dropped (or detached) once all of their tasks are finished, which is instant compared to
+    deleting the rows. Since new tasks always land in the latest partitions, and a task can only become pending again
+    while it's pending or processing, the start of the oldest partition with any active task is a safe lower bound
+    for dispatching, which lets the planner prune the older partitions.
+
+    With "state", the task table is split into a partition of pending and processing tasks and a partition of
+    finished ones, so that dispatching only touches the small active partition. The event table is left as is.
+
+    The primary key of a partitioned table has to include the partition key, and foreign keys can only reference
+    the whole primary key, so the foreign keys referencing the task table are not created in partitioned mode.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        task_model: typing.Type = models.Task,
+        event_model: typing.Type | None = models.Event,
+    ):
+        self.session = session
+        self.task_model: typing.Type[models.Task] = task_model
+        self.event_model: typing.Type[models.Event] | None = event_model
+
+    def _quote(self, name: str) -> str:
+        return self.session.get_bind().dialect.identifier_preparer.quote(name)
+
+    def managed_tables(self) -> list[Table]:
+        """The task and event tables, which are created by this service in partitioned mode"""
+        tables = [self.task_model.__table__]
+        if self.event_model is not None:
+            tables.append(self.event_model.__table__)
+        return tables
+
+    def partitioned_tables(self, partition_by: PartitionBy) -> list[Table]:
+        if partition_by == "created_at":
+            return self.managed_tables()
+        return [self.task_model.__table__]
+
+    def make_table(
+        self, table: Table, partition_by: PartitionBy | None, metadata: MetaData
+    ) -> Table:
+        """Copy the table without foreign keys, partitioned by the given column"""
+        kwargs = {}
+        if partition_by == "created_at":
+            kwargs["postgresql_partition_by"] = "RANGE (created_at)"
+        elif partition_by == "state":
+            kwargs["postgresql_partition_by"] = "LIST (state)"
+        columns = []
+        for column in table.columns:
+            copied = column._copy()
+            # the indexes are copied from the table below
+            copied.index = None
+            if column.name == partition_by:
+                copied.primary_key = True
+            columns.append(copied)
+        copied_table = Table(table.name, metadata, *columns, **kwargs)
+        for index in table.indexes:
+            column_names = [column.name for column in index.columns]
+            if partition_by == "state" and column_names == ["state"]:
+                # partition pruning already tells the states apart, and without indexing the state, claiming a
+                # task in the active partition can be a HOT update
+                continue
+            if (
+                index.unique
+                and partition_by is not None
+                and partition_by not in column_names
+            ):
+                # like the pending dedup keys, which can only be partitioned by state
+                raise ValueError(
+                    f"Unique index {index.name} doesn't include the partition column {partition_by}"
+                )
+            Index(
+                index.name,
+                *(copied_table.c[name] for name in column_names),
+                unique=index.unique,
+                **index.kwargs,
+            )
+        return copied_table
+
+    def create_tables(
+        self,
+        partition_by: PartitionBy,
+        interval: PartitionInterval = "day",
+        premake: int = 3,
+        storage_parameters: typing.Mapping[str, StorageParameters] | None = None,
+    ):
+        """Create the task and event tables with the partitioned ones along with their first partitions. The other
+        tables they reference are expected to be created before.
+
+        :param storage_parameters: storage parameters of the "active" and "finished" partitions in state mode
+        """
+        partitioned_tables = self.partitioned_tables(partition_by)
+        task_table = self.task_model.__table__
+        metadata = MetaData()
+        conn = self.session.connection()
+        for table in self.managed_tables():
+            if inspect(conn).has_table(table.name):
+                continue
+            self.make_table(
+                table,
+                partition_by if table in partitioned_tables else None,
+                metadata,
+            ).create(conn, checkfirst=True)
+            for constraint in table.foreign_key_constraints:
+                if constraint.referred_table is task_table:
+                    logger.info(
+                        "Skip foreign key %s of table %s referencing partitioned table %s",
+                        constraint.name,
+                        table.name,
+                        task_table.name,
+                    )
+                    continue
+                self.session.execute(
+                    text(
+                        f"ALTER TABLE {self._quote(table.name)} ADD CONSTRAINT {self._quote(constraint.name)} "
+                        f"FOREIGN KEY ({', '.join(self._quote(column.name) for column in constraint.columns)}) "
+                        f"REFERENCES {self._quote(constraint.referred_table.name)} "
+                        f"({', '.join(self._quote(element.column.name) for element in constraint.elements)})"
+                    )
+                )
+        if partition_by == "state":
+            self._create_state_partitions(
+                self.task_model.__table__, storage_parameters or {}
+            )
+        else:
+            for table in partitioned_tables:
+                self.session.execute(
+                    text(
+                        f"CREATE TABLE IF NOT EXISTS {self._quote(f'{table.name}_default')} "
+                        f"PARTITION OF {self._quote(table.name)} DEFAULT"
+                    )
+                )
+            self.create_partitions(interval=interval, premake=premake)
+
+    def _create_state_partitions(
+        self,
+        table: Table,
+        storage_parameters: typing.Mapping[str, StorageParameters],
+    ):
+        for suffix, states in (
+            ("active", ACTIVE_STATES),
+            ("finished", FINISHED_STATES),
+        ):
+            name = f"{table.name}_{suffix}"
+            values = ", ".join(f"'{state.value}'" for state in states)
+            self.session.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {self._quote(name)} "
+                    f"PARTITION OF {self._quote(table.name)} FOR VALUES IN ({values})"
+                )
+            )
+            self.set_storage_parameters(name, storage_parameters.get(suffix, {}))
+
+    def set_storage_parameters(self, table_name: str, parameters: StorageParameters):
+        """Set storage parameters, like fillfactor and the autovacuum thresholds, of the table"""
+        if not parameters:
+            return
+        for key in parameters:
+            if not _STORAGE_PARAMETER_PATTERN.match(key):
+                raise ValueError(f"Invalid storage parameter {key!r}")
+        values = ", ".join(
+            f"{key} = {float(value) if isinstance(value, float) else int(value)}"
+            for key, value in parameters.items()
+        )
+        self.session.execute(
+            text(f"ALTER TABLE {self._quote(table_name)} SET ({values})")
+        )
+
+    def list_partitions(self, table: Table) -> list[Partition]:
+        names = self.session.scalars(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = CAST(:table AS regclass) "
+                "ORDER BY child.relname"
+            ),
+            dict(table=self._quote(table.name)),
+        ).all()
+        partitions = []
+        for name in names:
+            start = None
+            match = _RANGE_PARTITION_PATTERN.search(name)
+            if match is not None and name == f"{table.name}{match.group(0)}":
+                start = datetime.datetime.strptime(match.group(1), "%Y%m%d").replace(
+                    tzinfo=datetime.timezone.utc
+                )
+            partitions.append(Partition(name=name, start=start))
+        return partitions
+
+    def create_partitions(
+        self,
+        interval: PartitionInterval = "day",
+        premake: int = 3,
+        now: datetime.datetime | None = None,
+    ) -> list[str]:
+        """Create the created_at partitions of the current range and `premake` ranges after it if missing,
+        return the names of the created partitions
+        """
+        if now is None:
+            now = self.session.scalar(select(func.now()))
+        created = []
+        for table in self.partitioned_tables("created_at"):
+            existing = {partition.name for partition in self.list_partitions(table)}
+            start = truncate_datetime(now, interval)
+            for _ in range(premake + 1):
+                end = next_datetime(start, interval)
+                name = f"{table.name}_p{start:%Y%m%d}"
+                if name not in existing:
+                    self.session.execute(
+                        text(
+                            f"CREATE TABLE {self._quote(name)} PARTITION OF {self._quote(table.name)} "
+                            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                        )
+                    )
+                    created.append(name)
+                start = end
+        return created
+
+    def _has_active_tasks(self, partition_name: str) -> bool:
+        return self.session.scalar(
+            text(
+                f"SELECT EXISTS (SELECT 1 FROM {self._quote(partition_name)} WHERE state IN :states)"
+            ).bindparams(bindparam("states", expanding=True)),
+            dict(states=[state.value for state in ACTIVE_STATES]),
+        )
+
+    def drop_partitions(
+        self,
+        before: datetime.datetime,
+        interval: PartitionInterval = "day",
+        detach_only: bool = False,
+    ) -> list[str]:
+        """Drop or detach the created_at partitions ending before the given datetime, the task partitions are only
+        dropped once all of their tasks are finished. Return the names of the dropped partitions
+        """
+        dropped = []
+        task_table = self.task_model.__table__
+        for table in self.partitioned_tables("created_at"):
+            for partition in self.list_partitions(table):
+                if partition.start is None:
+                    continue
+                if next_datetime(partition.start, interval) > before:
+                    continue
+                if table is task_table and self._has_active_tasks(partition.name):
+                    continue
+                self.session.execute(
+                    text(
+                        f"ALTER TABLE {self._quote(table.name)} DETACH PARTITION {self._quote(partition.name)}"
+                    )
+                )
+                if not detach_only:
+                    self.session.execute(
+                        text(f"DROP TABLE {self._quote(partition.name)}")
+                    )
+                dropped.append(partition.name)
+        return dropped
+
+    def get_min_created_at(self) -> datetime.datetime | None:
+        """Start of the oldest created_at partition with any pending or processing task, which is a lower bound
+        of created_at for dispatching. None if the default partition has any, which means no pruning possible.
+        """
+        task_table = self.task_model.__table__
+        partitions = self.list_partitions(task_table)
+        for partition in partitions:
+            if partition.start is None and self._has_active_tasks(partition.name):
+                return None
+        range_partitions = sorted(
+            (partition for partition in partitions if partition.start is not None),
+            key=lambda partition: partition.start,
+        )
+        for partition in range_partitions:
+            if self._has_active_tasks(partition.name):
+                return partition.start
+        if not range_partitions:
+            return None
+        # nothing active, the new tasks will land in the current partition
+        now = self.session.scalar(select(func.now()))
+        return max(
+            (
+                partition.start
+                for partition in range_partitions
+                if partition.start <= now
+            ),
+            default=None,
+        )
+
+    def maintain(
+        self,
+        interval: PartitionInterval = "day",
+        premake: int = 3,
+        retention: datetime.timedelta | None = None,
+        detach_only: bool = False,
+        lock_timeout: int = 1000,
+    ) -> bool:
+        """Create the future partitions and drop the ones past retention, without committing. Return False if
+        another worker is maintaining the partitions.
+
+        :param lock_timeout: milliseconds to wait for the table locks, to avoid blocking the other queries behind
+            the DDL for long, it will be retried next time
+        """
+        if not self.session.scalar(
+            select(func.pg_try_advisory_xact_lock(PARTITION_LOCK_KEY))
+        ):
+            return False
+        self.session.execute(
+            select(func.set_config("lock_timeout", str(lock_timeout), True))
+        )
+        now = self.session.scalar(select(func.now()))
+        created = self.create_partitions(interval=interval, premake=premake, now=now)
+        if created:
+            logger.info("Created partitions %s", created)
+        if retention is not None:
+            dropped = self.drop_partitions(
+                now - retention, interval=interval, detach_only=detach_only
+            )
+            if dropped:
+                logger.info(
+                    "%s partitions %s",
+                    "Detached" if detach_only else "Dropped",
+                    dropped,
+                )
+        return True
@@ -0,0 +1,169 @@
+import collections
+import typing
+
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import models
+
+# Advisory lock key for making sure only one worker compacts the counters at a time
+COMPACT_LOCK_KEY = 0x62715F6470  # "bq_dp"
+
+
+class QueueDepthService:
+    """Maintain the number of tasks per channel and state in a counter table with triggers, so that reading the
+    queue depth only takes O(channels) instead of counting the whole task table.
+
+    The triggers are statement-level with transition tables, so that a statement changing many tasks only writes
+    the counters once. Each transaction adds its deltas to the shard picked by its backend pid, and the compaction
+    folds the shards back into shard 0 periodically.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        task_model: typing.Type = models.Task,
+        queue_depth_model: typing.Type = models.QueueDepth,
+    ):
+        self.session = session
+        self.task_model: typing.Type[models.Task] = task_model
+        self.queue_depth_model: typing.Type[models.QueueDepth] = queue_depth_model
+
+    def _names(self) -> dict[str, str]:
+        preparer = self.session.get_bind().dialect.identifier_preparer
+        task_table = self.task_model.__table__.name
+        depth_table = self.queue_depth_model.__table__.name
+        return dict(
+            task_table=preparer.quote(task_table),
+            depth_table=preparer.quote(depth_table),
+            prefix=f"{depth_table}_{task_table}",
+        )
+
+    def make_trigger_ddl(self, shards: int) -> list[str]:
+        names = self._names()
+        statements = []
+        for op, deltas in (
+            ("insert", "SELECT channel, state, 1 AS delta FROM new_rows"),
+            (
+                "update",
+                "SELECT channel, state, 1 AS delta FROM new_rows "
+                "UNION ALL SELECT channel, state, -1 AS delta FROM old_rows",
+            ),
+            ("delete", "SELECT channel, state, -1 AS delta FROM old_rows"),
+        ):
+            func_name = f"{names['prefix']}_{op}"
+            if op == "insert":
+                referencing = "REFERENCING NEW TABLE AS new_rows"
+            elif op == "update":
+                referencing = "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"
+            else:
+                referencing = "REFERENCING OLD TABLE AS old_rows"
+            statements.append(
+                f"""
+CREATE OR REPLACE FUNCTION {func_name}() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO {names["depth_table"]} (channel, state, shard, count)
+    SELECT channel, state::text, pg_backend_pid() % {int(shards)}, sum(delta)
+    FROM ({deltas}) AS deltas
+    GROUP BY channel, state
+    HAVING sum(delta) <> 0
+    -- keep the lock order stable to avoid deadlocks between concurrent statements
+    ORDER BY channel, state
+    ON CONFLICT (channel, state, shard) DO UPDATE SET count = {names["depth_table"]}.count + EXCLUDED.count;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+            )
+            statements.append(
+                f"DROP TRIGGER IF EXISTS {func_name} ON {names['task_table']}"
+            )
+            statements.append(
+                f"CREATE TRIGGER {func_name} AFTER {op.upper()} ON {names['task_table']} "
+                f"{referencing} FOR EACH STATEMENT EXECUTE FUNCTION {func_name}()"
+            )
+        return statements
+
+    def install(self, shards: int = 16):
+        """Install the triggers and initialize the counters by counting the task table.
+
+        The task table is locked against writes until the transaction ends, so that no change is missed or
+        counted twice between the initial count and the triggers taking effect.
+        """
+        names = self._names()
+        self.session.execute(
+            text(f"LOCK TABLE {names['task_table']} IN SHARE ROW EXCLUSIVE MODE")
+        )
+        for statement in self.make_trigger_ddl(shards=shards):
+            self.session.execute(text(statement))
+        self.session.execute(self.queue_depth_model.__table__.delete())
+        self.session.execute(
+            text(
+                f"INSERT INTO {names['depth_table']} (channel, state, shard, count) "
+                f"SELECT channel, state::text, 0, count(*) FROM {names['task_table']} GROUP BY channel, state"
+            )
+        )
+
+    def uninstall(self):
+        names = self._names()
+        for op in ("insert", "update", "delete"):
+            func_name = f"{names['prefix']}_{op}"
+            self.session.execute(
+                text(f"DROP TRIGGER IF EXISTS {func_name} ON {names['task_table']}")
+            )
+            self.session.execute(text(f"DROP FUNCTION IF EXISTS {func_name}()"))
+
+    def make_depth_query(self, channels: typing.Sequence[str] | None = None):
+        query = select(
+            self.queue_depth_model.channel,
+            self.queue_depth_model.state,
+            func.sum(self.queue_depth_model.count),
+        ).group_by(self.queue_depth_model.channel, self.queue_depth_model.state)
+        if channels is not None:
+            query = query.where(self.queue_depth_model.channel.in_(channels))
+        return query
+
+    def get_depth(
+        self, channels: typing.Sequence[str] | None = None
+    ) -> dict[str, dict[models.TaskState, int]]:
+        depth = collections.defaultdict(dict)
+        for channel, state, count in self.session.execute(
+            self.make_depth_query(channels)
+        ):
+            depth[channel][models.TaskState(state)] = int(count)
+        return dict(depth)
+
+    def compact(self) -> bool:
+        """Fold all shards into shard 0 and remove zero counters, return False if another worker is compacting"""
+        if not self.session.scalar(
+            select(func.pg_try_advisory_xact_lock(COMPACT_LOCK_KEY))
+        ):
+            return False
+        names = self._names()
+        # lock the counters in the same order as the triggers do before deleting them, otherwise the DELETE could
+        # deadlock with a concurrent statement updating the same counters in another order
+        self.session.execute(
+            text(
+                f"SELECT 1 FROM {names['depth_table']} ORDER BY channel, state, shard FOR UPDATE"
+            )
+        )
+        # a concurrent statement may insert a counter into shard 0 that the lock above cannot see yet, merge into
+        # it instead of failing with a unique violation once that transaction commits
+        self.session.execute(
+            text(
+                f"""
+WITH deleted AS (
+    DELETE FROM {names["depth_table"]} RETURNING channel, state, count
+)
+INSERT INTO {names["depth_table"]} (channel, state, shard, count)
+SELECT channel, state, 0, sum(count) FROM deleted
+GROUP BY channel, state
+HAVING sum(count) <> 0
+ORDER BY channel, state
+ON CONFLICT (channel, state, shard) DO UPDATE SET count = {names["depth_table"]}.count + EXCLUDED.count
+"""
+            )
+        )
+        return True
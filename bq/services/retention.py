@@ -0,0 +1,278 @@
+import dataclasses
+import typing
+
+from sqlalchemy import case
+from sqlalchemy import Column
+from sqlalchemy import delete
+from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import MetaData
+from sqlalchemy import null
+from sqlalchemy import select
+from sqlalchemy import Table
+from sqlalchemy import text
+from sqlalchemy import type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..payloads import delete_payloads
+from ..payloads import REFERENCE_KEY
+from ..payloads import remove_payload
+
+# Advisory lock key for making sure only one worker runs the retention at a time
+RETENTION_LOCK_KEY = 0x62715F7274  # "bq_rt"
+
+FINISHED_STATES = (models.TaskState.DONE, models.TaskState.FAILED)
+
+
+@dataclasses.dataclass(frozen=True)
+class RetentionRule:
+    # seconds to keep the finished tasks
+    seconds: int
+    # channel this rule applies to, None for all the channels not in exclude_channels
+    channel: str | None = None
+    exclude_channels: tuple[str, ...] = ()
+
+
+# Columns of the DONE tasks which could be cleared before the tasks are removed
+COMPACTION_COLUMNS = ("result", "kwargs")
+
+
+@dataclasses.dataclass(frozen=True)
+class CompactionRule:
+    # seconds to keep the column of the DONE tasks
+    seconds: float
+    # the column to clear, one of COMPACTION_COLUMNS
+    column: str
+    channel: str
+    module: str
+    func_name: str
+
+
+@dataclasses.dataclass
+class RemovedCounts:
+    tasks: int = 0
+    events: int = 0
+    # number of task columns cleared by the compaction
+    compacted: int = 0
+
+    def __iadd__(self, other: "RemovedCounts") -> "RemovedCounts":
+        self.tasks += other.tasks
+        self.events += other.events
+        self.compacted += other.compacted
+        return self
+
+
+def make_retention_rules(
+    default_seconds: int | None, channels: typing.Mapping[str, int | None]
+) -> list[RetentionRule]:
+    """Make rules from the default retention and the ones of specific channels, None means keeping forever"""
+    rules = [
+        RetentionRule(seconds=seconds, channel=channel)
+        for channel, seconds in sorted(channels.items())
+        if seconds is not None
+    ]
+    if default_seconds is not None:
+        rules.append(
+            RetentionRule(
+                seconds=default_seconds, exclude_channels=tuple(sorted(channels))
+            )
+        )
+    return rules
+
+
+def make_compaction_rules(
+    processors: typing.Iterable[typing.Any],
+) -> list[CompactionRule]:
+    """Make rules from the `keep_result_for` and `keep_kwargs_for` of the processors"""
+    rules = []
+    for processor in processors:
+        for column in COMPACTION_COLUMNS:
+            seconds = getattr(processor, f"keep_{column}_for")
+            if seconds is None:
+                continue
+            rules.append(
+                CompactionRule(
+                    seconds=seconds,
+                    column=column,
+                    channel=processor.channel,
+                    module=processor.module,
+                    func_name=processor.name,
+                )
+            )
+    return rules
+
+
+class RetentionService:
+    """Remove finished tasks older than their retention along with their events, in batches.
+
+    A task is only removed once it has no child tasks left, so that the parent_id foreign key holds, and its events
+    are removed in the same transaction before it. The removed rows can be moved into archive tables, or passed to
+    a writer for exporting them elsewhere.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        task_model: typing.Type = models.Task,
+        event_model: typing.Type | None = models.Event,
+    ):
+        self.session = session
+        self.task_model: typing.Type[models.Task] = task_model
+        self.event_model: typing.Type[models.Event] | None = event_model
+
+    def _tables(self) -> list[Table]:
+        tables = [self.task_model.__table__]
+        if self.event_model is not None:
+            tables.insert(0, self.event_model.__table__)
+        return tables
+
+    def make_archive_table(self, table: Table, suffix: str) -> Table:
+        return Table(
+            f"{table.name}{suffix}",
+            MetaData(),
+            *(Column(column.name, column.type) for column in table.columns),
+        )
+
+    def create_archive_tables(self, suffix: str):
+        """Create the archive tables with the same columns as the task and event tables if they don't exist yet"""
+        preparer = self.session.get_bind().dialect.identifier_preparer
+        for table in self._tables():
+            self.session.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {preparer.quote(f'{table.name}{suffix}')} "
+                    f"(LIKE {preparer.quote(table.name)} INCLUDING DEFAULTS)"
+                )
+            )
+
+    def make_candidate_query(self, rule: RetentionRule, limit: int):
+        query = (
+            select(self.task_model.id)
+            .where(self.task_model.state.in_(FINISHED_STATES))
+            .where(
+                self.task_model.created_at
+                < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, rule.seconds)
+            )
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        if rule.channel is not None:
+            query = query.where(self.task_model.channel == rule.channel)
+        elif rule.exclude_channels:
+            query = query.where(self.task_model.channel.not_in(rule.exclude_channels))
+        if hasattr(self.task_model, "parent_id"):
+            child = aliased(self.task_model)
+            query = query.where(~exists().where(child.parent_id == self.task_model.id))
+        return query
+
+    def make_compaction_candidate_query(self, rule: CompactionRule, limit: int):
+        if rule.column not in COMPACTION_COLUMNS:
+            raise ValueError(
+                f"Invalid column {rule.column!r}, should be one of {COMPACTION_COLUMNS}"
+            )
+        column = getattr(self.task_model, rule.column)
+        finished_at = self.task_model.created_at
+        if hasattr(self.task_model, "finished_at"):
+            finished_at = func.coalesce(self.task_model.finished_at, finished_at)
+        return (
+            select(
+                self.task_model.id,
+                # only read the payload references, not the values to be cleared
+                case((type_coerce(column, JSONB).has_key(REFERENCE_KEY), column)),
+            )
+            .where(self.task_model.state == models.TaskState.DONE)
+            .where(self.task_model.channel == rule.channel)
+            .where(self.task_model.module == rule.module)
+            .where(self.task_model.func_name == rule.func_name)
+            .where(column.is_not(None))
+            .where(
+                finished_at
+                < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, rule.seconds)
+            )
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+
+    def compact_batch(self, rule: CompactionRule, limit: int) -> int:
+        """Clear the column of up to `limit` DONE tasks of the rule past its time, without committing, return the
+        number of cleared tasks
+        """
+        rows = self.session.execute(
+            self.make_compaction_candidate_query(rule, limit)
+        ).all()
+        if not rows:
+            return 0
+        connection = self.session.connection()
+        for _, reference in rows:
+            if reference is not None:
+                remove_payload(connection, reference)
+        task_table = self.task_model.__table__
+        self.session.execute(
+            task_table.update()
+            .where(task_table.c.id.in_([task_id for task_id, _ in rows]))
+            .values({rule.column: null()})
+        )
+        return len(rows)
+
+    def _remove(
+        self,
+        table: Table,
+        where: typing.Any,
+        archive_suffix: str | None,
+        writer: typing.Callable[[str, dict[str, typing.Any]], None] | None,
+    ) -> int:
+        if archive_suffix is not None:
+            moved = delete(table).where(where).returning(*table.columns).cte("moved")
+            archive_table = self.make_archive_table(table, archive_suffix)
+            names = [column.name for column in table.columns]
+            return self.session.execute(
+                insert(archive_table).from_select(names, select(*moved.columns))
+            ).rowcount
+        if writer is not None:
+            count = 0
+            for row in self.session.execute(
+                delete(table).where(where).returning(*table.columns)
+            ).mappings():
+                writer(table.name, dict(row))
+                count += 1
+            return count
+        return self.session.execute(delete(table).where(where)).rowcount
+
+    def remove_batch(
+        self,
+        rule: RetentionRule,
+        limit: int,
+        archive_suffix: str | None = None,
+        writer: typing.Callable[[str, dict[str, typing.Any]], None] | None = None,
+    ) -> RemovedCounts:
+        """Remove up to `limit` finished tasks of the rule, their events and payloads, without committing
+
+        :param archive_suffix: move the rows into the archive tables with this suffix instead of deleting them
+        :param writer: called with the table name and each removed row
+        """
+        task_ids = self.session.scalars(self.make_candidate_query(rule, limit)).all()
+        counts = RemovedCounts()
+        if not task_ids:
+            return counts
+        if self.event_model is not None:
+            event_table = self.event_model.__table__
+            counts.events = self._remove(
+                event_table,
+                event_table.c.task_id.in_(task_ids),
+                archive_suffix=archive_suffix,
+                writer=writer,
+            )
+        if archive_suffix is None:
+            # the archived tasks still reference their payloads
+            delete_payloads(self.session.connection(), task_ids)
+        task_table = self.task_model.__table__
+        counts.tasks = self._remove(
+            task_table,
+            task_table.c.id.in_(task_ids),
+            archive_suffix=archive_suffix,
+            writer=writer,
+        )
+        return counts
@@ -0,0 +1,146 @@
+import datetime
+import typing
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy import inspect
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..models.task import DEDUP_INDEX_ELEMENTS
+from ..models.task import DEDUP_INDEX_WHERE
+from ..payloads import delete_payloads
+from ..payloads import is_reference
+from ..payloads import offload_value
+from ..payloads import PAYLOAD_COLUMNS
+from ..utils import uuid7
+
+
+class SubmitService:
+    """Insert tasks in bulk with one statement. With a task model having `dedup_key`, the tasks with the same key as a
+    pending task are collapsed into it with `INSERT ... ON CONFLICT` instead of being inserted.
+    """
+
+    def __init__(self, session: Session, task_model: typing.Type = models.Task):
+        self.session = session
+        self.task_model: typing.Type[models.Task] = task_model
+
+    @property
+    def with_dedup(self) -> bool:
+        return hasattr(self.task_model, "dedup_key")
+
+    def make_row(self, task: models.Task) -> dict[str, typing.Any]:
+        """Make the row values from a task not added to any session yet, like the one returned by `run` of a
+        processor
+        """
+        state = inspect(task)
+        row = {
+            attr.key: state.dict[attr.key]
+            for attr in state.mapper.column_attrs
+            if attr.key in state.dict
+        }
+        parent = state.dict.get("parent")
+        if parent is not None:
+            row["parent_id"] = parent.id
+        return row
+
+    def make_insert_query(
+        self,
+        rows: typing.Sequence[dict[str, typing.Any]],
+        debounce: datetime.timedelta | None = None,
+    ):
+        task_table = self.task_model.__table__
+        query = insert(task_table).values(rows)
+        if self.with_dedup:
+            conflict_target = dict(
+                index_elements=list(DEDUP_INDEX_ELEMENTS),
+                index_where=text(DEDUP_INDEX_WHERE),
+            )
+            if debounce is None:
+                query = query.on_conflict_do_nothing(**conflict_target)
+            else:
+                # push the pending task back, so that it runs once the duplicates stop coming
+                query = query.on_conflict_do_update(
+                    **conflict_target,
+                    set_=dict(
+                        scheduled_at=func.greatest(
+                            task_table.c.scheduled_at, query.excluded.scheduled_at
+                        )
+                    ),
+                )
+        return query.returning(task_table.c.id, task_table.c.channel)
+
+    def submit(
+        self,
+        tasks: typing.Sequence[models.Task],
+        debounce: datetime.timedelta | None = None,
+    ) -> list[uuid.UUID]:
+        """Insert the tasks without committing, and return the ids of the inserted tasks along with the pending
+        tasks pushed back by the debounce. A task with the same dedup key as a pending task, or a task before it in
+        the same call, is dropped.
+
+        :param debounce: schedule the tasks with dedup key this long from now, and push the pending task with the
+            same key to the same time
+        """
+        connection = self.session.connection()
+        rows = []
+        dedup_keys = set()
+        for task in tasks:
+            row = self.make_row(task)
+            dedup_key = row.get("dedup_key")
+            if dedup_key is not None:
+                if not self.with_dedup:
+                    raise ValueError(
+                        f"Task model {self.task_model.__name__} has no dedup_key column"
+                    )
+                # a statement cannot update the same pending task twice
+                if dedup_key in dedup_keys:
+                    continue
+                dedup_keys.add(dedup_key)
+                if debounce is not None:
+                    row["scheduled_at"] = func.now() + debounce
+            # the bulk insert skips the ORM events, move the large payloads ourselves
+            for column in PAYLOAD_COLUMNS:
+                value = row.get(column)
+                if value is None:
+                    continue
+                task_id = row.get("id") or uuid7()
+                offloaded = offload_value(connection, task_id, value)
+                if offloaded is not value:
+                    row["id"] = task_id
+                    row[column] = offloaded
+            rows.append(row)
+
+        submitted = []
+        channels = set()
+        # the rows of one statement need the same columns, the others are left to their defaults
+        groups: dict[frozenset[str], list[dict[str, typing.Any]]] = {}
+        for row in rows:
+            groups.setdefault(frozenset(row), []).append(row)
+        for group_rows in groups.values():
+            for task_id, channel in self.session.execute(
+                self.make_insert_query(group_rows, debounce=debounce)
+            ):
+                submitted.append(task_id)
+                channels.add(channel)
+
+        # the payloads of the dropped duplicates are not referenced by any task
+        submitted_ids = frozenset(submitted)
+        dropped_ids = [
+            row["id"]
+            for row in rows
+            if any(is_reference(row.get(column)) for column in PAYLOAD_COLUMNS)
+            and row["id"] not in submitted_ids
+        ]
+        if dropped_ids:
+            delete_payloads(connection, dropped_ids)
+
+        # notify the workers ourselves as well
+        for channel in sorted(channels):
+            quoted_channel = connection.dialect.identifier_preparer.quote_identifier(
+                channel
+            )
+            connection.exec_driver_sql(f"NOTIFY {quoted_channel}")
+        return submitted
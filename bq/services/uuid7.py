@@ -0,0 +1,80 @@
+import typing
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import models
+
+# Name of the server-side function generating UUIDv7
+FUNCTION_NAME = "bq_uuid7"
+
+
+class UUID7Service:
+    """Install a function generating time-ordered UUIDv7 and make it the default of the id columns, so that new
+    rows are appended to the right side of the primary key B-tree instead of scattered across it like random
+    UUIDv4 do.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        task_model: typing.Type = models.Task,
+        worker_model: typing.Type = models.Worker,
+        event_model: typing.Type | None = models.Event,
+    ):
+        self.session = session
+        self.task_model: typing.Type[models.Task] = task_model
+        self.worker_model: typing.Type[models.Worker] = worker_model
+        self.event_model: typing.Type[models.Event] | None = event_model
+
+    def _models(self) -> list[typing.Type]:
+        return [
+            model
+            for model in (self.task_model, self.worker_model, self.event_model)
+            if model is not None
+        ]
+
+    def make_function_ddl(self) -> str:
+        # overwrite the first 48 bits of a random UUIDv4 with the millisecond timestamp, and turn its version
+        # bits from 0100 into 0111
+        return f"""
+CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS uuid AS $$
+    SELECT encode(
+        set_bit(
+            set_bit(
+                overlay(
+                    uuid_send(gen_random_uuid())
+                    PLACING substring(int8send((extract(epoch FROM clock_timestamp()) * 1000)::bigint) FROM 3)
+                    FROM 1 FOR 6
+                ),
+                52, 1
+            ),
+            53, 1
+        ),
+        'hex'
+    )::uuid
+$$ LANGUAGE sql VOLATILE PARALLEL SAFE
+"""
+
+    def _set_defaults(self, default: str):
+        preparer = self.session.get_bind().dialect.identifier_preparer
+        for model in self._models():
+            self.session.execute(
+                text(
+                    f"ALTER TABLE {preparer.format_table(model.__table__)} "
+                    f"ALTER COLUMN {preparer.quote(model.id.expression.name)} SET DEFAULT {default}"
+                )
+            )
+
+    def install(self):
+        """Install the function and use it as the default of the id columns"""
+        self.session.execute(text(self.make_function_ddl()))
+        self._set_defaults(f"{FUNCTION_NAME}()")
+
+    def uninstall(self):
+        """Restore the default of the id columns to random UUIDv4 and drop the function"""
+        self._set_defaults("gen_random_uuid()")
+        self.session.execute(text(f"DROP FUNCTION IF EXISTS {FUNCTION_NAME}()"))
+
+    def generate(self) -> typing.Any:
+        return self.session.scalar(text(f"SELECT {FUNCTION_NAME}()"))
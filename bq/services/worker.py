@@ -67,14 +67,18 @@ class WorkerService:
         )
 
     def make_update_tasks_query(self, worker_query: typing.Any):
+        values = dict(
+            state=models.TaskState.PENDING,
+            worker_id=None,
+        )
+        if hasattr(self.task_model, "dedup_key"):
+            # a newer task with the same key may be pending already
+            values["dedup_key"] = None
         return (
             self.task_model.__table__.update()
             .where(self.task_model.worker_id.in_(worker_query))
             .where(self.task_model.state == models.TaskState.PROCESSING)
-            .values(
-                state=models.TaskState.PENDING,
-                worker_id=None,
-            )
+            .values(**values)
         )
 
     def reschedule_dead_tasks(self, worker_query: typing.Any) -> int:
@@ -0,0 +1,373 @@
+import bisect
+import dataclasses
+import math
+import threading
+import typing
+
+from . import events
+from . import models
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_SECONDS_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+RATIO_BUCKETS = (0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+MetricType = typing.Literal["counter", "histogram", "gauge"]
+
+
+@dataclasses.dataclass(frozen=True)
+class Metric:
+    name: str
+    type: MetricType
+    documentation: str
+    label_names: tuple[str, ...] = ()
+    buckets: tuple[float, ...] = DEFAULT_SECONDS_BUCKETS
+
+
+class _Shard:
+    """Metric values recorded by a single thread, only the owner thread writes to it"""
+
+    def __init__(self):
+        self.counters: dict[tuple[str, tuple[str, ...]], float] = {}
+        # bucket counts (with the +Inf bucket at the end) followed by the sum of observed values
+        self.histograms: dict[tuple[str, tuple[str, ...]], list[float]] = {}
+
+
+class Stats:
+    """A minimal Prometheus style metrics registry.
+
+    Counters and histograms are recorded into per-thread shards, so recording a value never takes a lock and
+    worker threads don't contend with each other. The shards are only summed up when the metrics are collected.
+    Gauges are set by a single owner (usually the main thread) and stored directly.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._local = threading.local()
+        self._shards: list[_Shard] = []
+        self._shards_lock = threading.Lock()
+        self._gauges: dict[tuple[str, tuple[str, ...]], float] = {}
+
+    def define(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _shard(self) -> _Shard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = _Shard()
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def inc(self, metric: Metric, labels: tuple[str, ...] = (), value: float = 1):
+        counters = self._shard().counters
+        key = (metric.name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, metric: Metric, value: float, labels: tuple[str, ...] = ()):
+        histograms = self._shard().histograms
+        key = (metric.name, labels)
+        values = histograms.get(key)
+        if values is None:
+            values = [0] * (len(metric.buckets) + 2)
+            histograms[key] = values
+        values[bisect.bisect_left(metric.buckets, value)] += 1
+        values[-1] += value
+
+    def set(self, metric: Metric, value: float, labels: tuple[str, ...] = ()):
+        self._gauges[(metric.name, labels)] = value
+
+    def get(self, metric: Metric, labels: tuple[str, ...] = ()) -> float:
+        """Get the current value of a counter or gauge, or the count of observations of a histogram"""
+        key = (metric.name, labels)
+        if metric.type == "gauge":
+            return self._gauges.get(key, 0)
+        total = 0
+        for shard in self._collect_shards():
+            if metric.type == "counter":
+                total += shard.counters.get(key, 0)
+            else:
+                values = shard.histograms.get(key)
+                if values is not None:
+                    total += sum(values[:-1])
+        return total
+
+    def _collect_shards(self) -> list[_Shard]:
+        with self._shards_lock:
+            return list(self._shards)
+
+    def collect(
+        self,
+    ) -> tuple[
+        dict[tuple[str, tuple[str, ...]], float],
+        dict[tuple[str, tuple[str, ...]], list[float]],
+    ]:
+        counters: dict[tuple[str, tuple[str, ...]], float] = dict(self._gauges)
+        histograms: dict[tuple[str, tuple[str, ...]], list[float]] = {}
+        for shard in self._collect_shards():
+            # copying a dict is atomic with the GIL, so it's safe while the owner thread is writing to it
+            for key, value in shard.counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, values in shard.histograms.copy().items():
+                values = list(values)
+                merged = histograms.get(key)
+                if merged is None:
+                    histograms[key] = values
+                else:
+                    for index, value in enumerate(values):
+                        merged[index] += value
+        return counters, histograms
+
+    def render(self) -> str:
+        """Render the metrics in Prometheus text exposition format"""
+        counters, histograms = self.collect()
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            if metric.type == "histogram":
+                for (name, labels), values in sorted(histograms.items()):
+                    if name != metric.name:
+                        continue
+                    label_pairs = list(zip(metric.label_names, labels))
+                    cumulative = 0
+                    for bucket, count in zip(metric.buckets + (math.inf,), values[:-1]):
+                        cumulative += count
+                        bucket_labels = _format_labels(
+                            label_pairs + [("le", _format_value(bucket))]
+                        )
+                        lines.append(
+                            f"{name}_bucket{bucket_labels} {_format_value(cumulative)}"
+                        )
+                    lines.append(
+                        f"{name}_sum{_format_labels(label_pairs)} {_format_value(values[-1])}"
+                    )
+                    lines.append(
+                        f"{name}_count{_format_labels(label_pairs)} {_format_value(cumulative)}"
+                    )
+            else:
+                for (name, labels), value in sorted(counters.items()):
+                    if name != metric.name:
+                        continue
+                    label_pairs = list(zip(metric.label_names, labels))
+                    lines.append(
+                        f"{name}{_format_labels(label_pairs)} {_format_value(value)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._shards_lock:
+            for shard in self._shards:
+                shard.counters.clear()
+                shard.histograms.clear()
+        self._gauges.clear()
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_pairs: list[tuple[str, str]]) -> str:
+    if not label_pairs:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{_escape_label_value(str(value))}"' for name, value in label_pairs
+        )
+        + "}"
+    )
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+stats = Stats()
+
+TASK_LABELS = ("channel", "module", "func")
+
+TASKS_CLAIMED = stats.define(
+    Metric(
+        "bq_tasks_claimed_total",
+        "counter",
+        "Number of tasks claimed by this worker",
+        ("channel",),
+    )
+)
+TASKS_COMPLETED = stats.define(
+    Metric(
+        "bq_tasks_completed_total",
+        "counter",
+        "Number of tasks processed without error",
+        TASK_LABELS,
+    )
+)
+TASKS_FAILED = stats.define(
+    Metric(
+        "bq_tasks_failed_total",
+        "counter",
+        "Number of tasks failed without retry",
+        TASK_LABELS,
+    )
+)
+TASKS_RETRIED = stats.define(
+    Metric(
+        "bq_tasks_retried_total",
+        "counter",
+        "Number of tasks failed and scheduled for retry",
+        TASK_LABELS,
+    )
+)
+TASK_PROCESSING_SECONDS = stats.define(
+    Metric(
+        "bq_task_processing_seconds",
+        "histogram",
+        "Time spent on processing tasks",
+        TASK_LABELS,
+    )
+)
+TASK_QUEUE_WAIT_SECONDS = stats.define(
+    Metric(
+        "bq_task_queue_wait_seconds",
+        "histogram",
+        "Time between tasks becoming ready (created or scheduled) and being claimed",
+        ("channel",),
+    )
+)
+DISPATCH_SECONDS = stats.define(
+    Metric(
+        "bq_dispatch_seconds",
+        "histogram",
+        "Latency of the dispatch query claiming tasks",
+    )
+)
+DISPATCH_BATCH_FILL_RATIO = stats.define(
+    Metric(
+        "bq_dispatch_batch_fill_ratio",
+        "histogram",
+        "Number of tasks claimed divided by the limit of the dispatch query",
+        buckets=RATIO_BUCKETS,
+    )
+)
+WORKER_THREADS_BUSY = stats.define(
+    Metric(
+        "bq_worker_threads_busy",
+        "gauge",
+        "Number of worker threads processing tasks",
+    )
+)
+WORKER_THREADS_UTILIZATION = stats.define(
+    Metric(
+        "bq_worker_threads_utilization",
+        "gauge",
+        "Number of busy worker threads divided by the number of worker threads",
+    )
+)
+DB_POOL_CHECKOUT_SECONDS = stats.define(
+    Metric(
+        "bq_db_pool_checkout_seconds",
+        "histogram",
+        "Time spent waiting for a connection from the database connection pool",
+    )
+)
+TASKS_SLOW = stats.define(
+    Metric(
+        "bq_tasks_slow_total",
+        "counter",
+        "Number of tasks running longer than their slow threshold",
+        TASK_LABELS,
+    )
+)
+SLOW_TASKS_RUNNING = stats.define(
+    Metric(
+        "bq_slow_tasks_running",
+        "gauge",
+        "Number of tasks still running after exceeding their slow threshold",
+    )
+)
+QUEUE_DEPTH = stats.define(
+    Metric(
+        "bq_queue_depth",
+        "gauge",
+        "Number of tasks per channel and state of the whole cluster (requires QUEUE_DEPTH_ENABLED)",
+        ("channel", "state"),
+    )
+)
+CONCURRENCY_PLAN = stats.define(
+    Metric(
+        "bq_concurrency_plan",
+        "gauge",
+        "Values of the concurrency plan this worker runs with",
+        ("setting",),
+    )
+)
+
+
+def _on_dispatch_finished(
+    sender: typing.Any,
+    limit: int,
+    claimed: list[typing.Any],
+    duration: float,
+    **kwargs: typing.Any,
+):
+    stats.observe(DISPATCH_SECONDS, duration)
+    stats.observe(DISPATCH_BATCH_FILL_RATIO, len(claimed) / limit)
+    for task in claimed:
+        stats.inc(TASKS_CLAIMED, (task.channel,))
+        stats.observe(TASK_QUEUE_WAIT_SECONDS, task.queue_wait, (task.channel,))
+
+
+def _on_task_completed(
+    sender: typing.Any,
+    task: models.Task,
+    processor: typing.Any,
+    state: models.TaskState | None,
+    duration: float,
+    **kwargs: typing.Any,
+):
+    if processor is None:
+        stats.inc(TASKS_FAILED, (task.channel, task.module, task.func_name))
+        return
+    labels = (processor.channel, processor.module, processor.name)
+    stats.observe(TASK_PROCESSING_SECONDS, duration, labels)
+    if state == models.TaskState.FAILED:
+        stats.inc(TASKS_FAILED, labels)
+    elif state == models.TaskState.PENDING:
+        stats.inc(TASKS_RETRIED, labels)
+    else:
+        stats.inc(TASKS_COMPLETED, labels)
+
+
+def connect_receivers():
+    """Record the built-in metrics by connecting receivers to the instrumentation signals"""
+    events.dispatch_finished.connect(_on_dispatch_finished)
+    events.task_completed.connect(_on_task_completed)
+
+
+def disconnect_receivers():
+    events.dispatch_finished.disconnect(_on_dispatch_finished)
+    events.task_completed.disconnect(_on_task_completed)
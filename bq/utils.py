@@ -1,8 +1,76 @@
 import importlib
+import os
+import socket
+import threading
+import time
 import typing
+import uuid
+
+_uuid7_lock = threading.Lock()
+# millisecond timestamp and counter of the last generated UUIDv7
+_uuid7_last = (0, 0)
 
 
 def load_module_var(name: str) -> typing.Type:
     module_name, model_name = name.rsplit(".", 1)
     module = importlib.import_module(module_name)
     return getattr(module, model_name)
+
+
+def uuid7() -> uuid.UUID:
+    """Generate a time-ordered UUID version 7 (RFC 9562). The 12 bits after the millisecond timestamp are used
+    as a counter, so that the ids generated by the same process are strictly increasing even within the same
+    millisecond or when the clock goes backward.
+    """
+    global _uuid7_last
+    timestamp = time.time_ns() // 1_000_000
+    with _uuid7_lock:
+        last_timestamp, last_counter = _uuid7_last
+        if timestamp > last_timestamp:
+            # start from the lower half to leave room for increasing
+            counter = int.from_bytes(os.urandom(2)) & 0x7FF
+        else:
+            timestamp = last_timestamp
+            counter = last_counter + 1
+            if counter > 0xFFF:
+                timestamp += 1
+                counter = 0
+        _uuid7_last = (timestamp, counter)
+    rand_b = int.from_bytes(os.urandom(8)) & 0x3FFF_FFFF_FFFF_FFFF
+    return uuid.UUID(
+        int=(timestamp & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76
+        | counter << 64
+        | 0b10 << 62
+        | rand_b
+    )
+
+
+class Waker:
+    """A wake-up primitive can be waited with `select.select` together with other file descriptors."""
+
+    def __init__(self):
+        self._reader, self._writer = socket.socketpair()
+        self._reader.setblocking(False)
+        self._writer.setblocking(False)
+
+    def fileno(self) -> int:
+        return self._reader.fileno()
+
+    def wake(self):
+        try:
+            self._writer.send(b"\x00")
+        except BlockingIOError:
+            # the buffer is full, it's going to wake up anyway
+            pass
+
+    def drain(self):
+        try:
+            while self._reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
@@ -0,0 +1,142 @@
+import dataclasses
+import logging
+import sys
+import threading
+import time
+import traceback
+import typing
+
+from . import events
+from . import models
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class RunningTask:
+    task_id: typing.Any
+    channel: str
+    module: str
+    func_name: str
+    thread_ident: int
+    # time.perf_counter() when the task started
+    started_at: float
+    # seconds for the task to be considered slow
+    slow_threshold: float
+    # whether we have reported the task as slow
+    reported: bool = False
+
+
+class Watchdog:
+    """Track the tasks in-flight and report the ones running longer than their slow threshold.
+
+    The running tasks are tracked by receivers of the task_started and task_completed signals, keyed by the ident
+    of the thread processing them, so it works for both sequential and threaded processing. A background thread
+    checks them every `interval` seconds, and reports each slow task once by logging the stack of its thread,
+    sending the task_slow signal and counting it in the metrics.
+    """
+
+    def __init__(
+        self,
+        default_slow_threshold: float | None = None,
+        interval: float = 5,
+    ):
+        self.default_slow_threshold = default_slow_threshold
+        self.interval = interval
+        self._running_tasks: dict[int, RunningTask] = {}
+        self._shutdown_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _on_task_started(
+        self,
+        sender: typing.Any,
+        task: models.Task,
+        processor: typing.Any,
+        started_at: float,
+        **kwargs: typing.Any,
+    ):
+        slow_threshold = None
+        if processor is not None:
+            slow_threshold = processor.slow_threshold
+        if slow_threshold is None:
+            slow_threshold = self.default_slow_threshold
+        if slow_threshold is None:
+            return
+        ident = threading.get_ident()
+        self._running_tasks[ident] = RunningTask(
+            task_id=task.id,
+            channel=task.channel,
+            module=task.module,
+            func_name=task.func_name,
+            thread_ident=ident,
+            started_at=started_at,
+            slow_threshold=slow_threshold,
+        )
+
+    def _on_task_completed(self, sender: typing.Any, **kwargs: typing.Any):
+        self._running_tasks.pop(threading.get_ident(), None)
+
+    @property
+    def slow_tasks(self) -> list[RunningTask]:
+        """Tasks which are still running and have been reported as slow"""
+        return [
+            running_task
+            for running_task in list(self._running_tasks.values())
+            if running_task.reported
+        ]
+
+    def check(self):
+        now = time.perf_counter()
+        frames = None
+        for running_task in list(self._running_tasks.values()):
+            if running_task.reported:
+                continue
+            elapsed = now - running_task.started_at
+            if elapsed < running_task.slow_threshold:
+                continue
+            running_task.reported = True
+            if frames is None:
+                frames = sys._current_frames()
+            frame = frames.get(running_task.thread_ident)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            logger.warning(
+                "Task %s (channel=%s, module=%s, func=%s) has been running for %.1f seconds, "
+                "exceeding slow threshold %s seconds, stack:\n%s",
+                running_task.task_id,
+                running_task.channel,
+                running_task.module,
+                running_task.func_name,
+                elapsed,
+                running_task.slow_threshold,
+                stack,
+            )
+            stats.stats.inc(
+                stats.TASKS_SLOW,
+                (running_task.channel, running_task.module, running_task.func_name),
+            )
+            events.task_slow.send(
+                self, running_task=running_task, elapsed=elapsed, stack=stack
+            )
+        stats.stats.set(stats.SLOW_TASKS_RUNNING, len(self.slow_tasks))
+
+    def run(self):
+        while not self._shutdown_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Failed to check slow tasks")
+
+    def start(self):
+        events.task_started.connect(self._on_task_started)
+        events.task_completed.connect(self._on_task_completed)
+        self._thread = threading.Thread(target=self.run, name="watchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        events.task_started.disconnect(self._on_task_started)
+        events.task_completed.disconnect(self._on_task_completed)
+        self._shutdown_event.set()
+        if self._thread is not None:
+            self._thread.join(1)
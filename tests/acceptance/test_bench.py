@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from bq import models
+from bq.app import BeanQueue
+from bq.benchmark import Benchmark
+from bq.benchmark import BenchmarkSettings
+from bq.config import Config
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_benchmark(db: Session, db_url: str, threads: int):
+    app = BeanQueue(config=Config(DATABASE_URL=db_url, POLL_TIMEOUT=1))
+    benchmark = Benchmark(app)
+
+    result = benchmark.run(
+        BenchmarkSettings(
+            tasks=20,
+            workers=2,
+            batch_size=5,
+            threads=threads,
+            workload="sleep",
+            sleep_seconds=0.01,
+            timeout=30,
+        )
+    )
+
+    assert result.done == 20
+    assert result.failed == 0
+    assert result.throughput > 0
+    assert 0 <= result.enqueue_to_start_p50 <= result.enqueue_to_start_p99
+    assert result.enqueue_to_start_p50 < result.enqueue_to_finish_p50
+    assert result.enqueue_to_finish_p50 <= result.enqueue_to_finish_p99
+    # cleaned up after the benchmark
+    assert db.query(models.Task).count() == 0
+    assert db.query(models.Worker).count() == 0
+
+
+def test_benchmark_duration(db: Session, db_url: str):
+    app = BeanQueue(config=Config(DATABASE_URL=db_url, POLL_TIMEOUT=1))
+    benchmark = Benchmark(app)
+
+    result = benchmark.run(
+        BenchmarkSettings(
+            tasks=10,
+            workers=1,
+            batch_size=5,
+            workload="noop",
+            timeout=30,
+            duration=2,
+            report_interval=0.5,
+        )
+    )
+
+    # the backlog was topped up more than once
+    assert result.done > 10
+    assert result.failed == 0
+    assert len(result.throughput_windows) >= 3
+    assert all(throughput >= 0 for throughput in result.throughput_windows)
+    assert sum(result.throughput_windows) > 0
+    assert db.query(models.Task).count() == 0
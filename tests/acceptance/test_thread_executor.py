@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 from .fixtures.thread_processors import app
 from .fixtures.thread_processors import slow_task
 from .fixtures.thread_processors import concurrent_task
+from .fixtures.thread_processors import failing_task
 from .fixtures.thread_processors import timed_task
 from bq import models
 from bq.config import Config
@@ -601,3 +602,68 @@ def test_staggered_task_arrival_proves_concurrency(db: Session, db_url: str):
 
     proc.kill()
     proc.join(3)
+
+
+def run_process_cmd_with_completion_batch(db_url: str, max_workers: int):
+    """Run worker process with buffered completion writes enabled."""
+    app.config = Config(
+        PROCESSOR_PACKAGES=["tests.acceptance.fixtures.thread_processors"],
+        DATABASE_URL=db_url,
+        MAX_WORKER_THREADS=max_workers,
+        BATCH_SIZE=10,
+        COMPLETION_BATCH_ENABLED=True,
+        COMPLETION_BATCH_SIZE=10,
+        COMPLETION_BATCH_INTERVAL=0.05,
+    )
+    app.process_tasks(channels=("thread-tests",))
+
+
+def test_thread_executor_with_completion_batch(db: Session, db_url: str):
+    """Test that buffered completions are written with their results and events."""
+    proc = Process(
+        target=run_process_cmd_with_completion_batch,
+        args=(db_url, 4),
+    )
+    proc.start()
+
+    task_count = 30
+    for i in range(task_count):
+        db.add(concurrent_task.run(value=i))
+    db.add(failing_task.run(task_num=0, should_fail=True))
+    db.commit()
+
+    begin = datetime.datetime.now()
+    while True:
+        db.expire_all()
+        done_tasks = (
+            db.query(models.Task)
+            .filter(models.Task.state == models.TaskState.DONE)
+            .count()
+        )
+        failed_tasks = (
+            db.query(models.Task)
+            .filter(models.Task.state == models.TaskState.FAILED)
+            .count()
+        )
+        if done_tasks == task_count and failed_tasks == 1:
+            break
+        delta = datetime.datetime.now() - begin
+        if delta.total_seconds() > 15:
+            raise TimeoutError(
+                f"Timeout waiting for all tasks to finish. "
+                f"Done: {done_tasks}/{task_count}, Failed: {failed_tasks}"
+            )
+        time.sleep(0.2)
+
+    for task in db.query(models.Task).filter(
+        models.Task.state == models.TaskState.DONE
+    ):
+        assert task.result == task.kwargs["value"] ** 2
+        assert [event.type for event in task.events] == [models.EventType.COMPLETE]
+    failed_task = (
+        db.query(models.Task).filter(models.Task.state == models.TaskState.FAILED).one()
+    )
+    assert [event.type for event in failed_task.events] == [models.EventType.FAILED]
+
+    proc.kill()
+    proc.join(3)
@@ -1,4 +1,5 @@
 import os
+import pathlib
 import typing
 
 import pytest
@@ -9,9 +10,47 @@ from sqlalchemy.engine import Engine
 from .factories import EventFactory
 from .factories import TaskFactory
 from .factories import WorkerFactory
+from bq import stats
 from bq.db.base import Base
 from bq.db.session import Session
 
+PERFORMANCE_DIR = pathlib.Path(__file__).parent / "performance"
+
+
+def pytest_addoption(parser: pytest.Parser):
+    group = parser.getgroup("performance")
+    group.addoption(
+        "--performance",
+        action="store_true",
+        help="run the performance regression tests",
+    )
+    group.addoption(
+        "--performance-baseline",
+        default=str(PERFORMANCE_DIR / ".baseline.json"),
+        help="baseline file of the performance tests",
+    )
+    group.addoption(
+        "--performance-tolerance",
+        type=float,
+        default=0.3,
+        help="fail the performance tests if slower than the baseline by more than this ratio",
+    )
+    group.addoption(
+        "--update-performance-baseline",
+        action="store_true",
+        help="write the measurements of the performance tests as the new baseline",
+    )
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items: list[pytest.Item]):
+    if config.getoption("--performance"):
+        return
+    skip = pytest.mark.skip(reason="need --performance option to run")
+    for item in items:
+        if "performance" in item.keywords:
+            item.add_marker(skip)
+
+
 register(TaskFactory)
 register(WorkerFactory)
 register(EventFactory)
@@ -36,3 +75,12 @@ def db(engine: Engine) -> typing.Generator[Session, None, None]:
     finally:
         Session.remove()
     Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def stats_receivers() -> typing.Generator[None, None, None]:
+    stats.connect_receivers()
+    try:
+        yield
+    finally:
+        stats.disconnect_receivers()
@@ -0,0 +1,96 @@
+import dataclasses
+import json
+import pathlib
+import statistics
+import time
+import typing
+
+import pytest
+
+
+@dataclasses.dataclass
+class Baseline:
+    path: pathlib.Path
+    tolerance: float
+    update: bool
+    # seconds per operation of each benchmark
+    values: dict[str, float] = dataclasses.field(default_factory=dict)
+    changed: bool = False
+
+    @classmethod
+    def load(cls, path: pathlib.Path, tolerance: float, update: bool) -> "Baseline":
+        values = {}
+        if path.exists():
+            values = json.loads(path.read_text())
+        return cls(path=path, tolerance=tolerance, update=update, values=values)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.values, indent=2, sort_keys=True) + "\n")
+
+    def check(self, name: str, seconds: float):
+        expected = self.values.get(name)
+        if self.update or expected is None:
+            self.values[name] = seconds
+            self.changed = True
+            return
+        limit = expected * (1 + self.tolerance)
+        assert seconds <= limit, (
+            f"{name} took {seconds * 1000:.3f}ms per operation, "
+            f"slower than the baseline {expected * 1000:.3f}ms by more than {self.tolerance:.0%}"
+        )
+
+
+class Benchmark:
+    def __init__(self, baseline: Baseline, name: str):
+        self.baseline = baseline
+        self.name = name
+
+    def __call__(
+        self,
+        func: typing.Callable[..., typing.Any],
+        setup: typing.Callable[[], typing.Any] | None = None,
+        rounds: int = 20,
+        operations: int = 1,
+        warmup: int = 2,
+    ) -> float:
+        """Run the function for the given rounds and check the median seconds per operation against the baseline.
+
+        :param func: function to measure, called with the return value of setup if given
+        :param setup: function to prepare each round, not included in the measurement
+        :param rounds: number of rounds to measure
+        :param operations: number of operations each call of the function performs
+        :param warmup: number of rounds to run before measuring
+        """
+        samples = []
+        for index in range(warmup + rounds):
+            args = (setup(),) if setup is not None else ()
+            begin = time.perf_counter()
+            func(*args)
+            elapsed = time.perf_counter() - begin
+            if index >= warmup:
+                samples.append(elapsed / operations)
+        seconds = statistics.median(samples)
+        self.baseline.check(self.name, seconds)
+        return seconds
+
+
+@pytest.fixture(scope="session")
+def performance_baseline(
+    pytestconfig: pytest.Config,
+) -> typing.Generator[Baseline, None, None]:
+    baseline = Baseline.load(
+        path=pathlib.Path(pytestconfig.getoption("--performance-baseline")),
+        tolerance=pytestconfig.getoption("--performance-tolerance"),
+        update=pytestconfig.getoption("--update-performance-baseline"),
+    )
+    yield baseline
+    if baseline.changed:
+        baseline.save()
+
+
+@pytest.fixture
+def benchmark(
+    request: pytest.FixtureRequest, performance_baseline: Baseline
+) -> Benchmark:
+    return Benchmark(performance_baseline, name=request.node.name)
@@ -0,0 +1,315 @@
+import datetime
+import itertools
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Query
+from sqlalchemy.orm import Session
+
+from .conftest import Benchmark
+from bq import models
+from bq.app import BeanQueue
+from bq.config import Config
+from bq.processors.processor import Processor
+from bq.processors.registry import Registry
+from bq.services.dispatch import DispatchService
+from bq.services.worker import WorkerService
+
+pytestmark = pytest.mark.performance
+
+BATCH_SIZE = 100
+
+
+def insert_tasks(
+    db: Session,
+    channel: str,
+    count: int,
+    state: models.TaskState = models.TaskState.PENDING,
+    worker_id: uuid.UUID | None = None,
+):
+    db.execute(
+        models.Task.__table__.insert(),
+        [
+            dict(
+                channel=channel,
+                module="perf",
+                func_name="noop",
+                kwargs={},
+                state=state,
+                worker_id=worker_id,
+            )
+            for _ in range(count)
+        ],
+    )
+    db.commit()
+
+
+def test_dispatch_claim(db: Session, worker: models.Worker, benchmark: Benchmark):
+    dispatch_service = DispatchService(db)
+    # a backlog of tasks in the channel, so that claiming works against a non-trivial index
+    insert_tasks(db, "perf", 10_000)
+
+    def claim():
+        tasks = dispatch_service.dispatch(["perf"], worker_id=worker.id, limit=10).all()
+        db.commit()
+        assert len(tasks) == 10
+
+    benchmark(claim, rounds=50)
+
+
+def test_process_overhead(db: Session, benchmark: Benchmark):
+    processor = Processor(channel="perf", module="perf", name="noop", func=lambda: None)
+
+    rounds = itertools.count()
+
+    def setup() -> list[models.Task]:
+        # a channel for each round, so that the tasks processed by previous rounds are left out
+        channel = f"perf-{next(rounds)}"
+        insert_tasks(db, channel, BATCH_SIZE, state=models.TaskState.PROCESSING)
+        return db.query(models.Task).filter(models.Task.channel == channel).all()
+
+    def process(tasks: list[models.Task]):
+        for task in tasks:
+            processor.process(task=task)
+
+    benchmark(process, setup=setup, operations=BATCH_SIZE)
+
+
+def insert_retried_tasks(db: Session, channel: str, count: int):
+    """Insert pending tasks with large kwargs, failed once with an error message and a partial result"""
+    db.execute(
+        models.Task.__table__.insert(),
+        [
+            dict(
+                channel=channel,
+                module="perf",
+                func_name="noop",
+                kwargs=dict(rows=[dict(index=index) for index in range(200)]),
+                result=dict(progress=[index for index in range(200)]),
+                error_message="Traceback (most recent call last):\n" * 50,
+            )
+            for _ in range(count)
+        ],
+    )
+    db.commit()
+
+
+def measure_bytes(db: Session, query: Query) -> int:
+    """Bytes of the rows returned by the query in text format, which is how psycopg2 receives them"""
+    statement = query.statement.compile(
+        dialect=postgresql.dialect(), compile_kwargs=dict(literal_binds=True)
+    )
+    return db.scalar(
+        text(f"SELECT sum(octet_length(CAST(rows AS text))) FROM ({statement}) AS rows")
+    )
+
+
+def test_dispatch_bytes_per_claim(db: Session):
+    dispatch_service = DispatchService(db)
+    insert_retried_tasks(db, "perf", BATCH_SIZE)
+    task_ids = db.scalars(select(models.Task.id)).all()
+
+    full = measure_bytes(db, db.query(models.Task).filter(models.Task.id.in_(task_ids)))
+    deferred = measure_bytes(db, dispatch_service.make_load_query(task_ids))
+    deferred_kwargs = measure_bytes(
+        db, dispatch_service.make_load_query(task_ids, defer_kwargs=True)
+    )
+    assert deferred_kwargs < deferred < full
+    # the error message and the result are most of the row
+    assert deferred < full * 0.7
+    # only the small columns are left once the kwargs are deferred as well
+    assert deferred_kwargs / BATCH_SIZE < 256
+
+
+@pytest.mark.parametrize("defer_kwargs", [False, True])
+def test_dispatch_claim_large_payload(
+    db: Session, worker: models.Worker, benchmark: Benchmark, defer_kwargs: bool
+):
+    dispatch_service = DispatchService(db)
+    insert_retried_tasks(db, "perf", 2_000)
+
+    def claim():
+        tasks = dispatch_service.dispatch(
+            ["perf"], worker_id=worker.id, limit=10, defer_kwargs=defer_kwargs
+        ).all()
+        db.commit()
+        assert len(tasks) == 10
+
+    benchmark(claim, rounds=50)
+
+
+def test_notify_poll_round_trip(db: Session, benchmark: Benchmark):
+    dispatch_service = DispatchService(db)
+    dispatch_service.listen(["perf"])
+    db.commit()
+
+    def round_trip():
+        dispatch_service.notify(["perf"])
+        db.commit()
+        notifications = list(dispatch_service.poll(timeout=1))
+        assert [notification.channel for notification in notifications] == ["perf"]
+
+    benchmark(round_trip, rounds=100)
+
+
+def test_bulk_submit(db: Session, benchmark: Benchmark):
+    def submit():
+        db.add_all(
+            [
+                models.Task(channel="perf", module="perf", func_name="noop", kwargs={})
+                for _ in range(BATCH_SIZE)
+            ]
+        )
+        db.commit()
+
+    benchmark(submit, operations=BATCH_SIZE)
+
+
+def test_dead_worker_recovery(db: Session, benchmark: Benchmark):
+    worker_service = WorkerService(db)
+
+    def setup() -> models.Worker:
+        now = db.scalar(func.now())
+        worker = models.Worker(
+            name="dead-worker",
+            channels=["perf"],
+            last_heartbeat=now - datetime.timedelta(seconds=60),
+        )
+        db.add(worker)
+        db.flush()
+        insert_tasks(
+            db,
+            "perf",
+            BATCH_SIZE,
+            state=models.TaskState.PROCESSING,
+            worker_id=worker.id,
+        )
+        return worker
+
+    def recover(worker: models.Worker):
+        dead_workers = worker_service.fetch_dead_workers(timeout=30)
+        task_count = worker_service.reschedule_dead_tasks(
+            dead_workers.with_entities(models.Worker.id)
+        )
+        db.commit()
+        assert task_count == BATCH_SIZE
+        assert worker.state == models.WorkerState.NO_HEARTBEAT
+
+    benchmark(recover, setup=setup, operations=BATCH_SIZE)
+
+
+def test_threaded_idle_dispatch_rate(
+    db: Session, engine: Engine, worker: models.Worker
+):
+    """Count the dispatch queries of the threaded loop with nothing ready to dispatch, while the running tasks
+    keep completing, and check that a scheduled task is still picked up within POLL_TIMEOUT
+    """
+    poll_timeout = 1
+    duration = 3.5
+    app = BeanQueue(
+        config=Config(MAX_WORKER_THREADS=16, BATCH_SIZE=16, POLL_TIMEOUT=poll_timeout),
+        engine=engine,
+    )
+    registry = Registry()
+    registry.add(
+        Processor(
+            channel="perf",
+            module="perf",
+            name="sleep",
+            func=lambda seconds: time.sleep(seconds),
+        )
+    )
+    now = db.scalar(func.now())
+    db.add_all(
+        [
+            # a completion every 0.3 seconds
+            models.Task(
+                channel="perf",
+                module="perf",
+                func_name="sleep",
+                kwargs=dict(seconds=0.3 * index),
+            )
+            for index in range(1, 12)
+        ]
+        + [
+            models.Task(
+                channel="perf",
+                module="perf",
+                func_name="sleep",
+                kwargs=dict(seconds=0),
+                scheduled_at=now + datetime.timedelta(seconds=1.5),
+            )
+        ]
+    )
+    db.commit()
+
+    dispatch_db = app.make_session()
+    listen_db = app.make_session()
+    dispatch_service = DispatchService(dispatch_db)
+    listen_service = DispatchService(listen_db)
+    listen_service.listen(["perf"])
+    listen_db.commit()
+
+    dispatch_count = 0
+    dispatch = dispatch_service.dispatch
+    poll = listen_service.poll
+    begin = time.monotonic()
+
+    def count_dispatch(*args, **kwargs):
+        nonlocal dispatch_count
+        dispatch_count += 1
+        return dispatch(*args, **kwargs)
+
+    def poll_until_done(timeout: float, waker):
+        remaining = duration - (time.monotonic() - begin)
+        if remaining <= 0:
+            raise KeyboardInterrupt()
+        if timeout < remaining:
+            yield from poll(timeout=timeout, waker=waker)
+            return
+        try:
+            yield from poll(timeout=remaining, waker=waker)
+        except TimeoutError:
+            raise KeyboardInterrupt()
+
+    dispatch_service.dispatch = count_dispatch
+    listen_service.poll = poll_until_done
+    executor = ThreadPoolExecutor(max_workers=16)
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            app._process_tasks_threaded(
+                db=dispatch_db,
+                executor=executor,
+                dispatch_service=dispatch_service,
+                listen_service=listen_service,
+                registry=registry,
+                channels=("perf",),
+                worker_id=worker.id,
+            )
+    finally:
+        executor.shutdown(wait=True)
+        app._close_thread_sessions()
+        dispatch_db.close()
+        listen_db.close()
+
+    # the first dispatch claims the running tasks, then one query every POLL_TIMEOUT, the completions waking up
+    # the loop don't query
+    assert dispatch_count <= 1 + duration / poll_timeout
+    db.expire_all()
+    assert (
+        db.scalar(
+            select(func.count())
+            .select_from(models.Task)
+            .where(models.Task.channel == "perf")
+            .where(models.Task.scheduled_at.is_not(None))
+            .where(models.Task.state == models.TaskState.DONE)
+        )
+        == 1
+    )
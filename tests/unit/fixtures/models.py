@@ -0,0 +1,29 @@
+import uuid
+
+from sqlalchemy import ForeignKey
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+
+from bq import models
+from bq.db.base import Base
+
+
+class TimestampedTask(models.TaskModelMixin, models.TaskModelTimestampsMixin, Base):
+    __tablename__ = "bq_timestamped_tasks"
+
+    worker_id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True),
+        ForeignKey("bq_workers.id"),
+        nullable=True,
+    )
+
+
+class DedupTask(models.TaskModelMixin, models.TaskModelDedupMixin, Base):
+    __tablename__ = "bq_dedup_tasks"
+
+    worker_id: Mapped[uuid.UUID] = mapped_column(
+        UUID(as_uuid=True),
+        ForeignKey("bq_workers.id"),
+        nullable=True,
+    )
@@ -1,6 +1,8 @@
 import typing
 
 import pytest
+from sqlalchemy import event
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 from bq import models
@@ -117,6 +119,7 @@ def test_process_savepoint_rollback(
         module="mock.module",
         name="my_func",
         func=func,
+        isolation="savepoint",
     )
     processor.process(task=task)
     db.commit()
@@ -153,3 +156,170 @@ def test_processor_helper_create_child_task(
     db.expire_all()
     assert child_task.parent == task
     assert task.children == [child_task]
+
+
+@pytest.mark.parametrize("task__func_name", ["my_func"])
+def test_process_transaction_rollback(
+    db: Session,
+    task: models.Task,
+):
+    def func(db: Session, task: models.Task):
+        task.func_name = "changed"
+        db.add(task)
+        db.flush()
+        raise ValueError("boom")
+
+    processor = Processor(
+        channel="mock-channel",
+        module="mock.module",
+        name="my_func",
+        func=func,
+        isolation="transaction",
+    )
+    processor.process(task=task, event_cls=models.Event)
+    db.commit()
+    db.expire_all()
+    assert task.state == models.TaskState.FAILED
+    assert task.func_name == "my_func"
+    assert [event.type for event in task.events] == [models.EventType.FAILED]
+
+
+@pytest.mark.parametrize(
+    "func, isolation, expected",
+    [
+        (lambda: None, None, "none"),
+        (lambda task: None, None, "none"),
+        (lambda db: None, None, "savepoint"),
+        (lambda savepoint: None, None, "savepoint"),
+        (lambda db: None, "none", "none"),
+        (lambda: None, "transaction", "transaction"),
+    ],
+)
+def test_processor_resolved_isolation(
+    func: typing.Callable, isolation: str | None, expected: str
+):
+    processor = Processor(
+        channel="mock-channel",
+        module="mock.module",
+        name="my_func",
+        func=func,
+        isolation=isolation,
+    )
+    assert processor.resolved_isolation == expected
+
+
+@pytest.mark.parametrize(
+    "func, isolation",
+    [
+        (lambda: None, "serializable"),
+        (lambda savepoint: None, "none"),
+        (lambda savepoint: None, "transaction"),
+    ],
+)
+def test_processor_invalid_isolation(func: typing.Callable, isolation: str):
+    with pytest.raises(ValueError):
+        Processor(
+            channel="mock-channel",
+            module="mock.module",
+            name="my_func",
+            func=func,
+            isolation=isolation,
+        )
+
+
+@pytest.mark.parametrize("task__state", [models.TaskState.PROCESSING])
+@pytest.mark.parametrize("task__kwargs", [dict(value=1)])
+@pytest.mark.parametrize(
+    "keep_result_for, keep_kwargs_for, expected",
+    [
+        (None, None, (dict(value=2), dict(value=1))),
+        (60, 60, (dict(value=2), dict(value=1))),
+        (0, None, (None, dict(value=1))),
+        (None, 0, (dict(value=2), None)),
+    ],
+)
+def test_process_task_keep_for(
+    db: Session,
+    task: models.Task,
+    keep_result_for: float | None,
+    keep_kwargs_for: float | None,
+    expected: tuple,
+):
+    processor = Processor(
+        channel="mock-channel",
+        module="mock.module",
+        name="my_func",
+        func=lambda value: dict(value=value + 1),
+        keep_result_for=keep_result_for,
+        keep_kwargs_for=keep_kwargs_for,
+    )
+    assert processor.process(task=task) == dict(value=2)
+    db.commit()
+    assert (task.result, task.kwargs) == expected
+    # cleared as SQL NULL instead of JSON null
+    assert db.execute(
+        text("SELECT result IS NULL, kwargs IS NULL FROM bq_tasks WHERE id = :id"),
+        dict(id=task.id),
+    ).one() == (expected[0] is None, expected[1] is None)
+
+
+def test_processor_invalid_keep_for():
+    with pytest.raises(ValueError):
+        Processor(
+            channel="mock-channel",
+            module="mock.module",
+            name="my_func",
+            func=lambda: None,
+            keep_result_for=-1,
+        )
+
+
+@pytest.mark.parametrize(
+    "isolation, expected_statements",
+    [
+        # the task UPDATEs are flushed together in one batch, plus one INSERT per event
+        ("none", 11),
+        # begin_nested() flushes the previous task's UPDATE and event INSERT one by one
+        ("savepoint", 20),
+        # commit() flushes the previous task's UPDATE and event INSERT one by one as well, without reloading the
+        # other tasks of the batch
+        ("transaction", 20),
+    ],
+)
+def test_process_statements_per_batch(
+    db: Session,
+    task_factory: typing.Callable,
+    isolation: str,
+    expected_statements: int,
+):
+    tasks = [task_factory(state=models.TaskState.PROCESSING) for _ in range(10)]
+    processor = Processor(
+        channel="mock-channel",
+        module="mock.module",
+        name="my_func",
+        func=lambda: "result",
+        isolation=isolation,
+    )
+    for task in tasks:
+        # load the task before counting statements
+        assert task.kwargs == {}
+
+    statement_count = 0
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        nonlocal statement_count
+        statement_count += 1
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for task in tasks:
+            processor.process(task=task, event_cls=models.Event)
+        db.flush()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    db.commit()
+
+    assert statement_count == expected_statements
+    for task in tasks:
+        assert task.state == models.TaskState.DONE
@@ -3,7 +3,9 @@ from sqlalchemy.orm import Session
 
 from .. import fixtures
 from .conftest import processor_module
+from bq import events
 from bq import models
+from bq import stats
 from bq.processors.registry import collect
 from bq.processors.registry import Registry
 
@@ -50,3 +52,68 @@ def test_registry_process(
     db: Session, registry: Registry, task: models.Task, expected: str
 ):
     assert registry.process(task) == expected
+
+
+@pytest.mark.parametrize(
+    "task__channel, task__module, task__func_name",
+    [("mock-channel", "tests.unit.fixtures.processors", "processor0")],
+)
+def test_registry_process_stats(
+    db: Session, registry: Registry, task: models.Task, stats_receivers: None
+):
+    labels = (task.channel, task.module, task.func_name)
+    completed = stats.stats.get(stats.TASKS_COMPLETED, labels)
+    processed = stats.stats.get(stats.TASK_PROCESSING_SECONDS, labels)
+
+    registry.process(task)
+
+    assert stats.stats.get(stats.TASKS_COMPLETED, labels) == completed + 1
+    assert stats.stats.get(stats.TASK_PROCESSING_SECONDS, labels) == processed + 1
+
+
+@pytest.mark.parametrize(
+    "task__channel, task__module, task__func_name",
+    [("mock-channel", "tests.unit.fixtures.processors", "missing")],
+)
+def test_registry_process_missing_processor_stats(
+    db: Session, registry: Registry, task: models.Task, stats_receivers: None
+):
+    labels = (task.channel, task.module, task.func_name)
+    failed = stats.stats.get(stats.TASKS_FAILED, labels)
+
+    registry.process(task)
+
+    assert task.state == models.TaskState.FAILED
+    assert stats.stats.get(stats.TASKS_FAILED, labels) == failed + 1
+
+
+@pytest.mark.parametrize(
+    "task__channel, task__module, task__func_name",
+    [("mock-channel", "tests.unit.fixtures.processors", "processor0")],
+)
+def test_registry_process_signals(db: Session, registry: Registry, task: models.Task):
+    calls = []
+
+    @events.task_started.connect
+    def on_started(sender, **kwargs):
+        calls.append(("started", kwargs))
+
+    @events.task_completed.connect
+    def on_completed(sender, **kwargs):
+        calls.append(("completed", kwargs))
+
+    try:
+        registry.process(task)
+    finally:
+        events.task_started.disconnect(on_started)
+        events.task_completed.disconnect(on_completed)
+
+    assert [name for name, _ in calls] == ["started", "completed"]
+    started_kwargs = calls[0][1]
+    completed_kwargs = calls[1][1]
+    assert started_kwargs["task"] is task
+    assert started_kwargs["processor"] is registry.get(task)
+    assert completed_kwargs["processor"] is registry.get(task)
+    assert completed_kwargs["state"] == models.TaskState.DONE
+    assert completed_kwargs["started_at"] == started_kwargs["started_at"]
+    assert completed_kwargs["duration"] >= 0
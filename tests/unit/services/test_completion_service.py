@@ -0,0 +1,238 @@
+import datetime
+import hashlib
+
+import pytest
+from sqlalchemy import null
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ...factories import TaskFactory
+from ...factories import WorkerFactory
+from ..fixtures.models import TimestampedTask
+from bq import models
+from bq.codecs import decode_value
+from bq.codecs import ENVELOPE_KEY
+from bq.codecs import with_codec
+from bq.completion import CompletionBuffer
+from bq.services.completion import Completion
+from bq.services.completion import CompletionService
+
+
+@pytest.fixture
+def completion_service(db: Session) -> CompletionService:
+    return CompletionService(db)
+
+
+def test_complete(
+    db: Session,
+    completion_service: CompletionService,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+):
+    tasks = [
+        task_factory(state=models.TaskState.PROCESSING, worker=worker) for _ in range(3)
+    ]
+    other_task = task_factory(state=models.TaskState.PROCESSING, worker=worker)
+
+    count = completion_service.complete(
+        [
+            Completion(task_id=tasks[0].id, result={"value": 0}),
+            Completion(task_id=tasks[1].id, result=[1]),
+            Completion(task_id=tasks[2].id, result=None),
+        ],
+        worker_id=worker.id,
+    )
+    db.commit()
+    db.expire_all()
+
+    assert count == 3
+    for task in tasks:
+        assert task.state == models.TaskState.DONE
+        assert [event.type for event in task.events] == [models.EventType.COMPLETE]
+    assert [task.result for task in tasks] == [{"value": 0}, [1], None]
+    assert other_task.state == models.TaskState.PROCESSING
+    assert not other_task.events
+
+
+def test_complete_skip_tasks_of_other_workers(
+    db: Session,
+    completion_service: CompletionService,
+    worker: models.Worker,
+    worker_factory: WorkerFactory,
+    task_factory: TaskFactory,
+):
+    other_worker = worker_factory()
+    rescheduled_task = task_factory(state=models.TaskState.PENDING, worker=None)
+    other_worker_task = task_factory(
+        state=models.TaskState.PROCESSING, worker=other_worker
+    )
+
+    count = completion_service.complete(
+        [
+            Completion(task_id=rescheduled_task.id, result=1),
+            Completion(task_id=other_worker_task.id, result=2),
+        ],
+        worker_id=worker.id,
+    )
+    db.commit()
+    db.expire_all()
+
+    assert count == 0
+    assert rescheduled_task.state == models.TaskState.PENDING
+    assert other_worker_task.state == models.TaskState.PROCESSING
+    assert not rescheduled_task.events
+    assert not other_worker_task.events
+
+
+def test_complete_without_event_model(
+    db: Session,
+    worker: models.Worker,
+    task: models.Task,
+):
+    task.state = models.TaskState.PROCESSING
+    task.worker = worker
+    db.commit()
+
+    completion_service = CompletionService(db, event_model=None)
+    count = completion_service.complete(
+        [Completion(task_id=task.id, result="done")], worker_id=worker.id
+    )
+    db.commit()
+    db.expire_all()
+
+    assert count == 1
+    assert task.state == models.TaskState.DONE
+    assert task.result == "done"
+    assert not task.events
+
+
+def test_completion_buffer(
+    db: Session,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+):
+    tasks = [
+        task_factory(state=models.TaskState.PROCESSING, worker=worker) for _ in range(5)
+    ]
+    buffer = CompletionBuffer(
+        make_session=lambda: Session(bind=db.get_bind()),
+        make_service=CompletionService,
+        worker_id=worker.id,
+        max_size=2,
+        interval=60,
+    )
+    buffer.start()
+    for index, task in enumerate(tasks):
+        buffer.add(Completion(task_id=task.id, result=index))
+    buffer.shutdown()
+
+    db.expire_all()
+    for index, task in enumerate(tasks):
+        assert task.state == models.TaskState.DONE
+        assert task.result == index
+        assert len(task.events) == 1
+
+
+def test_completion_buffer_without_results(
+    db: Session,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+):
+    tasks = [
+        task_factory(state=models.TaskState.PROCESSING, worker=worker) for _ in range(2)
+    ]
+    task_ids = [task.id for task in tasks]
+    buffer = CompletionBuffer(
+        make_session=lambda: Session(bind=db.get_bind()),
+        make_service=CompletionService,
+        worker_id=worker.id,
+    )
+    buffer.flush([Completion(task_id=task_id) for task_id in task_ids])
+
+    db.expire_all()
+    for task in tasks:
+        assert task.state == models.TaskState.DONE
+        assert task.result is None
+        assert len(task.events) == 1
+    # JSON null like the results written through the ORM, not SQL NULL
+    assert db.scalars(
+        text("SELECT jsonb_typeof(result) FROM bq_tasks WHERE id = ANY(:ids)"),
+        dict(ids=task_ids),
+    ).all() == ["null", "null"]
+
+
+def test_complete_with_timestamps(db: Session, worker: models.Worker):
+    task = TimestampedTask(
+        channel="images",
+        module="my_module",
+        func_name="resize",
+        state=models.TaskState.PROCESSING,
+        worker_id=worker.id,
+    )
+    db.add(task)
+    db.commit()
+    started_at = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    finished_at = started_at + datetime.timedelta(seconds=3)
+
+    completion_service = CompletionService(
+        db, task_model=TimestampedTask, event_model=None
+    )
+    count = completion_service.complete(
+        [
+            Completion(
+                task_id=task.id,
+                result=1,
+                started_at=started_at,
+                finished_at=finished_at,
+            )
+        ],
+        worker_id=worker.id,
+    )
+    db.commit()
+    db.expire_all()
+
+    assert count == 1
+    assert task.state == models.TaskState.DONE
+    assert task.started_at == started_at
+    assert task.finished_at == finished_at
+
+
+def test_complete_with_codec(
+    db: Session,
+    completion_service: CompletionService,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+):
+    task = task_factory(state=models.TaskState.PROCESSING, worker=worker)
+    result = dict(
+        rows=[hashlib.sha256(str(index).encode()).hexdigest() for index in range(100)]
+    )
+    completion_service.complete(
+        [Completion(task_id=task.id, result=with_codec(result, "msgpack+zstd"))],
+        worker_id=worker.id,
+    )
+    db.commit()
+    raw_result = db.scalar(
+        text("SELECT result FROM bq_tasks WHERE id = :id"), dict(id=task.id)
+    )
+    assert raw_result[ENVELOPE_KEY] == "msgpack+zstd"
+    db.expire_all()
+    assert decode_value(task.result) == result
+
+
+def test_complete_clear_result(
+    db: Session,
+    completion_service: CompletionService,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+):
+    task = task_factory(
+        state=models.TaskState.PROCESSING, worker=worker, result=dict(value=1)
+    )
+    completion_service.complete(
+        [Completion(task_id=task.id, result=null())], worker_id=worker.id
+    )
+    db.commit()
+    assert db.scalar(
+        text("SELECT result IS NULL FROM bq_tasks WHERE id = :id"), dict(id=task.id)
+    )
@@ -1,12 +1,19 @@
 import datetime
 
 import pytest
+from sqlalchemy import event
 from sqlalchemy import func
+from sqlalchemy import inspect
 from sqlalchemy.orm import Session
 
 from ...factories import TaskFactory
+from bq import events
 from bq import models
+from bq import stats
+from bq.services.dispatch import DeferredColumnLoader
 from bq.services.dispatch import DispatchService
+from bq.utils import uuid7
+from bq.utils import Waker
 
 
 @pytest.fixture
@@ -36,6 +43,87 @@ def test_dispatch(
     assert not list(dispatch_service.dispatch([task.channel], worker_id=worker.id))
 
 
+def test_dispatch_stats(
+    db: Session,
+    dispatch_service: DispatchService,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+    stats_receivers: None,
+):
+    for _ in range(3):
+        task_factory(channel="stats-channel")
+    claimed = stats.stats.get(stats.TASKS_CLAIMED, ("stats-channel",))
+    queue_wait = stats.stats.get(stats.TASK_QUEUE_WAIT_SECONDS, ("stats-channel",))
+    dispatches = stats.stats.get(stats.DISPATCH_SECONDS)
+
+    tasks = dispatch_service.dispatch(
+        ["stats-channel"], worker_id=worker.id, limit=4
+    ).all()
+
+    assert len(tasks) == 3
+    assert stats.stats.get(stats.TASKS_CLAIMED, ("stats-channel",)) == claimed + 3
+    assert (
+        stats.stats.get(stats.TASK_QUEUE_WAIT_SECONDS, ("stats-channel",))
+        == queue_wait + 3
+    )
+    assert stats.stats.get(stats.DISPATCH_SECONDS) == dispatches + 1
+
+
+def test_dispatch_signals(
+    db: Session,
+    dispatch_service: DispatchService,
+    worker: models.Worker,
+    task: models.Task,
+):
+    calls = []
+
+    @events.dispatch_started.connect
+    def on_started(sender, **kwargs):
+        calls.append(("started", sender, kwargs))
+
+    @events.dispatch_finished.connect
+    def on_finished(sender, **kwargs):
+        calls.append(("finished", sender, kwargs))
+
+    try:
+        dispatch_service.dispatch([task.channel], worker_id=worker.id, limit=2).all()
+    finally:
+        events.dispatch_started.disconnect(on_started)
+        events.dispatch_finished.disconnect(on_finished)
+
+    assert [(name, sender) for name, sender, _ in calls] == [
+        ("started", dispatch_service),
+        ("finished", dispatch_service),
+    ]
+    started_kwargs = calls[0][2]
+    finished_kwargs = calls[1][2]
+    assert started_kwargs["channels"] == [task.channel]
+    assert started_kwargs["limit"] == 2
+    assert finished_kwargs["started_at"] == started_kwargs["started_at"]
+    assert finished_kwargs["duration"] > 0
+    (claimed,) = finished_kwargs["claimed"]
+    assert claimed.id == task.id
+    assert claimed.channel == task.channel
+    assert claimed.queue_wait >= 0
+
+
+def test_dispatch_without_receivers(
+    db: Session,
+    dispatch_service: DispatchService,
+    worker: models.Worker,
+    task: models.Task,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    def send(*args, **kwargs):
+        raise AssertionError("signal should not be sent without receivers")
+
+    monkeypatch.setattr(events.dispatch_started, "send", send)
+    monkeypatch.setattr(events.dispatch_finished, "send", send)
+    assert (
+        len(dispatch_service.dispatch([task.channel], worker_id=worker.id).all()) == 1
+    )
+
+
 @pytest.mark.parametrize(
     "task__scheduled_at", [func.now() + datetime.timedelta(seconds=10)]
 )
@@ -104,6 +192,71 @@ def test_dispatch_many(
     assert len(tasks) == 1
 
 
+def test_dispatch_order_by_id(
+    db: Session,
+    dispatch_service: DispatchService,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+):
+    now = db.scalar(func.now())
+    first_id = uuid7()
+    older = task_factory(
+        id=uuid7(), channel="ordered", created_at=now - datetime.timedelta(seconds=10)
+    )
+    first = task_factory(id=first_id, channel="ordered", created_at=now)
+
+    assert dispatch_service.dispatch(
+        ["ordered"], worker_id=worker.id, order_by_id=True
+    ).all() == [first]
+    db.rollback()
+    assert dispatch_service.dispatch(["ordered"], worker_id=worker.id).all() == [older]
+
+
+def test_dispatch_deferred_columns(
+    db: Session,
+    dispatch_service: DispatchService,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+):
+    for _ in range(2):
+        task_factory(channel="deferred", kwargs=dict(key="value"), error_message="boom")
+    worker_id = worker.id
+    db.expunge_all()
+
+    task, _ = dispatch_service.dispatch(["deferred"], worker_id=worker_id, limit=2)
+    unloaded = inspect(task).unloaded
+    assert {"result", "error_message"} <= unloaded
+    assert "kwargs" not in unloaded
+    # loaded lazily when accessed
+    assert task.error_message == "boom"
+    db.rollback()
+    db.expunge_all()
+
+    tasks = dispatch_service.dispatch(
+        ["deferred"], worker_id=worker_id, limit=2, defer_kwargs=True
+    ).all()
+    assert all("kwargs" in inspect(task).unloaded for task in tasks)
+    loader = DeferredColumnLoader(models.Task, "kwargs", [task.id for task in tasks])
+    for task in tasks:
+        db.expunge(task)
+
+    statements: list[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.get_bind(), "before_cursor_execute", before_cursor_execute)
+    try:
+        for task in tasks:
+            task = db.merge(task, load=False)
+            loader.apply(db, task)
+            assert task.kwargs == dict(key="value")
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", before_cursor_execute)
+    # loaded in bulk with one query
+    assert len(statements) == 1
+
+
 def test_listen_value_quote(db: Session, dispatch_service: DispatchService):
     dispatch_service.listen(["a", "中文", "!@#$%^&*(()-_"])
     db.commit()
@@ -118,3 +271,24 @@ def test_poll(db: Session, dispatch_service: DispatchService):
     db.commit()
     notifications = list(dispatch_service.poll(timeout=1))
     assert frozenset([n.channel for n in notifications]) == frozenset(["a", "c"])
+
+
+def test_poll_waker(db: Session, dispatch_service: DispatchService):
+    dispatch_service.listen(["a"])
+    db.commit()
+    waker = Waker()
+    try:
+        with pytest.raises(TimeoutError):
+            list(dispatch_service.poll(timeout=0.1, waker=waker))
+        waker.wake()
+        assert list(dispatch_service.poll(timeout=1, waker=waker)) == []
+        # drained, it should time out again
+        with pytest.raises(TimeoutError):
+            list(dispatch_service.poll(timeout=0.1, waker=waker))
+        waker.wake()
+        dispatch_service.notify(["a"])
+        db.commit()
+        notifications = list(dispatch_service.poll(timeout=1, waker=waker))
+        assert [n.channel for n in notifications] == ["a"]
+    finally:
+        waker.close()
@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from ..fixtures.models import TimestampedTask
+from bq import models
+from bq.processors.processor import Processor
+from bq.services.dispatch import DispatchService
+from bq.services.latency import LatencyService
+
+
+def test_lifecycle_timestamps(db: Session, worker: models.Worker):
+    task = TimestampedTask(
+        channel="images", module="my_module", func_name="resize", kwargs={}
+    )
+    db.add(task)
+    db.commit()
+
+    dispatch_service = DispatchService(db, task_model=TimestampedTask)
+    (task,) = dispatch_service.dispatch(["images"], worker_id=worker.id).all()
+    assert task.dispatched_at is not None
+    assert task.started_at is None
+    assert task.finished_at is None
+
+    processor = Processor(
+        channel="images", module="my_module", name="resize", func=lambda: None
+    )
+    processor.process(task)
+    db.commit()
+    db.expire_all()
+
+    assert task.state == models.TaskState.DONE
+    assert task.dispatched_at <= task.started_at <= task.finished_at
+
+
+def test_get_latency(db: Session):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for index in range(10):
+        created_at = now - datetime.timedelta(minutes=10)
+        dispatched_at = created_at + datetime.timedelta(seconds=index + 1)
+        db.add(
+            TimestampedTask(
+                channel="images",
+                module="my_module",
+                func_name="resize",
+                state=models.TaskState.DONE,
+                created_at=created_at,
+                dispatched_at=dispatched_at,
+                started_at=dispatched_at,
+                finished_at=dispatched_at + datetime.timedelta(seconds=2),
+            )
+        )
+    # not finished yet
+    db.add(
+        TimestampedTask(
+            channel="images",
+            module="my_module",
+            func_name="resize",
+            created_at=now,
+        )
+    )
+    # out of the window
+    db.add(
+        TimestampedTask(
+            channel="images",
+            module="my_module",
+            func_name="resize",
+            state=models.TaskState.DONE,
+            created_at=now - datetime.timedelta(days=2),
+            dispatched_at=now - datetime.timedelta(days=2),
+            started_at=now - datetime.timedelta(days=2),
+            finished_at=now - datetime.timedelta(days=1),
+        )
+    )
+    db.commit()
+
+    service = LatencyService(db, task_model=TimestampedTask)
+    (latency,) = service.get_latency(since=now - datetime.timedelta(hours=1))
+
+    assert latency.channel == "images"
+    assert latency.module == "my_module"
+    assert latency.func_name == "resize"
+    assert latency.count == 10
+    assert latency.wait.p50 == pytest.approx(5.5)
+    assert latency.wait.p99 == pytest.approx(9.91)
+    assert latency.run.p50 == pytest.approx(2)
+    assert latency.run.p95 == pytest.approx(2)
+    assert service.get_latency(since=now, channels=["images"]) == []
+
+
+def test_get_latency_without_timestamps(db: Session):
+    service = LatencyService(db)
+    with pytest.raises(ValueError):
+        service.get_latency(since=datetime.datetime.now(datetime.timezone.utc))
+
+
+def test_finished_at_index(db: Session):
+    indexes = inspect(db.get_bind()).get_indexes(TimestampedTask.__tablename__)
+    assert any(index["column_names"] == ["finished_at"] for index in indexes)
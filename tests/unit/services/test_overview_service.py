@@ -0,0 +1,116 @@
+import datetime
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ...factories import TaskFactory
+from ...factories import WorkerFactory
+from bq import models
+from bq.services.overview import ChannelOverview
+from bq.services.overview import OverviewService
+from bq.services.queue_depth import QueueDepthService
+
+
+@pytest.fixture
+def overview_service(db: Session) -> OverviewService:
+    return OverviewService(db)
+
+
+def test_get_channels(
+    db: Session, overview_service: OverviewService, task_factory: TaskFactory
+):
+    now = db.scalar(func.now())
+    task_factory(channel="images", created_at=now - datetime.timedelta(seconds=30))
+    task_factory(channel="images", created_at=now - datetime.timedelta(seconds=10))
+    task_factory(
+        channel="images",
+        created_at=now - datetime.timedelta(seconds=100),
+        scheduled_at=now + datetime.timedelta(hours=1),
+    )
+    task_factory(channel="images", state=models.TaskState.PROCESSING)
+    task_factory(channel="images", state=models.TaskState.DONE)
+    task_factory(channel="emails", state=models.TaskState.PROCESSING)
+    task_factory(channel="archived", state=models.TaskState.FAILED)
+
+    channels = overview_service.get_channels()
+    assert [channel.channel for channel in channels] == ["emails", "images"]
+    emails, images = channels
+    assert emails == ChannelOverview(
+        channel="emails",
+        pending=0,
+        processing=1,
+        scheduled=0,
+        oldest_pending_age=None,
+    )
+    assert images.pending == 3
+    assert images.processing == 1
+    assert images.scheduled == 1
+    assert images.oldest_pending_age == pytest.approx(30, abs=5)
+    assert images.done is None
+    assert images.failed is None
+
+    assert [
+        channel.channel for channel in overview_service.get_channels(["emails"])
+    ] == ["emails"]
+
+
+def test_get_channels_with_counters(db: Session, task_factory: TaskFactory):
+    QueueDepthService(db).install(shards=4)
+    db.commit()
+    now = db.scalar(func.now())
+    task_factory(channel="images", created_at=now - datetime.timedelta(seconds=30))
+    task_factory(
+        channel="images",
+        created_at=now - datetime.timedelta(seconds=100),
+        scheduled_at=now + datetime.timedelta(hours=1),
+    )
+    task_factory(channel="images", state=models.TaskState.PROCESSING)
+    task_factory(channel="images", state=models.TaskState.DONE)
+    task_factory(channel="images", state=models.TaskState.DONE)
+    task_factory(channel="archived", state=models.TaskState.FAILED)
+
+    overview_service = OverviewService(db, queue_depth_model=models.QueueDepth)
+    archived, images = overview_service.get_channels()
+    assert archived == ChannelOverview(
+        channel="archived",
+        pending=0,
+        processing=0,
+        scheduled=0,
+        oldest_pending_age=None,
+        done=0,
+        failed=1,
+    )
+    assert images.pending == 2
+    assert images.processing == 1
+    assert images.scheduled == 1
+    assert images.oldest_pending_age == pytest.approx(30, abs=5)
+    assert images.done == 2
+    assert images.failed == 0
+
+
+def test_get_workers(
+    db: Session,
+    overview_service: OverviewService,
+    worker_factory: WorkerFactory,
+    task_factory: TaskFactory,
+):
+    now = db.scalar(func.now())
+    worker0 = worker_factory(
+        channels=["images"], last_heartbeat=now - datetime.timedelta(seconds=20)
+    )
+    worker1 = worker_factory(channels=["emails"])
+    worker_factory(state=models.WorkerState.SHUTDOWN)
+    task_factory(worker=worker0, state=models.TaskState.PROCESSING)
+    task_factory(worker=worker0, state=models.TaskState.PROCESSING)
+    task_factory(worker=worker0, state=models.TaskState.DONE)
+
+    workers = {worker.id: worker for worker in overview_service.get_workers()}
+    assert frozenset(workers) == frozenset([worker0.id, worker1.id])
+    assert workers[worker0.id].in_flight == 2
+    assert workers[worker0.id].heartbeat_age == pytest.approx(20, abs=5)
+    assert workers[worker1.id].in_flight == 0
+
+    assert [worker.id for worker in overview_service.get_workers(["emails"])] == [
+        worker1.id
+    ]
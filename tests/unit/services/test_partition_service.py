@@ -0,0 +1,221 @@
+import datetime
+import typing
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy import MetaData
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from ...factories import TaskFactory
+from ..fixtures.models import DedupTask
+from bq import models
+from bq.services.dispatch import DispatchService
+from bq.services.partition import next_datetime
+from bq.services.partition import PartitionService
+from bq.services.partition import truncate_datetime
+
+
+@pytest.fixture
+def partition_service(db: Session) -> PartitionService:
+    return PartitionService(db)
+
+
+@pytest.fixture
+def partitioned_tables(
+    request: pytest.FixtureRequest, db: Session, partition_service: PartitionService
+) -> typing.Generator[None, None, None]:
+    db.execute(text("DROP TABLE bq_events, bq_tasks"))
+    partition_service.create_tables(
+        request.param,
+        interval="day",
+        premake=2,
+        storage_parameters=dict(
+            active=dict(fillfactor=70, autovacuum_vacuum_scale_factor=0.0),
+            finished=dict(autovacuum_vacuum_insert_threshold=100_000),
+        ),
+    )
+    db.commit()
+    yield
+    db.rollback()
+
+
+def make_utc(*args: int) -> datetime.datetime:
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "value, interval, expected_start, expected_next",
+    [
+        (
+            make_utc(2024, 5, 15, 13, 30),
+            "day",
+            make_utc(2024, 5, 15),
+            make_utc(2024, 5, 16),
+        ),
+        (
+            make_utc(2024, 5, 15, 13, 30),
+            "week",
+            make_utc(2024, 5, 13),
+            make_utc(2024, 5, 20),
+        ),
+        (
+            make_utc(2024, 12, 15, 13, 30),
+            "month",
+            make_utc(2024, 12, 1),
+            make_utc(2025, 1, 1),
+        ),
+    ],
+)
+def test_partition_ranges(
+    value: datetime.datetime,
+    interval: str,
+    expected_start: datetime.datetime,
+    expected_next: datetime.datetime,
+):
+    start = truncate_datetime(value, interval)
+    assert start == expected_start
+    assert next_datetime(start, interval) == expected_next
+
+
+@pytest.mark.parametrize("partitioned_tables", ["created_at"], indirect=True)
+def test_create_tables_by_created_at(
+    db: Session, partition_service: PartitionService, partitioned_tables: None
+):
+    today = truncate_datetime(db.scalar(func.now()), "day")
+    for table in (models.Task.__table__, models.Event.__table__):
+        partitions = partition_service.list_partitions(table)
+        assert [partition.name for partition in partitions] == [
+            f"{table.name}_default",
+            *(
+                f"{table.name}_p{today + datetime.timedelta(days=days):%Y%m%d}"
+                for days in range(3)
+            ),
+        ]
+        assert partitions[0].start is None
+        assert partitions[1].start == today
+    # idempotent
+    assert partition_service.create_partitions(interval="day", premake=2) == []
+
+
+@pytest.mark.parametrize("partitioned_tables", ["created_at"], indirect=True)
+def test_min_created_at_and_drop_partitions(
+    db: Session,
+    partition_service: PartitionService,
+    partitioned_tables: None,
+    task_factory: TaskFactory,
+    worker: models.Worker,
+):
+    now = db.scalar(func.now())
+    today = truncate_datetime(now, "day")
+    old = now - datetime.timedelta(days=10)
+    old_start = truncate_datetime(old, "day")
+    old_partition = f"bq_tasks_p{old_start:%Y%m%d}"
+    assert partition_service.create_partitions(interval="day", premake=0, now=old) == [
+        old_partition,
+        f"bq_events_p{old_start:%Y%m%d}",
+    ]
+    db.commit()
+    assert partition_service.get_min_created_at() == today
+
+    old_task = task_factory(created_at=old)
+    task_factory()
+    assert partition_service.get_min_created_at() == old_start
+    # the task partition is kept while it has any pending task
+    assert partition_service.drop_partitions(now - datetime.timedelta(days=5)) == [
+        f"bq_events_p{old_start:%Y%m%d}"
+    ]
+    db.rollback()
+
+    dispatch_service = DispatchService(db)
+    query = dispatch_service.make_task_query(
+        [old_task.channel], min_created_at=today
+    ).statement.compile(
+        dialect=postgresql.dialect(), compile_kwargs=dict(literal_binds=True)
+    )
+    plan = "\n".join(db.scalars(text(f"EXPLAIN {query}")))
+    assert old_partition not in plan
+    assert f"bq_tasks_p{today:%Y%m%d}" in plan
+
+    old_task.state = models.TaskState.DONE
+    db.commit()
+    assert partition_service.get_min_created_at() == today
+    dropped = partition_service.drop_partitions(now - datetime.timedelta(days=5))
+    db.commit()
+    assert frozenset(dropped) == frozenset(
+        [old_partition, f"bq_events_p{old_start:%Y%m%d}"]
+    )
+    assert old_partition not in [
+        partition.name
+        for partition in partition_service.list_partitions(models.Task.__table__)
+    ]
+
+
+@pytest.mark.parametrize("partitioned_tables", ["state"], indirect=True)
+def test_create_tables_by_state(
+    db: Session,
+    partition_service: PartitionService,
+    partitioned_tables: None,
+    task_factory: TaskFactory,
+    worker: models.Worker,
+):
+    assert [
+        partition.name
+        for partition in partition_service.list_partitions(models.Task.__table__)
+    ] == ["bq_tasks_active", "bq_tasks_finished"]
+    task = task_factory()
+    dispatch_service = DispatchService(db)
+    assert dispatch_service.dispatch([task.channel], worker_id=worker.id).all() == [
+        task
+    ]
+    task.state = models.TaskState.DONE
+    db.commit()
+    assert db.scalar(text("SELECT count(*) FROM bq_tasks_active")) == 0
+    assert db.scalar(select(func.count()).select_from(models.Task)) == 1
+    assert db.scalar(text("SELECT count(*) FROM bq_tasks_finished")) == 1
+
+
+@pytest.mark.parametrize("partitioned_tables", ["state"], indirect=True)
+def test_state_partitions_storage(db: Session, partitioned_tables: None):
+    def get_options(name: str) -> list[str] | None:
+        return db.scalar(
+            text("SELECT reloptions FROM pg_class WHERE relname = :name"),
+            dict(name=name),
+        )
+
+    assert get_options("bq_tasks_active") == [
+        "fillfactor=70",
+        "autovacuum_vacuum_scale_factor=0.0",
+    ]
+    assert get_options("bq_tasks_finished") == [
+        "autovacuum_vacuum_insert_threshold=100000"
+    ]
+    # no index on the state, so that claiming tasks can be HOT updates
+    index_columns = db.scalars(
+        text(
+            "SELECT a.attname FROM pg_index i "
+            "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            "WHERE i.indrelid = 'bq_tasks_active'::regclass AND NOT i.indisprimary"
+        )
+    ).all()
+    assert "state" not in index_columns
+    assert "channel" in index_columns
+
+
+def test_set_storage_parameters_invalid(partition_service: PartitionService):
+    with pytest.raises(ValueError):
+        partition_service.set_storage_parameters(
+            "bq_tasks", {"fillfactor = 10); DROP TABLE bq_tasks; --": 1}
+        )
+
+
+def test_make_table_with_dedup_key(db: Session):
+    partition_service = PartitionService(db, task_model=DedupTask)
+    table = partition_service.make_table(DedupTask.__table__, "state", MetaData())
+    (index,) = [index for index in table.indexes if index.unique]
+    assert [column.name for column in index.columns] == ["dedup_key", "state"]
+    # unique indexes of a partitioned table have to include the partition column
+    with pytest.raises(ValueError):
+        partition_service.make_table(DedupTask.__table__, "created_at", MetaData())
@@ -0,0 +1,170 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from ...factories import TaskFactory
+from bq import models
+from bq.services.queue_depth import QueueDepthService
+
+
+@pytest.fixture
+def queue_depth_service(db: Session) -> QueueDepthService:
+    return QueueDepthService(db)
+
+
+def test_install_counts_existing_tasks(
+    db: Session, queue_depth_service: QueueDepthService, task_factory: TaskFactory
+):
+    task_factory(channel="images")
+    task_factory(channel="images")
+    task_factory(channel="images", state=models.TaskState.DONE)
+    task_factory(channel="emails")
+
+    queue_depth_service.install(shards=4)
+    db.commit()
+
+    assert queue_depth_service.get_depth() == {
+        "images": {models.TaskState.PENDING: 2, models.TaskState.DONE: 1},
+        "emails": {models.TaskState.PENDING: 1},
+    }
+    assert queue_depth_service.get_depth(["emails"]) == {
+        "emails": {models.TaskState.PENDING: 1},
+    }
+
+
+def test_triggers(
+    db: Session, queue_depth_service: QueueDepthService, task_factory: TaskFactory
+):
+    queue_depth_service.install(shards=4)
+    db.commit()
+
+    tasks = [task_factory(channel="images") for _ in range(3)]
+    assert queue_depth_service.get_depth() == {
+        "images": {models.TaskState.PENDING: 3},
+    }
+
+    tasks[0].state = models.TaskState.PROCESSING
+    tasks[1].state = models.TaskState.DONE
+    db.commit()
+    assert queue_depth_service.get_depth() == {
+        "images": {
+            models.TaskState.PENDING: 1,
+            models.TaskState.PROCESSING: 1,
+            models.TaskState.DONE: 1,
+        },
+    }
+
+    db.delete(tasks[1])
+    db.execute(
+        models.Task.__table__.update()
+        .where(models.Task.state == models.TaskState.PENDING)
+        .values(channel="videos")
+    )
+    db.commit()
+    assert queue_depth_service.get_depth() == {
+        "images": {
+            models.TaskState.PENDING: 0,
+            models.TaskState.PROCESSING: 1,
+            models.TaskState.DONE: 0,
+        },
+        "videos": {models.TaskState.PENDING: 1},
+    }
+
+
+def test_compact(
+    db: Session, queue_depth_service: QueueDepthService, task_factory: TaskFactory
+):
+    queue_depth_service.install(shards=4)
+    db.commit()
+    tasks = [task_factory(channel="images") for _ in range(3)]
+    for task in tasks:
+        task.state = models.TaskState.DONE
+    db.commit()
+    depth = queue_depth_service.get_depth()
+
+    assert queue_depth_service.compact()
+    db.commit()
+
+    assert queue_depth_service.get_depth() == {
+        "images": {models.TaskState.DONE: 3},
+    }
+    assert depth["images"][models.TaskState.DONE] == 3
+    assert (
+        db.scalar(
+            select(func.count())
+            .select_from(models.QueueDepth)
+            .where(models.QueueDepth.shard != 0)
+        )
+        == 0
+    )
+
+
+def test_compact_with_concurrent_insert(
+    db: Session,
+    engine: Engine,
+    queue_depth_service: QueueDepthService,
+    task_factory: TaskFactory,
+):
+    queue_depth_service.install(shards=1)
+    # a counter left in another shard, for example by an install with more shards
+    db.add(
+        models.QueueDepth(
+            channel="images", state=models.TaskState.PENDING.value, shard=5, count=2
+        )
+    )
+    db.commit()
+
+    with Session(bind=engine) as other_db:
+        # the trigger inserts the shard 0 counter, but the transaction is not committed yet
+        other_db.add(models.Task(channel="images", module="m", func_name="f"))
+        other_db.flush()
+
+        errors = []
+
+        def compact():
+            try:
+                with Session(bind=engine) as compact_db:
+                    assert QueueDepthService(compact_db).compact()
+                    compact_db.commit()
+            except Exception as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=compact)
+        thread.start()
+        # give the compaction time to block on the uncommitted shard 0 counter
+        time.sleep(0.5)
+        other_db.commit()
+        thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert errors == []
+    db.expire_all()
+    assert queue_depth_service.get_depth() == {
+        "images": {models.TaskState.PENDING: 3},
+    }
+    assert (
+        db.scalar(
+            select(func.count())
+            .select_from(models.QueueDepth)
+            .where(models.QueueDepth.shard != 0)
+        )
+        == 0
+    )
+
+
+def test_uninstall(
+    db: Session, queue_depth_service: QueueDepthService, task_factory: TaskFactory
+):
+    queue_depth_service.install(shards=4)
+    db.commit()
+    queue_depth_service.uninstall()
+    db.commit()
+
+    task_factory(channel="images")
+
+    assert queue_depth_service.get_depth() == {}
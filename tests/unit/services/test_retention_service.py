@@ -0,0 +1,239 @@
+import datetime
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ...factories import EventFactory
+from ...factories import TaskFactory
+from bq import models
+from bq.processors.processor import Processor
+from bq.services.retention import CompactionRule
+from bq.services.retention import make_compaction_rules
+from bq.services.retention import make_retention_rules
+from bq.services.retention import RetentionRule
+from bq.services.retention import RetentionService
+
+
+@pytest.fixture
+def retention_service(db: Session) -> RetentionService:
+    return RetentionService(db)
+
+
+def test_make_retention_rules():
+    assert make_retention_rules(None, {}) == []
+    assert make_retention_rules(60, {"emails": 10, "audit": None}) == [
+        RetentionRule(seconds=10, channel="emails"),
+        RetentionRule(seconds=60, exclude_channels=("audit", "emails")),
+    ]
+
+
+def test_remove_batch(
+    db: Session,
+    retention_service: RetentionService,
+    task_factory: TaskFactory,
+    event_factory: EventFactory,
+):
+    now = db.scalar(func.now())
+    old = now - datetime.timedelta(hours=2)
+    old_done = task_factory(
+        channel="images", state=models.TaskState.DONE, created_at=old
+    )
+    old_failed = task_factory(
+        channel="images", state=models.TaskState.FAILED, created_at=old
+    )
+    event_factory(task=old_done)
+    event_factory(task=old_failed, type=models.EventType.FAILED)
+    old_pending = task_factory(
+        channel="images", state=models.TaskState.PENDING, created_at=old
+    )
+    new_done = task_factory(channel="images", state=models.TaskState.DONE)
+    other_channel = task_factory(
+        channel="audit", state=models.TaskState.DONE, created_at=old
+    )
+    task_ids = [old_pending.id, new_done.id, other_channel.id]
+
+    rule = RetentionRule(seconds=3600, exclude_channels=("audit",))
+    counts = retention_service.remove_batch(rule, limit=1)
+    assert counts.tasks == 1
+    assert counts.events == 1
+    counts = retention_service.remove_batch(rule, limit=10)
+    assert counts.tasks == 1
+    assert counts.events == 1
+    db.commit()
+    assert retention_service.remove_batch(rule, limit=10).tasks == 0
+
+    assert frozenset(db.scalars(select(models.Task.id))) == frozenset(task_ids)
+    assert db.scalar(select(func.count()).select_from(models.Event)) == 0
+
+
+def test_remove_batch_keeps_parents(
+    db: Session, retention_service: RetentionService, task_factory: TaskFactory
+):
+    now = db.scalar(func.now())
+    old = now - datetime.timedelta(hours=2)
+    parent = task_factory(state=models.TaskState.DONE, created_at=old)
+    task_factory(state=models.TaskState.DONE, created_at=old, parent=parent)
+    parent_id = parent.id
+    rule = RetentionRule(seconds=3600)
+
+    counts = retention_service.remove_batch(rule, limit=10)
+    db.commit()
+    assert counts.tasks == 1
+    assert db.scalars(select(models.Task.id)).all() == [parent_id]
+
+    counts = retention_service.remove_batch(rule, limit=10)
+    db.commit()
+    assert counts.tasks == 1
+    assert db.scalars(select(models.Task.id)).all() == []
+
+
+def test_remove_batch_archive_tables(
+    db: Session,
+    retention_service: RetentionService,
+    task_factory: TaskFactory,
+    event_factory: EventFactory,
+):
+    retention_service.create_archive_tables("_archive")
+    db.commit()
+    try:
+        now = db.scalar(func.now())
+        task = task_factory(
+            state=models.TaskState.DONE,
+            created_at=now - datetime.timedelta(hours=2),
+            kwargs=dict(key="value"),
+        )
+        event_factory(task=task)
+        task_id = task.id
+        counts = retention_service.remove_batch(
+            RetentionRule(seconds=3600), limit=10, archive_suffix="_archive"
+        )
+        db.commit()
+        assert counts.tasks == 1
+        assert counts.events == 1
+        assert db.scalar(select(func.count()).select_from(models.Task)) == 0
+        assert db.execute(
+            text("SELECT id, state, kwargs FROM bq_tasks_archive")
+        ).all() == [(task_id, "DONE", dict(key="value"))]
+        assert db.scalar(text("SELECT task_id FROM bq_events_archive")) == task_id
+    finally:
+        db.rollback()
+        db.execute(text("DROP TABLE bq_events_archive, bq_tasks_archive"))
+        db.commit()
+
+
+def test_remove_batch_writer(
+    db: Session, retention_service: RetentionService, task_factory: TaskFactory
+):
+    now = db.scalar(func.now())
+    task = task_factory(
+        state=models.TaskState.DONE, created_at=now - datetime.timedelta(hours=2)
+    )
+    task_id = task.id
+    rows = []
+    counts = retention_service.remove_batch(
+        RetentionRule(seconds=3600),
+        limit=10,
+        writer=lambda table, row: rows.append((table, row)),
+    )
+    db.commit()
+    assert counts.tasks == 1
+    assert [(table, row["id"], row["state"]) for table, row in rows] == [
+        ("bq_tasks", task_id, models.TaskState.DONE)
+    ]
+
+
+def test_make_compaction_rules():
+    processors = [
+        Processor(
+            channel="images",
+            module="my.tasks",
+            name="resize",
+            func=lambda: None,
+            keep_result_for=60,
+            keep_kwargs_for=0,
+        ),
+        Processor(channel="images", module="my.tasks", name="crop", func=lambda: None),
+    ]
+    assert make_compaction_rules(processors) == [
+        CompactionRule(
+            seconds=60,
+            column="result",
+            channel="images",
+            module="my.tasks",
+            func_name="resize",
+        ),
+        CompactionRule(
+            seconds=0,
+            column="kwargs",
+            channel="images",
+            module="my.tasks",
+            func_name="resize",
+        ),
+    ]
+
+
+def test_compact_batch(
+    db: Session,
+    retention_service: RetentionService,
+    task_factory: TaskFactory,
+):
+    now = db.scalar(func.now())
+    old = now - datetime.timedelta(hours=2)
+
+    def make_task(**kwargs) -> models.Task:
+        return task_factory(
+            **(
+                dict(
+                    channel="images",
+                    module="my.tasks",
+                    func_name="resize",
+                    state=models.TaskState.DONE,
+                    created_at=old,
+                    kwargs=dict(size=1),
+                    result=dict(url="image.png"),
+                )
+                | kwargs
+            )
+        )
+
+    old_tasks = [make_task() for _ in range(3)]
+    kept_tasks = [
+        make_task(created_at=now),
+        make_task(state=models.TaskState.FAILED),
+        make_task(func_name="crop"),
+        make_task(channel="audit"),
+    ]
+    old_ids = [task.id for task in old_tasks]
+    kept_ids = [task.id for task in kept_tasks]
+
+    rule = CompactionRule(
+        seconds=3600,
+        column="result",
+        channel="images",
+        module="my.tasks",
+        func_name="resize",
+    )
+    assert retention_service.compact_batch(rule, limit=2) == 2
+    assert retention_service.compact_batch(rule, limit=2) == 1
+    assert retention_service.compact_batch(rule, limit=2) == 0
+    db.commit()
+
+    rows = dict(
+        db.execute(
+            text("SELECT id, result IS NULL FROM bq_tasks WHERE kwargs IS NOT NULL")
+        ).all()
+    )
+    assert rows == {task_id: True for task_id in old_ids} | {
+        task_id: False for task_id in kept_ids
+    }
+
+
+def test_compact_batch_invalid_column(retention_service: RetentionService):
+    rule = CompactionRule(
+        seconds=60, column="channel", channel="images", module="my", func_name="f"
+    )
+    with pytest.raises(ValueError):
+        retention_service.compact_batch(rule, limit=10)
@@ -0,0 +1,165 @@
+import datetime
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..fixtures.models import DedupTask
+from bq import models
+from bq.processors.processor import Processor
+from bq.processors.processor import ProcessorHelper
+from bq.services.submit import SubmitService
+from bq.services.worker import WorkerService
+
+
+@pytest.fixture
+def submit_service(db: Session) -> SubmitService:
+    return SubmitService(db, task_model=DedupTask)
+
+
+@pytest.fixture
+def reindex() -> ProcessorHelper:
+    processor = Processor(
+        channel="accounts",
+        module="my.tasks",
+        name="reindex",
+        func=lambda account_id: account_id,
+    )
+    return ProcessorHelper(processor, task_cls=DedupTask)
+
+
+def get_pending(db: Session) -> list[DedupTask]:
+    return db.scalars(
+        select(DedupTask).where(DedupTask.state == models.TaskState.PENDING)
+    ).all()
+
+
+def test_submit(db: Session, submit_service: SubmitService, reindex: ProcessorHelper):
+    task_ids = submit_service.submit(
+        [
+            reindex.run(account_id=42, dedup_key="account-42"),
+            reindex.run(account_id=42, dedup_key="account-42"),
+            reindex.run(account_id=7, dedup_key="account-7"),
+            reindex.run(account_id=7),
+        ]
+    )
+    db.commit()
+    assert len(task_ids) == 3
+    pending = get_pending(db)
+    assert frozenset(task.id for task in pending) == frozenset(task_ids)
+    assert sorted(
+        (task.dedup_key or "", task.kwargs["account_id"]) for task in pending
+    ) == [
+        ("", 7),
+        ("account-42", 42),
+        ("account-7", 7),
+    ]
+
+    # collapsed into the pending task
+    assert (
+        submit_service.submit([reindex.run(account_id=42, dedup_key="account-42")])
+        == []
+    )
+    db.commit()
+    assert len(get_pending(db)) == 3
+
+    # a new pending task once the previous one is being processed
+    task = next(task for task in pending if task.dedup_key == "account-42")
+    task.state = models.TaskState.PROCESSING
+    db.commit()
+    assert (
+        len(submit_service.submit([reindex.run(account_id=42, dedup_key="account-42")]))
+        == 1
+    )
+    db.commit()
+    assert len(get_pending(db)) == 3
+
+
+def test_submit_debounce(
+    db: Session, submit_service: SubmitService, reindex: ProcessorHelper
+):
+    now = db.scalar(func.now())
+    debounce = datetime.timedelta(minutes=5)
+    (task_id,) = submit_service.submit(
+        [reindex.run(account_id=42, dedup_key="account-42")], debounce=debounce
+    )
+    db.commit()
+    task = db.get(DedupTask, task_id)
+    assert task.scheduled_at == now + debounce
+
+    now = db.scalar(func.now())
+    assert submit_service.submit(
+        [reindex.run(account_id=42, dedup_key="account-42")], debounce=debounce
+    ) == [task_id]
+    db.commit()
+    db.expire_all()
+    assert task.scheduled_at == now + debounce
+    assert len(get_pending(db)) == 1
+
+
+def test_submit_without_dedup(db: Session):
+    processor = Processor(
+        channel="accounts", module="my.tasks", name="reindex", func=lambda: None
+    )
+    helper = ProcessorHelper(processor)
+    task_ids = SubmitService(db).submit([helper.run(), helper.run()])
+    db.commit()
+    assert len(task_ids) == 2
+    with pytest.raises(ValueError):
+        helper.run(dedup_key="account-42")
+
+
+def test_retry_clears_dedup_key(db: Session, submit_service: SubmitService):
+    def reindex(account_id: int):
+        raise ValueError("boom")
+
+    processor = Processor(
+        channel="accounts",
+        module="my.tasks",
+        name="reindex",
+        func=reindex,
+        retry_policy=lambda task: func.now(),
+    )
+    helper = ProcessorHelper(processor, task_cls=DedupTask)
+    (task_id,) = submit_service.submit(
+        [helper.run(account_id=42, dedup_key="account-42")]
+    )
+    db.commit()
+    task = db.get(DedupTask, task_id)
+    task.state = models.TaskState.PROCESSING
+    db.commit()
+    submit_service.submit([helper.run(account_id=42, dedup_key="account-42")])
+    db.commit()
+
+    processor.process(task)
+    db.commit()
+    assert task.state == models.TaskState.PENDING
+    assert task.dedup_key is None
+    assert len(get_pending(db)) == 2
+
+
+def test_reschedule_clears_dedup_key(
+    db: Session,
+    submit_service: SubmitService,
+    reindex: ProcessorHelper,
+    worker: models.Worker,
+):
+    (task_id,) = submit_service.submit(
+        [reindex.run(account_id=42, dedup_key="account-42")]
+    )
+    db.commit()
+    task = db.get(DedupTask, task_id)
+    task.state = models.TaskState.PROCESSING
+    task.worker_id = worker.id
+    db.commit()
+    submit_service.submit([reindex.run(account_id=42, dedup_key="account-42")])
+    db.commit()
+
+    worker_service = WorkerService(db, task_model=DedupTask)
+    assert worker_service.reschedule_dead_tasks([worker.id]) == 1
+    db.commit()
+    db.expire_all()
+    assert task.state == models.TaskState.PENDING
+    assert task.dedup_key is None
+    assert len(get_pending(db)) == 2
@@ -0,0 +1,48 @@
+import typing
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ...factories import TaskFactory
+from ...factories import WorkerFactory
+from bq.services.uuid7 import UUID7Service
+
+
+@pytest.fixture
+def uuid7_service(db: Session) -> typing.Generator[UUID7Service, None, None]:
+    service = UUID7Service(db)
+    service.install()
+    db.commit()
+    yield service
+    db.rollback()
+    service.uninstall()
+    db.commit()
+
+
+def test_generate(db: Session, uuid7_service: UUID7Service):
+    now = db.scalar(func.now())
+    ids = [uuid7_service.generate() for _ in range(10)]
+    for value in ids:
+        assert value.version == 7
+        assert value.variant == "specified in RFC 4122"
+        timestamp = int.from_bytes(value.bytes[:6]) / 1000
+        assert timestamp == pytest.approx(now.timestamp(), abs=5)
+    assert len(set(ids)) == len(ids)
+
+
+def test_install_defaults(
+    db: Session,
+    uuid7_service: UUID7Service,
+    task_factory: TaskFactory,
+    worker_factory: WorkerFactory,
+):
+    assert task_factory().id.version == 7
+    assert worker_factory().id.version == 7
+
+    db.rollback()
+    uuid7_service.uninstall()
+    db.commit()
+    assert task_factory().id.version == 4
+    uuid7_service.install()
+    db.commit()
@@ -0,0 +1,92 @@
+import datetime
+import json
+import math
+
+import pytest
+from sqlalchemy.orm import Session
+
+from bq import models
+from bq.app import BeanQueue
+from bq.benchmark.processors import make_registry
+from bq.benchmark.processors import noop
+from bq.benchmark.runner import Benchmark
+from bq.benchmark.runner import BenchmarkResult
+from bq.benchmark.runner import BenchmarkSettings
+from bq.benchmark.runner import percentile
+from bq.config import Config
+
+
+@pytest.mark.parametrize(
+    "values, percent, expected",
+    [
+        ([], 50, math.nan),
+        ([3.0], 99, 3.0),
+        ([5.0, 1.0, 4.0, 2.0, 3.0], 50, 3.0),
+        (list(map(float, range(1, 101))), 99, 99.0),
+        (list(map(float, range(1, 101))), 100, 100.0),
+    ],
+)
+def test_percentile(values: list[float], percent: float, expected: float):
+    if math.isnan(expected):
+        assert math.isnan(percentile(values, percent))
+    else:
+        assert percentile(values, percent) == expected
+
+
+def test_make_registry():
+    registry = make_registry("bench-channel")
+    modules = registry.processors["bench-channel"]
+    assert modules["bq.benchmark.processors"].keys() == {"noop", "sleep", "burn"}
+
+
+def test_result_to_dict_without_done_tasks():
+    result = BenchmarkResult(
+        settings=BenchmarkSettings(),
+        done=0,
+        failed=3,
+        elapsed=math.nan,
+        throughput=math.nan,
+        enqueue_to_start_p50=percentile([], 50),
+        enqueue_to_start_p99=percentile([], 99),
+        enqueue_to_finish_p50=percentile([], 50),
+        enqueue_to_finish_p99=percentile([], 99),
+    )
+    data = result.to_dict()
+    assert data["throughput"] is None
+    assert data["enqueue_to_finish_p99"] is None
+    assert data["failed"] == 3
+    # valid JSON without NaN
+    json.dumps(data, allow_nan=False)
+
+
+def test_timings_from_one_clock():
+    timings = noop(submitted=100.0)
+    assert timings["submitted"] == 100.0
+    assert timings["submitted"] <= timings["started"] <= timings["finished"]
+
+
+def test_collect_ignores_database_clock(db: Session, db_url: str):
+    app = BeanQueue(config=Config(DATABASE_URL=db_url))
+    # the database clock is an hour ahead of the host submitting and processing the tasks
+    created_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        hours=1
+    )
+    for index in range(3):
+        db.add(
+            models.Task(
+                channel="bench-channel",
+                module="bq.benchmark.processors",
+                func_name="noop",
+                state=models.TaskState.DONE,
+                created_at=created_at,
+                result=dict(submitted=100.0, started=101.0 + index, finished=103.0),
+            )
+        )
+    db.commit()
+
+    result = Benchmark(app)._collect("bench-channel", BenchmarkSettings())
+
+    assert result.done == 3
+    assert result.elapsed == 3.0
+    assert result.enqueue_to_start_p50 == 2.0
+    assert result.enqueue_to_finish_p99 == 3.0
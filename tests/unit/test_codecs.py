@@ -0,0 +1,159 @@
+import hashlib
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from bq import models
+from bq.codecs import decode_value
+from bq.codecs import encode_value
+from bq.codecs import EncodedJSONB
+from bq.codecs import ENVELOPE_KEY
+from bq.codecs import get_codec
+from bq.codecs import get_envelope_codec
+from bq.codecs import make_json_serializers
+from bq.codecs import with_codec
+from bq.processors.processor import Processor
+from bq.processors.processor import ProcessorHelper
+
+VALUE = dict(
+    name="image.png",
+    sizes=[16, 32, 64],
+    options=dict(quality=0.8, lossless=False, watermark=None),
+)
+LARGE_VALUE = dict(
+    rows=[
+        dict(index=index, digest=hashlib.sha256(str(index).encode()).hexdigest())
+        for index in range(100)
+    ]
+)
+
+
+@pytest.mark.parametrize("name", ["json", "msgpack", "json+zstd", "msgpack+zstd"])
+def test_codec_round_trip(name: str):
+    codec = get_codec(name)
+    assert codec.name == name
+    assert codec.decode(codec.encode(VALUE)) == VALUE
+
+
+@pytest.mark.parametrize("name", ["pickle", "json+gzip", "json+zstd+zstd"])
+def test_invalid_codec(name: str):
+    with pytest.raises(ValueError):
+        get_codec(name)
+
+
+def test_plain_json_envelope_codec():
+    # the payload store keeps the plain JSON bytes, but an envelope would only make it larger
+    assert get_codec("json").name == "json"
+    assert get_envelope_codec("json+zstd").name == "json+zstd"
+    with pytest.raises(ValueError):
+        get_envelope_codec("json")
+    with pytest.raises(ValueError):
+        EncodedJSONB(codec="json")
+    with pytest.raises(ValueError):
+        Processor(
+            channel="mock-channel",
+            module="mock.module",
+            name="my_func",
+            func=lambda: None,
+            codec="json",
+        )
+
+
+def test_encode_value():
+    codec = get_codec("msgpack+zstd")
+    # small values are kept as plain JSON
+    assert encode_value(VALUE, codec, min_size=1024) == VALUE
+    encoded = encode_value(LARGE_VALUE, codec, min_size=1024)
+    assert encoded[ENVELOPE_KEY] == "msgpack+zstd"
+    assert len(encoded["data"]) < len(make_json_serializers("json")[0](LARGE_VALUE))
+    assert decode_value(encoded) == LARGE_VALUE
+    assert decode_value(VALUE) == VALUE
+
+
+@pytest.mark.parametrize("name", ["json", "orjson"])
+def test_json_serializers(name: str):
+    dumps, loads = make_json_serializers(name)
+    assert loads(dumps(VALUE)) == VALUE
+
+
+def test_processor_codec(db: Session):
+    def func(rows: list):
+        return dict(rows=rows)
+
+    processor = Processor(
+        channel="mock-channel",
+        module="mock.module",
+        name="my_func",
+        func=func,
+        codec="msgpack+zstd",
+    )
+    task = ProcessorHelper(processor).run(**LARGE_VALUE)
+    assert task.kwargs == LARGE_VALUE
+    db.add(task)
+    db.commit()
+
+    raw_kwargs = db.scalar(
+        text("SELECT kwargs FROM bq_tasks WHERE id = :id"), dict(id=task.id)
+    )
+    assert raw_kwargs[ENVELOPE_KEY] == "msgpack+zstd"
+    # only decoded where it's used
+    kwargs = db.scalar(select(models.Task.kwargs).where(models.Task.id == task.id))
+    assert kwargs == raw_kwargs
+    assert decode_value(kwargs) == LARGE_VALUE
+
+    processor.process(task)
+    db.commit()
+    raw_result = db.scalar(
+        text("SELECT result FROM bq_tasks WHERE id = :id"), dict(id=task.id)
+    )
+    assert raw_result[ENVELOPE_KEY] == "msgpack+zstd"
+    db.expire_all()
+    assert decode_value(task.result) == LARGE_VALUE
+
+    # the envelope read from the row is written back as it is
+    other_task = models.Task(
+        channel="mock-channel",
+        module="mock.module",
+        func_name="my_func",
+        kwargs=task.result,
+    )
+    db.add(other_task)
+    db.commit()
+    db.expire_all()
+    assert decode_value(other_task.kwargs) == LARGE_VALUE
+
+
+@pytest.mark.parametrize("task__state", [models.TaskState.PROCESSING])
+def test_process_corrupted_kwargs(db: Session, task: models.Task):
+    db.execute(
+        text("UPDATE bq_tasks SET kwargs = CAST(:kwargs AS JSONB) WHERE id = :id"),
+        dict(
+            kwargs=f'{{"{ENVELOPE_KEY}": "msgpack", "data": "bm90IG1zZ3BhY2s="}}',
+            id=task.id,
+        ),
+    )
+    db.commit()
+    processor = Processor(
+        channel="mock-channel",
+        module="mock.module",
+        name="my_func",
+        func=lambda **kwargs: kwargs,
+    )
+    processor.process(task)
+    db.commit()
+    db.expire_all()
+    assert task.state == models.TaskState.FAILED
+
+
+def test_plain_json_rows(db: Session, task: models.Task):
+    # rows written without any codec are read as they are
+    db.execute(
+        text("UPDATE bq_tasks SET kwargs = CAST(:kwargs AS JSONB) WHERE id = :id"),
+        dict(kwargs='{"key": "value"}', id=task.id),
+    )
+    db.commit()
+    db.expire_all()
+    assert task.kwargs == dict(key="value")
+    assert with_codec("value", "msgpack") == "value"
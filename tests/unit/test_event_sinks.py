@@ -0,0 +1,185 @@
+import datetime
+import json
+import pathlib
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from ..factories import TaskFactory
+from bq import models
+from bq.app import BeanQueue
+from bq.config import Config
+from bq.event_sinks import BufferedEventSink
+from bq.event_sinks import DatabaseEventSink
+from bq.event_sinks import EventRecord
+from bq.event_sinks import LogFileEventSink
+from bq.event_sinks import SampledEventSink
+from bq.processors.processor import Processor
+from bq.processors.retry_policies import DelayRetry
+from bq.processors.retry_policies import LimitAttempt
+from bq.services.completion import Completion
+from bq.services.completion import CompletionService
+
+
+def make_processor(func=lambda: "result", **kwargs) -> Processor:
+    return Processor(
+        channel="mock-channel",
+        module="mock.module",
+        name="my_func",
+        func=func,
+        **kwargs,
+    )
+
+
+def get_event_types(db: Session, task_id) -> list[models.EventType]:
+    return db.scalars(
+        select(models.Event.type)
+        .where(models.Event.task_id == task_id)
+        .order_by(models.Event.created_at)
+    ).all()
+
+
+@pytest.mark.parametrize("task__state", [models.TaskState.PROCESSING])
+def test_database_sink(db: Session, task: models.Task):
+    make_processor().process(
+        task, event_cls=models.Event, event_sink=DatabaseEventSink()
+    )
+    db.commit()
+    assert get_event_types(db, task.id) == [models.EventType.COMPLETE]
+
+
+@pytest.mark.parametrize("task__state", [models.TaskState.PROCESSING])
+def test_sampled_sink_records_failures(db: Session, task: models.Task):
+    def func():
+        raise ValueError("boom")
+
+    processor = make_processor(
+        func=func,
+        retry_policy=LimitAttempt(3, DelayRetry(datetime.timedelta(0))),
+    )
+    sink = SampledEventSink(DatabaseEventSink(), rate=0)
+    for _ in range(3):
+        processor.process(task, event_cls=models.Event, event_sink=sink)
+        db.commit()
+    # the attempts are counted from the failure events, which are never sampled
+    assert get_event_types(db, task.id) == [
+        models.EventType.FAILED_RETRY_SCHEDULED,
+        models.EventType.FAILED_RETRY_SCHEDULED,
+        models.EventType.FAILED,
+    ]
+    assert task.state == models.TaskState.FAILED
+
+    task.state = models.TaskState.PROCESSING
+    make_processor().process(task, event_cls=models.Event, event_sink=sink)
+    db.commit()
+    assert models.EventType.COMPLETE not in get_event_types(db, task.id)
+
+
+def test_sampled_sink_rate():
+    class RecordingSink(DatabaseEventSink):
+        def add(self, db: Session, records):
+            added.extend(records)
+
+    added = []
+    values = iter([0.1, 0.6, 0.4, 0.9])
+    sink = SampledEventSink(RecordingSink(), rate=0.5, random_func=lambda: next(values))
+    records = [
+        EventRecord(task_id=index, type=models.EventType.COMPLETE) for index in range(4)
+    ]
+    sink.add(None, records)
+    assert added == [records[0], records[2]]
+    with pytest.raises(ValueError):
+        SampledEventSink(RecordingSink(), rate=2)
+
+
+def test_buffered_sink(db: Session, engine: Engine, task_factory: TaskFactory):
+    app = BeanQueue(engine=engine)
+    sink = BufferedEventSink(make_session=app.make_session, max_size=2, interval=60)
+    sink.start()
+    committed = [task_factory(state=models.TaskState.PROCESSING) for _ in range(3)]
+    rolled_back = task_factory(state=models.TaskState.PROCESSING)
+    for task in committed:
+        make_processor().process(task, event_sink=sink)
+    db.commit()
+    make_processor().process(rolled_back, event_sink=sink)
+    db.rollback()
+    sink.shutdown()
+
+    for task in committed:
+        assert get_event_types(db, task.id) == [models.EventType.COMPLETE]
+    assert get_event_types(db, rolled_back.id) == []
+
+
+@pytest.mark.parametrize("task__state", [models.TaskState.PROCESSING])
+def test_logfile_sink(db: Session, task: models.Task, tmp_path: pathlib.Path):
+    path = tmp_path / "events.ndjson"
+    sink = LogFileEventSink(path)
+    processor = make_processor()
+    processor.process(task, event_cls=models.Event, event_sink=sink)
+    # a savepoint rolled back later in the same transaction keeps the event
+    with pytest.raises(ValueError):
+        with db.begin_nested():
+            raise ValueError("boom")
+    assert not path.read_text()
+    db.commit()
+    sink.shutdown()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(line["task_id"], line["type"]) for line in lines] == [
+        (str(task.id), "COMPLETE")
+    ]
+    # not inserted into the database
+    assert get_event_types(db, task.id) == []
+
+
+def test_completion_service_with_sink(
+    db: Session,
+    tmp_path: pathlib.Path,
+    worker: models.Worker,
+    task_factory: TaskFactory,
+):
+    path = tmp_path / "events.ndjson"
+    sink = LogFileEventSink(path)
+    tasks = [
+        task_factory(state=models.TaskState.PROCESSING, worker=worker) for _ in range(2)
+    ]
+    other_task = task_factory(state=models.TaskState.PROCESSING)
+    count = CompletionService(db, event_sink=sink).complete(
+        [Completion(task_id=task.id, result="done") for task in tasks + [other_task]],
+        worker_id=worker.id,
+    )
+    db.commit()
+    sink.shutdown()
+
+    assert count == 2
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert frozenset(line["task_id"] for line in lines) == frozenset(
+        str(task.id) for task in tasks
+    )
+    assert get_event_types(db, tasks[0].id) == []
+
+
+def test_make_event_sink(tmp_path: pathlib.Path):
+    assert BeanQueue(config=Config()).make_event_sink() is None
+    assert (
+        BeanQueue(
+            config=Config(EVENT_MODEL=None, EVENT_SINK="buffered")
+        ).make_event_sink()
+        is None
+    )
+    assert isinstance(
+        BeanQueue(config=Config(EVENT_SINK="buffered")).make_event_sink(),
+        BufferedEventSink,
+    )
+    sink = BeanQueue(config=Config(EVENT_SAMPLE_RATE=0.1)).make_event_sink()
+    assert isinstance(sink, SampledEventSink)
+    assert isinstance(sink.sink, DatabaseEventSink)
+    with pytest.raises(ValueError):
+        BeanQueue(config=Config(EVENT_SINK="logfile")).make_event_sink()
+    sink = BeanQueue(
+        config=Config(EVENT_SINK="logfile", EVENT_SINK_PATH=str(tmp_path / "events"))
+    ).make_event_sink()
+    assert isinstance(sink, LogFileEventSink)
+    sink.shutdown()
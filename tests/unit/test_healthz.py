@@ -1,4 +1,5 @@
 import asyncio
+import time
 from unittest.mock import MagicMock
 
 import pytest
@@ -6,6 +7,7 @@ from starlette.testclient import TestClient
 
 from bq import events
 from bq.app import BeanQueue
+from bq.config import Config
 from bq.metrics import MetricsExtrasNotInstalledError
 from bq.metrics import MetricsServer
 from bq.metrics import require_metrics_extras
@@ -118,8 +120,122 @@ def test_healthz_endpoint(metrics_server: MetricsServer):
     assert response.json()["status"] == "ok"
 
 
+def test_metrics_endpoint(metrics_server: MetricsServer):
+    client = TestClient(metrics_server.create_app())
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE bq_tasks_claimed_total counter" in response.text
+    assert "# TYPE bq_task_processing_seconds histogram" in response.text
+
+
+def test_profile_endpoint_disabled(metrics_server: MetricsServer):
+    client = TestClient(metrics_server.create_app())
+    response = client.get("/debug/profile?seconds=0.01")
+
+    assert response.status_code == 404
+
+
+def test_profile_endpoint(app_with_worker: BeanQueue):
+    app_with_worker.config = Config(METRICS_PROFILE_ENABLED=True)
+    metrics_server = MetricsServer(app_with_worker, "worker-1")
+    client = TestClient(metrics_server.create_app())
+
+    response = client.get("/debug/profile?seconds=0.05")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    assert client.get("/debug/profile?seconds=abc").status_code == 400
+    assert client.get("/debug/profile?seconds=3600").status_code == 400
+
+
+def test_check_healthz_slow_tasks(app_with_worker: BeanQueue):
+    app_with_worker.config = Config(SLOW_TASK_UNHEALTHY=True)
+    app_with_worker._watchdog = MagicMock()
+    app_with_worker._watchdog.slow_tasks = [MagicMock(task_id="task-1")]
+    metrics_server = MetricsServer(app_with_worker, "worker-1")
+
+    ok, body = asyncio.run(metrics_server.check_healthz())
+
+    assert ok is False
+    assert body == {"status": "slow tasks", "slow_tasks": ["task-1"]}
+
+
 def test_require_metrics_extras_missing(monkeypatch: pytest.MonkeyPatch):
     monkeypatch.setattr("bq.metrics.find_spec", lambda name: None)
 
     with pytest.raises(MetricsExtrasNotInstalledError, match="beanqueue\\[metrics\\]"):
         require_metrics_extras()
+
+
+def test_get_healthz_cache(app_with_worker: BeanQueue, monkeypatch: pytest.MonkeyPatch):
+    app_with_worker.config = Config(METRICS_HEALTHZ_CACHE_TTL=60)
+    metrics_server = MetricsServer(app_with_worker, "worker-1")
+    calls = []
+
+    @events.healthz_check.connect
+    def _check(sender, worker, session):
+        calls.append(worker)
+
+    try:
+
+        async def run():
+            first = await metrics_server.get_healthz()
+            second = await metrics_server.get_healthz()
+            return first, second
+
+        first, second = asyncio.run(run())
+        monkeypatch.setattr(metrics_server, "_healthz_expires_at", 0)
+        third = asyncio.run(metrics_server.get_healthz())
+    finally:
+        events.healthz_check.disconnect(_check)
+
+    assert first == second == third
+    assert first[0] is True
+    assert len(calls) == 2
+
+
+def test_get_healthz_single_flight(metrics_server: MetricsServer):
+    calls = []
+
+    @events.healthz_check.connect
+    async def _check(sender, worker, session):
+        calls.append(worker)
+        await asyncio.sleep(0.05)
+
+    try:
+
+        async def run():
+            return await asyncio.gather(
+                *(metrics_server.get_healthz() for _ in range(5))
+            )
+
+        results = asyncio.run(run())
+    finally:
+        events.healthz_check.disconnect(_check)
+
+    assert len(calls) == 1
+    assert all(ok for ok, _ in results)
+    # without TTL, the next request checks again
+    assert asyncio.run(metrics_server.get_healthz())[0] is True
+
+
+def test_livez_endpoint(app_with_worker: BeanQueue):
+    app_with_worker.config = Config(METRICS_LIVEZ_MAX_HEARTBEAT_AGE=10)
+    metrics_server = MetricsServer(app_with_worker, "worker-1")
+    client = TestClient(metrics_server.create_app())
+
+    response = client.get("/livez")
+    assert response.status_code == 500
+    assert response.json() == {"status": "no heartbeat yet"}
+
+    app_with_worker._last_heartbeat_at = time.monotonic()
+    response = client.get("/livez")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+
+    app_with_worker._last_heartbeat_at = time.monotonic() - 11
+    response = client.get("/livez")
+    assert response.status_code == 500
+    assert response.json()["status"] == "heartbeat too old"
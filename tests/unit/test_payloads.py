@@ -0,0 +1,322 @@
+import datetime
+import pathlib
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy import null
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..factories import TaskFactory
+from .fixtures.models import DedupTask
+from bq import models
+from bq import payloads
+from bq.app import BeanQueue
+from bq.config import Config
+from bq.payloads import FilesystemPayloadStore
+from bq.payloads import load_payload
+from bq.payloads import open_payload
+from bq.payloads import PayloadStore
+from bq.payloads import REFERENCE_KEY
+from bq.payloads import TablePayloadStore
+from bq.processors.processor import Processor
+from bq.processors.processor import ProcessorHelper
+from bq.services.completion import Completion
+from bq.services.completion import CompletionService
+from bq.services.dispatch import DispatchService
+from bq.services.retention import CompactionRule
+from bq.services.retention import RetentionRule
+from bq.services.retention import RetentionService
+from bq.services.submit import SubmitService
+
+LARGE_KWARGS = dict(rows=[f"row-{index}" for index in range(100)])
+
+
+@pytest.fixture(params=["table", "filesystem"])
+def payload_store(
+    request: pytest.FixtureRequest,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: pathlib.Path,
+    db: Session,
+) -> PayloadStore:
+    monkeypatch.setattr(payloads, "_stores", {})
+    monkeypatch.setattr(payloads, "_offloading", None)
+    if request.param == "table":
+        store = TablePayloadStore()
+    else:
+        store = FilesystemPayloadStore(tmp_path)
+    payloads.configure_payload_store(store, threshold=100)
+    return store
+
+
+def get_raw(db: Session, task_id, column: str = "kwargs", table: str = "bq_tasks"):
+    return db.scalar(
+        text(f"SELECT {column} FROM {table} WHERE id = :id"), dict(id=task_id)
+    )
+
+
+def count_payloads(db: Session, store: PayloadStore) -> int:
+    if isinstance(store, TablePayloadStore):
+        return db.scalar(select(func.count()).select_from(models.Payload))
+    return sum(1 for path in store.root.rglob("*") if path.is_file())
+
+
+def test_offload(db: Session, payload_store: PayloadStore, task_factory: TaskFactory):
+    small = task_factory(kwargs=dict(key="value"))
+    large = task_factory(kwargs=LARGE_KWARGS)
+
+    assert get_raw(db, small.id) == dict(key="value")
+    reference = get_raw(db, large.id)
+    assert reference[REFERENCE_KEY] == payload_store.name
+    assert reference["codec"] == "json"
+    assert load_payload(db.connection(), reference) == LARGE_KWARGS
+    assert load_payload(db.connection(), dict(key="value")) == dict(key="value")
+
+
+def test_process(db: Session, payload_store: PayloadStore, task_factory: TaskFactory):
+    task = task_factory(kwargs=LARGE_KWARGS, state=models.TaskState.PROCESSING)
+    processor = Processor(
+        channel=task.channel,
+        module=task.module,
+        name=task.func_name,
+        func=lambda rows: dict(rows=list(reversed(rows))),
+    )
+    processor.process(task)
+    db.commit()
+
+    reference = get_raw(db, task.id, "result")
+    assert reference[REFERENCE_KEY] == payload_store.name
+    assert load_payload(db.connection(), reference) == dict(
+        rows=list(reversed(LARGE_KWARGS["rows"]))
+    )
+
+
+@pytest.mark.parametrize("stream_payload", [False, True])
+def test_process_missing_payload(
+    db: Session,
+    payload_store: PayloadStore,
+    task_factory: TaskFactory,
+    stream_payload: bool,
+):
+    task = task_factory(kwargs=LARGE_KWARGS, state=models.TaskState.PROCESSING)
+    payload_store.remove(db.connection(), task.kwargs["key"])
+    db.commit()
+
+    def func(payload=None, rows=None):
+        return "done"
+
+    processor = Processor(
+        channel=task.channel,
+        module=task.module,
+        name=task.func_name,
+        func=func,
+        stream_payload=stream_payload,
+    )
+    processor.process(task, event_cls=models.Event)
+    db.commit()
+    db.expire_all()
+    assert task.state == models.TaskState.FAILED
+    assert task.error_message
+    assert [event.type for event in task.events] == [models.EventType.FAILED]
+
+
+def test_process_stream_payload(
+    db: Session, payload_store: PayloadStore, task_factory: TaskFactory
+):
+    task = task_factory(kwargs=LARGE_KWARGS, state=models.TaskState.PROCESSING)
+
+    def func(payload) -> int:
+        return len(payload.read())
+
+    processor = Processor(
+        channel=task.channel,
+        module=task.module,
+        name=task.func_name,
+        func=func,
+        stream_payload=True,
+    )
+    with open_payload(db.connection(), task.kwargs) as file:
+        size = len(file.read())
+    assert processor.process(task) == size
+
+
+def test_stream_table_payload_in_chunks(
+    db: Session, task_factory: TaskFactory, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(payloads, "_stores", {})
+    monkeypatch.setattr(payloads, "_offloading", None)
+    monkeypatch.setattr(payloads, "TABLE_CHUNK_SIZE", 7)
+    payloads.configure_payload_store(TablePayloadStore(), threshold=100)
+    task = task_factory(kwargs=LARGE_KWARGS)
+
+    with open_payload(db.connection(), task.kwargs) as file:
+        chunks = iter(lambda: file.read(5), b"")
+        data = b"".join(chunks)
+    assert data == payloads.get_codec("json").encode(LARGE_KWARGS)
+
+
+def test_delete_with_task(
+    db: Session, payload_store: PayloadStore, task_factory: TaskFactory
+):
+    task = task_factory(kwargs=LARGE_KWARGS)
+    reference = task.kwargs
+    db.delete(task)
+    db.commit()
+    with pytest.raises((KeyError, FileNotFoundError)):
+        load_payload(db.connection(), reference)
+
+
+def test_delete_with_retention(
+    db: Session, payload_store: PayloadStore, task_factory: TaskFactory
+):
+    now = db.scalar(func.now())
+    task = task_factory(
+        kwargs=LARGE_KWARGS,
+        state=models.TaskState.DONE,
+        created_at=now - datetime.timedelta(hours=2),
+    )
+    reference = task.kwargs
+    counts = RetentionService(db).remove_batch(RetentionRule(seconds=3600), limit=10)
+    db.commit()
+    assert counts.tasks == 1
+    assert db.scalar(select(func.count()).select_from(models.Payload)) == 0
+    with pytest.raises((KeyError, FileNotFoundError)):
+        load_payload(db.connection(), reference)
+
+
+def test_remove_replaced(
+    db: Session, payload_store: PayloadStore, task_factory: TaskFactory
+):
+    task = task_factory(kwargs=LARGE_KWARGS)
+    reference = task.kwargs
+    task.kwargs = dict(key="value")
+    db.commit()
+    with pytest.raises((KeyError, FileNotFoundError)):
+        load_payload(db.connection(), reference)
+
+
+@pytest.mark.parametrize("new_result", [dict(key="value"), None, null()])
+def test_remove_replaced_deferred(
+    db: Session,
+    payload_store: PayloadStore,
+    task_factory: TaskFactory,
+    new_result,
+):
+    task = task_factory(result=LARGE_KWARGS)
+    task_id = task.id
+    assert count_payloads(db, payload_store) == 1
+    db.expunge_all()
+
+    # loaded without the result like the dispatched tasks
+    (task,) = DispatchService(db).make_load_query([task_id]).all()
+    task.result = new_result
+    db.commit()
+    assert count_payloads(db, payload_store) == 0
+
+
+def test_remove_replaced_buffered(
+    db: Session,
+    payload_store: PayloadStore,
+    task_factory: TaskFactory,
+    worker: models.Worker,
+):
+    task = task_factory(
+        state=models.TaskState.PROCESSING, worker=worker, result=LARGE_KWARGS
+    )
+    other_task = task_factory(state=models.TaskState.PROCESSING, result=LARGE_KWARGS)
+    assert count_payloads(db, payload_store) == 2
+    CompletionService(db).complete(
+        [
+            Completion(task_id=task.id, result=dict(key="value")),
+            # not processed by the worker anymore, keeps its result
+            Completion(task_id=other_task.id, result=dict(key="value")),
+        ],
+        worker_id=worker.id,
+    )
+    db.commit()
+    assert count_payloads(db, payload_store) == 1
+    assert load_payload(db.connection(), other_task.result) == LARGE_KWARGS
+
+
+def test_remove_with_compaction(
+    db: Session, payload_store: PayloadStore, task_factory: TaskFactory
+):
+    now = db.scalar(func.now())
+    task = task_factory(
+        kwargs=LARGE_KWARGS,
+        result=LARGE_KWARGS,
+        state=models.TaskState.DONE,
+        created_at=now - datetime.timedelta(hours=2),
+    )
+    kwargs_reference = task.kwargs
+    result_reference = task.result
+    rule = CompactionRule(
+        seconds=3600,
+        column="result",
+        channel=task.channel,
+        module=task.module,
+        func_name=task.func_name,
+    )
+    assert RetentionService(db).compact_batch(rule, limit=10) == 1
+    db.commit()
+    assert get_raw(db, task.id, "result") is None
+    with pytest.raises((KeyError, FileNotFoundError)):
+        load_payload(db.connection(), result_reference)
+    assert load_payload(db.connection(), kwargs_reference) == LARGE_KWARGS
+
+
+def test_submit(db: Session, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(payloads, "_stores", {})
+    monkeypatch.setattr(payloads, "_offloading", None)
+    payloads.configure_payload_store(TablePayloadStore(), threshold=100)
+    processor = Processor(
+        channel="rows", module="my.tasks", name="sum_rows", func=lambda rows: None
+    )
+    helper = ProcessorHelper(processor, task_cls=DedupTask)
+    (task_id,) = SubmitService(db, task_model=DedupTask).submit(
+        [helper.run(dedup_key="rows", **LARGE_KWARGS) for _ in range(2)]
+    )
+    db.commit()
+
+    reference = get_raw(db, task_id, table=DedupTask.__tablename__)
+    assert load_payload(db.connection(), reference) == LARGE_KWARGS
+    assert (
+        SubmitService(db, task_model=DedupTask).submit(
+            [helper.run(dedup_key="rows", **LARGE_KWARGS)]
+        )
+        == []
+    )
+    db.commit()
+    # the payload of the duplicate is removed along with it
+    assert db.scalar(select(func.count()).select_from(models.Payload)) == 1
+
+
+def test_make_payload_store(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(payloads, "_stores", {})
+    monkeypatch.setattr(payloads, "_offloading", None)
+    with pytest.raises(ValueError):
+        BeanQueue(config=Config(PAYLOAD_STORE="filesystem"))
+    app = BeanQueue(
+        config=Config(PAYLOAD_STORE="filesystem", PAYLOAD_STORE_PATH=str(tmp_path))
+    )
+    store = app.make_payload_store()
+    assert isinstance(store, FilesystemPayloadStore)
+    assert store.root == tmp_path.resolve()
+
+
+def test_complete_buffered(
+    db: Session,
+    payload_store: PayloadStore,
+    task_factory: TaskFactory,
+    worker: models.Worker,
+):
+    task = task_factory(state=models.TaskState.PROCESSING, worker=worker)
+    CompletionService(db).complete(
+        [Completion(task_id=task.id, result=LARGE_KWARGS)], worker_id=worker.id
+    )
+    db.commit()
+
+    reference = get_raw(db, task.id, "result")
+    assert reference[REFERENCE_KEY] == payload_store.name
+    assert load_payload(db.connection(), reference) == LARGE_KWARGS
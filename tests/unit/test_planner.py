@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from bq.config import Config
+from bq.planner import ConcurrencyPlan
+from bq.planner import make_concurrency_plan
+from bq.planner import validate_concurrency_plan
+
+
+@pytest.mark.parametrize(
+    "config, expected",
+    [
+        (
+            Config(MAX_WORKER_THREADS=1, BATCH_SIZE=5),
+            ConcurrencyPlan(
+                worker_threads=1,
+                max_in_flight=5,
+                prefetch=5,
+                pool_size=None,
+                pool_max_overflow=0,
+            ),
+        ),
+        (
+            Config(MAX_WORKER_THREADS=0, BATCH_SIZE=1),
+            ConcurrencyPlan(
+                worker_threads=10,
+                max_in_flight=10,
+                prefetch=1,
+                pool_size=15,
+                pool_max_overflow=10,
+            ),
+        ),
+        (
+            Config(MAX_WORKER_THREADS=4, BATCH_SIZE=100, DB_POOL_MAX_OVERFLOW=2),
+            ConcurrencyPlan(
+                worker_threads=4,
+                max_in_flight=4,
+                prefetch=4,
+                pool_size=9,
+                pool_max_overflow=2,
+            ),
+        ),
+    ],
+)
+def test_make_concurrency_plan(config: Config, expected: ConcurrencyPlan):
+    assert make_concurrency_plan(config) == expected
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        Config(MAX_WORKER_THREADS=-1),
+        Config(BATCH_SIZE=0),
+    ],
+)
+def test_make_concurrency_plan_invalid(config: Config):
+    with pytest.raises(ValueError):
+        make_concurrency_plan(config)
+
+
+def test_plan_max_connections():
+    assert make_concurrency_plan(Config(MAX_WORKER_THREADS=1)).max_connections == 3
+    assert (
+        make_concurrency_plan(
+            Config(MAX_WORKER_THREADS=8, DB_POOL_MAX_OVERFLOW=3)
+        ).max_connections
+        == 8 + 5 + 3
+    )
+
+
+def test_validate_concurrency_plan(db: Session):
+    plan = make_concurrency_plan(Config(MAX_WORKER_THREADS=1))
+    assert validate_concurrency_plan(plan, db) >= 1
+    with pytest.raises(ValueError):
+        validate_concurrency_plan(
+            make_concurrency_plan(
+                Config(MAX_WORKER_THREADS=100_000, DB_POOL_MAX_OVERFLOW=0)
+            ),
+            db,
+        )
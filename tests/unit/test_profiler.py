@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from bq import events
+from bq.processors.processor import Processor
+from bq.profiler import ProfilerBusyError
+from bq.profiler import SamplingProfiler
+
+
+def busy_processor_func(stop: threading.Event):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_sample():
+    processor = Processor(
+        channel="images",
+        module="my_module",
+        name="resize",
+        func=busy_processor_func,
+    )
+    profiler = SamplingProfiler(interval=0.001)
+    started = threading.Event()
+    stop = threading.Event()
+
+    def run():
+        # wait for the profiler to connect to the signals
+        while not events.task_started.receivers:
+            time.sleep(0.001)
+        events.task_started.send(None, task=None, processor=processor)
+        started.set()
+        busy_processor_func(stop)
+        events.task_completed.send(None, task=None, processor=processor)
+
+    thread = threading.Thread(target=run, name="task_worker_0")
+    thread.start()
+    try:
+        stacks = profiler.sample(0.2)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert started.is_set()
+    worker_stacks = [stack for stack in stacks if stack.startswith("task_worker_0;")]
+    assert worker_stacks
+    assert any(
+        stack.startswith("task_worker_0;images:my_module.resize;")
+        and "busy_processor_func" in stack
+        for stack in worker_stacks
+    )
+    # the receivers are disconnected after profiling
+    assert not events.task_started.receivers
+    assert not events.task_completed.receivers
+
+
+def test_profile_busy():
+    profiler = SamplingProfiler(interval=0.001)
+    thread = threading.Thread(target=profiler.sample, args=(0.2,))
+    thread.start()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(ProfilerBusyError):
+            profiler.profile(0.01)
+    finally:
+        thread.join()
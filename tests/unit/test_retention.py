@@ -0,0 +1,94 @@
+import datetime
+import io
+import json
+
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from ..factories import TaskFactory
+from bq import models
+from bq.app import BeanQueue
+from bq.retention import NDJSONWriter
+from bq.retention import Retention
+from bq.services.retention import CompactionRule
+from bq.services.retention import RETENTION_LOCK_KEY
+from bq.services.retention import RetentionRule
+
+
+def test_run(db: Session, engine: Engine, task_factory: TaskFactory):
+    now = db.scalar(func.now())
+    task_ids = [
+        task_factory(
+            state=models.TaskState.DONE, created_at=now - datetime.timedelta(hours=2)
+        ).id
+        for _ in range(5)
+    ]
+    kept_id = task_factory(state=models.TaskState.DONE).id
+    output = io.StringIO()
+    retention = Retention(
+        BeanQueue(engine=engine),
+        rules=[RetentionRule(seconds=3600)],
+        batch_size=2,
+        batch_interval=0,
+        writer=NDJSONWriter(output),
+    )
+
+    counts = retention.run()
+    assert counts.tasks == 5
+    assert db.scalars(select(models.Task.id)).all() == [kept_id]
+    lines = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert frozenset(line["row"]["id"] for line in lines) == frozenset(
+        str(task_id) for task_id in task_ids
+    )
+    assert {line["table"] for line in lines} == {"bq_tasks"}
+    assert {line["row"]["state"] for line in lines} == {"DONE"}
+
+
+def test_run_locked(db: Session, engine: Engine):
+    retention = Retention(BeanQueue(engine=engine), rules=[RetentionRule(seconds=1)])
+    with engine.connect() as conn:
+        conn.scalar(select(func.pg_advisory_lock(RETENTION_LOCK_KEY)))
+        try:
+            assert retention.run() is None
+        finally:
+            conn.scalar(select(func.pg_advisory_unlock(RETENTION_LOCK_KEY)))
+    assert retention.run() is not None
+
+
+def test_run_compaction(db: Session, engine: Engine, task_factory: TaskFactory):
+    now = db.scalar(func.now())
+    task_ids = [
+        task_factory(
+            state=models.TaskState.DONE,
+            created_at=now - datetime.timedelta(hours=2),
+            module="my.tasks",
+            func_name="resize",
+            channel="images",
+            kwargs=dict(size=index),
+        ).id
+        for index in range(5)
+    ]
+    retention = Retention(
+        BeanQueue(engine=engine),
+        rules=[],
+        batch_size=2,
+        batch_interval=0,
+        compaction_rules=[
+            CompactionRule(
+                seconds=3600,
+                column="kwargs",
+                channel="images",
+                module="my.tasks",
+                func_name="resize",
+            )
+        ],
+    )
+
+    counts = retention.run()
+    assert counts.compacted == 5
+    assert counts.tasks == 0
+    assert frozenset(
+        db.scalars(select(models.Task.id).where(models.Task.kwargs.is_(None)))
+    ) == frozenset(task_ids)
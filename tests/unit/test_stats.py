@@ -0,0 +1,57 @@
+import threading
+
+from bq.stats import Metric
+from bq.stats import Stats
+
+
+def test_counter_across_threads():
+    stats = Stats()
+    counter = stats.define(Metric("my_total", "counter", "My counter", ("channel",)))
+
+    def run():
+        for _ in range(1000):
+            stats.inc(counter, ("default",))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.inc(counter, ("other",), 2)
+
+    assert stats.get(counter, ("default",)) == 4000
+    assert stats.get(counter, ("other",)) == 2
+
+
+def test_render():
+    stats = Stats()
+    counter = stats.define(Metric("my_total", "counter", "My counter", ("channel",)))
+    histogram = stats.define(
+        Metric("my_seconds", "histogram", "My histogram", buckets=(0.1, 1.0))
+    )
+    gauge = stats.define(Metric("my_gauge", "gauge", "My gauge"))
+    stats.inc(counter, ('quote"d',))
+    stats.observe(histogram, 0.05)
+    stats.observe(histogram, 0.5)
+    stats.observe(histogram, 5)
+    stats.set(gauge, 0.5)
+
+    assert stats.get(histogram) == 3
+    assert stats.render() == "\n".join(
+        [
+            "# HELP my_total My counter",
+            "# TYPE my_total counter",
+            'my_total{channel="quote\\"d"} 1',
+            "# HELP my_seconds My histogram",
+            "# TYPE my_seconds histogram",
+            'my_seconds_bucket{le="0.1"} 1',
+            'my_seconds_bucket{le="1"} 2',
+            'my_seconds_bucket{le="+Inf"} 3',
+            "my_seconds_sum 5.55",
+            "my_seconds_count 3",
+            "# HELP my_gauge My gauge",
+            "# TYPE my_gauge gauge",
+            "my_gauge 0.5",
+            "",
+        ]
+    )
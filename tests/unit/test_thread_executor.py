@@ -1,11 +1,19 @@
 """Unit tests for thread executor configuration and pool management."""
 import pytest
+from sqlalchemy import event
 from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 from sqlalchemy.pool import QueuePool
 from sqlalchemy.pool import SingletonThreadPool
 
+from . import fixtures
+from ..factories import TaskFactory
 import bq
+from bq import models
 from bq.config import Config
+from bq.processors.registry import collect
+from bq.services.dispatch import DeferredColumnLoader
+from bq.services.dispatch import DispatchService
 
 
 def test_default_pool_is_singleton(db_url: str):
@@ -125,3 +133,131 @@ def test_config_batch_size_with_threads():
     )
     assert config.MAX_WORKER_THREADS == 8
     assert config.BATCH_SIZE == 20
+
+
+def test_process_task_in_thread_without_reloading(
+    db: Session, engine: Engine, db_url: str, task_factory: TaskFactory
+):
+    """Test that worker threads merge the claimed task instead of querying it again."""
+    app = bq.BeanQueue(
+        config=Config(DATABASE_URL=db_url, MAX_WORKER_THREADS=4), engine=engine
+    )
+    registry = collect([fixtures])
+    task = task_factory(
+        state=models.TaskState.PROCESSING,
+        channel="mock-channel",
+        module="tests.unit.fixtures.processors",
+        func_name="processor0",
+    )
+    db.refresh(task)
+    db.expunge(task)
+
+    statements: list[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        app._process_task_in_thread(task, registry)
+        thread_db = app._get_thread_session()
+        # the same session is reused by the same thread
+        app._process_task_in_thread(thread_db.merge(task, load=False), registry)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        app._close_thread_sessions()
+
+    assert not [
+        statement for statement in statements if statement.startswith("SELECT")
+    ]
+    db.expire_all()
+    processed_task = db.get(models.Task, task.id)
+    assert processed_task.state == models.TaskState.DONE
+    assert processed_task.result == "processed by processor0"
+
+
+def test_process_task_in_thread_with_deferred_kwargs(
+    db: Session, engine: Engine, db_url: str, task_factory: TaskFactory
+):
+    """Test that worker threads load the deferred kwargs of the whole batch with one query."""
+    app = bq.BeanQueue(
+        config=Config(DATABASE_URL=db_url, MAX_WORKER_THREADS=4), engine=engine
+    )
+    registry = collect([fixtures])
+    task_ids = []
+    for index in range(2):
+        task = task_factory(
+            state=models.TaskState.PROCESSING,
+            channel="mock-channel2",
+            module="tests.unit.fixtures.processors",
+            func_name="processor1",
+            kwargs=dict(kwarg0=f"value{index}"),
+        )
+        task_ids.append(task.id)
+    db.expunge_all()
+    tasks = DispatchService(db).make_load_query(task_ids, defer_kwargs=True).all()
+    db.expunge_all()
+    loader = DeferredColumnLoader(models.Task, "kwargs", task_ids)
+
+    statements: list[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for task in tasks:
+            app._process_task_in_thread(task, registry, kwargs_loader=loader)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        app._close_thread_sessions()
+
+    assert (
+        len([statement for statement in statements if statement.startswith("SELECT")])
+        == 1
+    )
+    db.expire_all()
+    assert [db.get(models.Task, task_id).result for task_id in task_ids] == [
+        "value0",
+        "value1",
+    ]
+
+
+def test_thread_session_identity_map_limit(
+    db: Session, engine: Engine, db_url: str, task_factory: TaskFactory
+):
+    """Test that thread sessions expunge all objects once the identity map grows too large."""
+    app = bq.BeanQueue(
+        config=Config(
+            DATABASE_URL=db_url,
+            MAX_WORKER_THREADS=4,
+            THREAD_SESSION_IDENTITY_MAP_LIMIT=0,
+        ),
+        engine=engine,
+    )
+    registry = collect([fixtures])
+    tasks = [
+        task_factory(
+            state=models.TaskState.PROCESSING,
+            channel="mock-channel",
+            module="tests.unit.fixtures.processors",
+            func_name="processor0",
+        )
+        for _ in range(2)
+    ]
+    for task in tasks:
+        db.refresh(task)
+        db.expunge(task)
+
+    try:
+        thread_db = app._get_thread_session()
+        # held by something else, so that the identity map won't release it
+        held_task = thread_db.merge(tasks[0], load=False)
+        thread_db.commit()
+        assert held_task in thread_db
+
+        app._process_task_in_thread(tasks[1], registry)
+        assert held_task not in thread_db
+        assert len(thread_db.identity_map) == 0
+    finally:
+        app._close_thread_sessions()
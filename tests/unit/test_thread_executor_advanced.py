@@ -1,4 +1,10 @@
 """Advanced unit tests for thread executor functionality."""
+import select
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
 import pytest
 from sqlalchemy.engine import create_engine
 from sqlalchemy.pool import QueuePool
@@ -6,6 +12,8 @@ from sqlalchemy.pool import SingletonThreadPool
 
 import bq
 from bq.config import Config
+from bq.services.dispatch import Notification
+from bq.utils import Waker
 
 
 def test_engine_recreation_with_different_config(db_url: str):
@@ -205,3 +213,134 @@ def test_custom_engine_override(db_url: str):
     assert app.engine is custom_engine
     assert isinstance(app.engine.pool, QueuePool)
     assert app.engine.pool.size() == 20
+
+
+class FakeDispatchService:
+    """Fake dispatch service returns the given batches of tasks, then nothing."""
+
+    def __init__(
+        self,
+        batches: list[list[typing.Any]],
+        duration: float,
+        notify_at: float | None = None,
+    ):
+        self.batches = batches
+        self.duration = duration
+        self.notify_at = notify_at
+        self.dispatch_calls = 0
+        self.begin = time.monotonic()
+
+    def dispatch(self, channels, worker_id, limit):
+        self.dispatch_calls += 1
+        tasks = self.batches.pop(0) if self.batches else []
+        assert len(tasks) <= limit
+        query = MagicMock()
+        query.all.return_value = tasks
+        return query
+
+    def poll(self, timeout: int, waker: Waker):
+        elapsed = time.monotonic() - self.begin
+        if elapsed >= self.duration:
+            raise KeyboardInterrupt()
+        deadline = self.duration
+        if self.notify_at is not None:
+            deadline = min(self.notify_at, deadline)
+        ready, _, _ = select.select([waker], [], [], min(timeout, deadline - elapsed))
+        if ready:
+            waker.drain()
+            return
+        if timeout < deadline - elapsed:
+            raise TimeoutError()
+        if deadline == self.notify_at:
+            self.notify_at = None
+            yield Notification(pid=0, channel="test")
+            return
+        raise KeyboardInterrupt()
+
+
+def run_threaded_loop(app: bq.BeanQueue, dispatch_service: FakeDispatchService):
+    executor = ThreadPoolExecutor(max_workers=app.config.MAX_WORKER_THREADS)
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            app._process_tasks_threaded(
+                db=MagicMock(),
+                executor=executor,
+                dispatch_service=dispatch_service,
+                listen_service=dispatch_service,
+                registry=MagicMock(),
+                channels=("test",),
+                worker_id="worker",
+            )
+    finally:
+        executor.shutdown(wait=True)
+
+
+def test_threaded_loop_idle_dispatch_rate(monkeypatch: pytest.MonkeyPatch):
+    """Test that no dispatch query is made while threads are busy and the queue is drained."""
+    app = bq.BeanQueue(
+        config=Config(MAX_WORKER_THREADS=2, BATCH_SIZE=1, POLL_TIMEOUT=60)
+    )
+    processed = []
+
+    def process_task(task, registry):
+        time.sleep(0.5)
+        processed.append(task)
+
+    monkeypatch.setattr(app, "_process_task_in_thread", process_task)
+    dispatch_service = FakeDispatchService(batches=[["task0"]], duration=1.0)
+    run_threaded_loop(app, dispatch_service)
+
+    assert processed == ["task0"]
+    # The first dispatch gets a full batch, the second one finds the queue drained. Neither the running
+    # task nor its completion makes the loop query again within the one second.
+    assert dispatch_service.dispatch_calls == 2
+
+
+def test_threaded_loop_dispatch_on_notification(monkeypatch: pytest.MonkeyPatch):
+    """Test that notifications make the loop query for new tasks."""
+    app = bq.BeanQueue(
+        config=Config(MAX_WORKER_THREADS=2, BATCH_SIZE=2, POLL_TIMEOUT=60)
+    )
+    processed = []
+    monkeypatch.setattr(
+        app,
+        "_process_task_in_thread",
+        lambda task, registry: processed.append(task),
+    )
+    dispatch_service = FakeDispatchService(
+        batches=[[], ["task0"]], duration=0.5, notify_at=0.2
+    )
+    run_threaded_loop(app, dispatch_service)
+
+    assert processed == ["task0"]
+    assert dispatch_service.dispatch_calls == 2
+
+
+def test_threaded_loop_redispatch_while_completing(monkeypatch: pytest.MonkeyPatch):
+    """Test that completions waking up the loop don't push back the dispatch for scheduled tasks."""
+    app = bq.BeanQueue(
+        config=Config(MAX_WORKER_THREADS=8, BATCH_SIZE=8, POLL_TIMEOUT=1)
+    )
+    dispatched_at = []
+
+    def process_task(task, registry):
+        time.sleep(task)
+
+    monkeypatch.setattr(app, "_process_task_in_thread", process_task)
+    dispatch_service = FakeDispatchService(
+        # the tasks keep completing every 0.3 seconds
+        batches=[[0.3, 0.6, 0.9, 1.2, 1.5]],
+        duration=1.4,
+    )
+    dispatch = dispatch_service.dispatch
+
+    def record_dispatch(*args, **kwargs):
+        dispatched_at.append(time.monotonic() - dispatch_service.begin)
+        return dispatch(*args, **kwargs)
+
+    dispatch_service.dispatch = record_dispatch
+    run_threaded_loop(app, dispatch_service)
+
+    # dispatched again POLL_TIMEOUT after the first dispatch, not POLL_TIMEOUT after the last completion
+    assert len(dispatched_at) == 2
+    assert dispatched_at[1] == pytest.approx(1.0, abs=0.2)
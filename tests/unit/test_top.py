@@ -0,0 +1,37 @@
+import pytest
+
+from bq.cmds.top import compute_rates
+from bq.services.overview import ChannelOverview
+from bq.services.overview import Overview
+
+
+def make_overview(done: int | None, failed: int | None) -> Overview:
+    return Overview(
+        channels=[
+            ChannelOverview(
+                channel="images",
+                pending=0,
+                processing=0,
+                scheduled=0,
+                oldest_pending_age=None,
+                done=done,
+                failed=failed,
+            )
+        ],
+        workers=[],
+    )
+
+
+def test_compute_rates():
+    previous = make_overview(done=10, failed=1)
+    current = make_overview(done=30, failed=2)
+    assert compute_rates(None, current, elapsed=2) == {}
+    assert compute_rates(previous, current, elapsed=2) == {
+        "images": (pytest.approx(10), pytest.approx(0.5))
+    }
+
+
+def test_compute_rates_without_counters():
+    previous = make_overview(done=None, failed=None)
+    current = make_overview(done=None, failed=None)
+    assert compute_rates(previous, current, elapsed=1) == {}
@@ -0,0 +1,15 @@
+import time
+
+from bq.utils import uuid7
+
+
+def test_uuid7():
+    now = time.time()
+    ids = [uuid7() for _ in range(10_000)]
+    for value in ids[:10]:
+        assert value.version == 7
+        assert value.variant == "specified in RFC 4122"
+        assert abs(int.from_bytes(value.bytes[:6]) / 1000 - now) < 5
+    # strictly increasing even within the same millisecond
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
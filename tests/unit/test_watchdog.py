@@ -0,0 +1,118 @@
+import threading
+import time
+import types
+import uuid
+
+import pytest
+
+from bq import events
+from bq import stats
+from bq.processors.processor import Processor
+from bq.watchdog import Watchdog
+
+
+def make_task(func_name: str = "fetch"):
+    return types.SimpleNamespace(
+        id=uuid.uuid4(), channel="default", module="my_module", func_name=func_name
+    )
+
+
+def run_task(
+    processor: Processor | None,
+    task: types.SimpleNamespace,
+    started: threading.Event,
+    stop: threading.Event,
+):
+    events.task_started.send(
+        None, task=task, processor=processor, started_at=time.perf_counter()
+    )
+    started.set()
+    stop.wait(5)
+    events.task_completed.send(None, task=task, processor=processor)
+
+
+def test_watchdog_reports_slow_task():
+    processor = Processor(
+        channel="default",
+        module="my_module",
+        name="fetch",
+        func=lambda: None,
+        slow_threshold=0.01,
+    )
+    task = make_task()
+    watchdog = Watchdog(interval=60)
+    reports = []
+
+    @events.task_slow.connect
+    def on_slow(sender, running_task, elapsed, stack):
+        reports.append((running_task, elapsed, stack))
+
+    labels = ("default", "my_module", "fetch")
+    slow_count = stats.stats.get(stats.TASKS_SLOW, labels)
+    started = threading.Event()
+    stop = threading.Event()
+    watchdog.start()
+    thread = threading.Thread(
+        target=run_task, args=(processor, task, started, stop), name="task_worker_0"
+    )
+    thread.start()
+    try:
+        started.wait(5)
+        time.sleep(0.05)
+        watchdog.check()
+        # each slow task is only reported once
+        watchdog.check()
+        assert [running_task.task_id for running_task in watchdog.slow_tasks] == [
+            task.id
+        ]
+    finally:
+        stop.set()
+        thread.join()
+        watchdog.shutdown()
+        events.task_slow.disconnect(on_slow)
+
+    assert len(reports) == 1
+    running_task, elapsed, stack = reports[0]
+    assert running_task.task_id == task.id
+    assert elapsed >= 0.01
+    assert "run_task" in stack
+    assert stats.stats.get(stats.TASKS_SLOW, labels) == slow_count + 1
+    assert not watchdog.slow_tasks
+
+
+@pytest.mark.parametrize(
+    "default_slow_threshold, processor_slow_threshold, expected_watched",
+    [
+        (None, None, False),
+        (60, None, True),
+        (None, 60, True),
+    ],
+)
+def test_watchdog_slow_threshold(
+    default_slow_threshold: float | None,
+    processor_slow_threshold: float | None,
+    expected_watched: bool,
+):
+    processor = Processor(
+        channel="default",
+        module="my_module",
+        name="fetch",
+        func=lambda: None,
+        slow_threshold=processor_slow_threshold,
+    )
+    watchdog = Watchdog(default_slow_threshold=default_slow_threshold)
+    watchdog._on_task_started(
+        None, task=make_task(), processor=processor, started_at=time.perf_counter()
+    )
+    assert bool(watchdog._running_tasks) == expected_watched
+
+
+def test_processor_invalid_slow_threshold():
+    with pytest.raises(ValueError):
+        Processor(
+            channel="default",
+            module="my_module",
+            name="fetch",
+            func=lambda: None,
+            slow_threshold=0,
+        )